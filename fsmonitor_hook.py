@@ -0,0 +1,42 @@
+"""Хук core.fsmonitor (протокол версии 2) для репозиториев, отслеживаемых GitHub Auto-Commit Watcher.
+
+git запускает его в корне рабочей копии как `fsmonitor_hook.py [файл состояния] 2 <токен>`
+(файл состояния по умолчанию - STATE_FILE рядом с хуком). Хук спрашивает у
+запущенной программы, какие файлы изменились с момента токена, и печатает ответ для git.
+Если программа не запущена или папка не отслеживается, хук завершается с ошибкой - git
+в этом случае сам обходит все дерево.
+"""
+
+import os
+import sys
+import json
+import http.client
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fsmonitor_state.json")
+
+def main(argv):
+    args = argv[1:]
+    state_file = args.pop(0) if len(args) > 2 else STATE_FILE
+    if not args or args[0] != '2':
+        return 1
+    token = args[1] if len(args) > 1 else ''
+
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        body = json.dumps({'secret': state['secret'], 'root': os.getcwd(), 'token': token})
+        connection = http.client.HTTPConnection('127.0.0.1', state['port'], timeout=5)
+        connection.request('POST', '/fsmonitor', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        answer = response.read()
+    except Exception:
+        return 1
+    if response.status != 200:
+        return 1
+
+    sys.stdout.buffer.write(answer)
+    sys.stdout.flush()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,42 +1,30 @@
+import sys
+
+# Headless-режим не должен загружать tkinter, поэтому переключаемся до импорта виджетов
+if __name__ == "__main__" and "--daemon" in sys.argv[1:]:
+    from watcher_daemon import main as daemon_main
+    sys.exit(daemon_main(sys.argv[1:]))
+
 import os
 import time
-import json
 import threading
 import shutil
-import requests
-import sys
+import queue
 from pathlib import Path
+from collections import deque
 from tkinter import *
 from tkinter import ttk, messagebox, filedialog, simpledialog
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from git import Repo, GitCommandError
-
-class ChangeHandler(FileSystemEventHandler):
-    def __init__(self, folder_name, callback):
-        self.folder_name = folder_name
-        self.callback = callback
-        self.changes_detected = False
-
-    def on_modified(self, event):
-        if not event.is_directory:
-            self.changes_detected = True
-            self.callback(self.folder_name)
-
-    def on_created(self, event):
-        if not event.is_directory:
-            self.changes_detected = True
-            self.callback(self.folder_name)
-
-    def on_deleted(self, event):
-        if not event.is_directory:
-            self.changes_detected = True
-            self.callback(self.folder_name)
+from git import Repo
+from watcher_core import WatcherEngine, GitHubError, SharedRepoStore
 
 class GitHubBrowser:
-    def __init__(self, parent, on_select_callback):
+    def __init__(self, parent, on_select_callback, client, store_mode=None):
         self.parent = parent
         self.on_select_callback = on_select_callback
+        self.client = client
+        # store_mode(repo_url) - режим уже загруженного хранилища remote или None
+        self.store_mode = store_mode
+        self.existing_mode = None
         self.repo_url = ""
         self.branches = []
         self.token = ""
@@ -44,7 +32,7 @@ class GitHubBrowser:
     def show(self):
         self.window = Toplevel(self.parent)
         self.window.title("Обзор GitHub репозитория")
-        self.window.geometry("600x500")
+        self.window.geometry("600x670")
         self.window.transient(self.parent)
         self.window.grab_set()
         
@@ -89,6 +77,45 @@ class GitHubBrowser:
         ttk.Button(branch_frame, text="Создать ветку", 
                   command=self.create_new_branch).pack(side=LEFT)
         
+        # Режим клонирования (применяется, когда хранилище remote создается впервые)
+        mode_frame = ttk.LabelFrame(self.window, text="Режим клонирования")
+        mode_frame.pack(fill=X, padx=10, pady=5)
+        
+        self.mode_note_var = StringVar(value="Режим применяется, когда репозиторий клонируется впервые")
+        ttk.Label(mode_frame, textvariable=self.mode_note_var, font=("Arial", 8), foreground="gray",
+                  wraplength=560).pack(anchor=W, padx=5)
+        
+        self.partial_var = BooleanVar(value=False)
+        partial_check = ttk.Checkbutton(mode_frame, text="Partial clone: старые версии файлов скачиваются по требованию",
+                                        variable=self.partial_var)
+        partial_check.pack(anchor=W, padx=5)
+        
+        depth_frame = ttk.Frame(mode_frame)
+        depth_frame.pack(fill=X, padx=5)
+        self.shallow_var = BooleanVar(value=False)
+        shallow_check = ttk.Checkbutton(depth_frame, text="Shallow: только последние коммиты, штук:",
+                                        variable=self.shallow_var)
+        shallow_check.pack(side=LEFT)
+        self.depth_var = IntVar(value=1)
+        depth_spinbox = ttk.Spinbox(depth_frame, from_=1, to=100000, textvariable=self.depth_var, width=8)
+        depth_spinbox.pack(side=LEFT, padx=5)
+        
+        self.single_branch_var = BooleanVar(value=False)
+        single_branch_check = ttk.Checkbutton(mode_frame, text="Только выбранная ветка",
+                                              variable=self.single_branch_var)
+        single_branch_check.pack(anchor=W, padx=5)
+        
+        reference_frame = ttk.Frame(mode_frame)
+        reference_frame.pack(fill=X, padx=5, pady=(0, 5))
+        ttk.Label(reference_frame, text="Локальный reference-репозиторий:").pack(side=LEFT)
+        self.reference_var = StringVar()
+        reference_entry = ttk.Entry(reference_frame, textvariable=self.reference_var)
+        reference_entry.pack(side=LEFT, padx=5, fill=X, expand=True)
+        reference_button = ttk.Button(reference_frame, text="Обзор...", command=self.choose_reference)
+        reference_button.pack(side=LEFT)
+        self.mode_widgets = [partial_check, shallow_check, depth_spinbox, single_branch_check,
+                             reference_entry, reference_button]
+        
         # Buttons
         button_frame = ttk.Frame(self.window)
         button_frame.pack(fill=X, padx=10, pady=10)
@@ -120,44 +147,58 @@ class GitHubBrowser:
             repo = repo[:-4]
             
         self.repo_url = f"https://github.com/{owner}/{repo}.git"
-        api_url = f"https://api.github.com/repos/{owner}/{repo}"
+        if self.token:
+            # Update URL with token for private repos
+            self.repo_url = f"https://{self.token}@github.com/{owner}/{repo}.git"
         
         try:
-            # Prepare headers with token if provided
-            headers = {}
-            if self.token:
-                headers['Authorization'] = f'token {self.token}'
-                # Update URL with token for private repos
-                self.repo_url = f"https://{self.token}@github.com/{owner}/{repo}.git"
-            
             # Get repository info
-            repo_response = requests.get(api_url, headers=headers, timeout=10)
-            if repo_response.status_code == 401:
-                messagebox.showerror("Ошибка", "Неверный токен или недостаточно прав")
-                return
-            elif repo_response.status_code == 403:
-                messagebox.showerror("Ошибка", "Превышен лимит запросов. Используйте токен для увеличения лимита.")
-                return
-            elif repo_response.status_code == 404:
-                messagebox.showerror("Ошибка", "Репозиторий не найден. Возможно, он приватный и нужен токен.")
-                return
-            elif repo_response.status_code != 200:
-                messagebox.showerror("Ошибка", f"Ошибка доступа: {repo_response.status_code}")
+            try:
+                self.client.get_repository(owner, repo, self.token)
+            except GitHubError as e:
+                if e.status == 401:
+                    messagebox.showerror("Ошибка", "Неверный токен или недостаточно прав")
+                elif e.status in (403, 429):
+                    messagebox.showerror("Ошибка", "Превышен лимит запросов. Используйте токен для увеличения лимита.")
+                elif e.status == 404:
+                    messagebox.showerror("Ошибка", "Репозиторий не найден. Возможно, он приватный и нужен токен.")
+                else:
+                    messagebox.showerror("Ошибка", f"Ошибка доступа: {e.status}")
                 return
             
-            # Get branches
-            branches_response = requests.get(f"{api_url}/branches", headers=headers, timeout=10)
-            if branches_response.status_code != 200:
+            # Get branches (все страницы)
+            try:
+                self.branches = self.client.list_branches(owner, repo, self.token)
+            except GitHubError:
                 messagebox.showerror("Ошибка", "Не удалось загрузить ветки")
                 return
                 
-            self.branches = [branch['name'] for branch in branches_response.json()]
             self.branches_listbox.delete(0, END)
             for branch in self.branches:
                 self.branches_listbox.insert(END, branch)
+            self.update_mode_section()
                 
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка загрузки: {str(e)}")
+
+    def update_mode_section(self):
+        """Хранилище репозитория уже загружено: его режим показывается, выбрать другой нельзя"""
+        self.existing_mode = self.store_mode(self.repo_url) if self.store_mode else None
+        mode = self.existing_mode
+        state = ['!disabled'] if mode is None else ['disabled']
+        for widget in self.mode_widgets:
+            widget.state(state)
+        if mode is None:
+            self.mode_note_var.set("Режим применяется, когда репозиторий клонируется впервые")
+            return
+        
+        self.partial_var.set(bool(mode['filter']))
+        self.shallow_var.set(bool(mode['depth']))
+        self.depth_var.set(mode['depth'] or 1)
+        self.single_branch_var.set(mode['single_branch'])
+        self.reference_var.set('')
+        self.mode_note_var.set(f"Репозиторий уже загружен в режиме \"{SharedRepoStore.describe_options(mode)}\": "
+                               f"новая папка создается из него, режим изменить нельзя")
             
     def create_new_branch(self):
         new_branch = self.new_branch_var.get().strip()
@@ -178,6 +219,33 @@ class GitHubBrowser:
         self.branches_listbox.selection_set(self.branches.index(new_branch))
         messagebox.showinfo("Успех", f"Ветка '{new_branch}' будет создана при скачивании")
 
+    def choose_reference(self):
+        path = filedialog.askdirectory(title="Локальный клон того же репозитория", parent=self.window)
+        if path:
+            self.reference_var.set(path)
+
+    def clone_options(self):
+        """Режим клонирования из формы (ключи SharedRepoStore.CLONE_OPTIONS); None - ошибка ввода"""
+        if self.existing_mode is not None:
+            # Режим задает существующее хранилище
+            return {}
+        options = {
+            'filter': 'blob:none' if self.partial_var.get() else '',
+            'depth': 0,
+            'single_branch': self.single_branch_var.get(),
+            'reference': self.reference_var.get().strip(),
+        }
+        if self.shallow_var.get():
+            try:
+                options['depth'] = max(1, int(self.depth_var.get()))
+            except (TclError, ValueError):
+                messagebox.showerror("Ошибка", "Глубина shallow clone должна быть числом")
+                return None
+        if options['reference'] and not os.path.isdir(options['reference']):
+            messagebox.showerror("Ошибка", "Reference-репозиторий не найден")
+            return None
+        return options
+
     def download_selected(self):
         selection = self.branches_listbox.curselection()
         branch = self.new_branch_var.get().strip()
@@ -188,41 +256,99 @@ class GitHubBrowser:
             
         if selection:
             branch = self.branches[selection[0]]
+        
+        options = self.clone_options()
+        if options is None:
+            return
             
         self.window.destroy()
-        self.on_select_callback(self.repo_url, branch)
+        self.on_select_callback(self.repo_url, branch, options)
+
+class UiDispatcher:
+    """Очередь вызовов для главного потока Tk.
+    
+    Фоновые потоки не обращаются к виджетам: они кладут вызовы в очередь, а цикл Tk
+    выполняет их пачками по таймеру after().
+    """
+
+    def __init__(self, root, interval_ms=50, batch_size=500):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.main_thread = threading.current_thread()
+        self.root.after(self.interval_ms, self.drain)
+
+    def post(self, func, *args):
+        """Выполнить func(*args) в главном потоке при следующем разборе очереди"""
+        self.queue.put((func, args))
+
+    def call(self, func, *args):
+        """В главном потоке - сразу, из фонового - через очередь"""
+        if threading.current_thread() is self.main_thread:
+            func(*args)
+        else:
+            self.post(func, *args)
+
+    def drain(self):
+        for _ in range(self.batch_size):
+            try:
+                func, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception:
+                self.root.report_callback_exception(*sys.exc_info())
+        self.root.after(self.interval_ms, self.drain)
 
 class GitWatcherGUI:
+    FILTER_ALL = "(все)"
+
     def __init__(self, root):
+        started = time.monotonic()
         self.root = root
         self.root.title("GitHub Auto-Commit Watcher - Multi-Branch")
         self.root.geometry("1000x700")
         
         self.config_file = "watcher_config.json"
-        self.watched_folders = {}
-        self.observers = []
-        
-        self.load_config()
+        self.ui = UiDispatcher(self.root)
+        self.pending_refresh = set()
+        self.pending_full_refresh = False
+        self.pending_head_changes = set()
+        self.refresh_posted = False
+        self.pending_lock = threading.Lock()
+        # Размер буфера известен до создания ядра: строки, которые ядро пишет при запуске, не теряются
+        self.log_max_lines = WatcherEngine.read_log_settings(self.config_file)['max_lines']
+        self.log_buffer = deque(maxlen=self.log_max_lines)
+        self.log_file = None
         self.create_widgets()
+        
+        self.engine = WatcherEngine(self.config_file, log=self.log_message)
+        try:
+            self.log_file = self.engine.open_log_file()
+        except OSError as e:
+            self.log_message(f"Не удалось открыть файл лога: {str(e)}")
+        self.flush_log()
+        self.engine.add_listener(self.on_engine_update)
+        self.watched_folders = self.engine.watched_folders
         self.start_monitoring()
+        self.log_message(f"Окно готово за {time.monotonic() - started:.2f} с, "
+                         f"репозитории загружаются в фоне ({len(self.watched_folders)})")
         
         # Проверка обновлений при запуске (через 3 секунды)
         self.root.after(3000, self.check_self_update_on_start)
 
     def check_self_update_on_start(self):
         """Проверка обновлений при запуске"""
-        try:
-            def update_check():
-                if self.check_self_update():
-                    if messagebox.askyesno("Обновление", "Перезапустить программу сейчас?"):
-                        self.restart_program()
-            
-            threading.Thread(target=update_check, daemon=True).start()
-        except Exception as e:
-            self.log_message(f"Ошибка при проверке обновлений: {str(e)}")
+        self.check_self_update(ask_restart=True)
 
     def restart_program(self):
         """Перезапуск программы"""
+        # execl не выполняет обработчики выхода: конфигурацию, метрики и лог сохраняем сами
+        self.engine.shutdown()
+        if self.log_file is not None:
+            self.log_file.close()
         python = sys.executable
         os.execl(python, python, *sys.argv)
 
@@ -259,11 +385,47 @@ class GitWatcherGUI:
         
         # Update button
         update_btn = ttk.Button(controls_frame, text="Проверить обновления", 
-                               command=lambda: threading.Thread(target=self.check_self_update, daemon=True).start())
+                               command=self.check_self_update)
         update_btn.grid(row=0, column=4, padx=(0, 10))
         
-        # Status treeview
+        # Statistics button
+        stats_btn = ttk.Button(controls_frame, text="Статистика", command=self.show_statistics)
+        stats_btn.grid(row=0, column=5, padx=(0, 10))
+        
+        # Откат последнего обновления программы (то же, что --rollback в headless-режиме)
+        rollback_btn = ttk.Button(controls_frame, text="Откатить обновление", command=self.rollback_self_update)
+        rollback_btn.grid(row=0, column=6, padx=(0, 10))
+        
+        # Быстрые фильтры таблицы (по индексам реестра папок)
+        filter_frame = ttk.Frame(controls_frame)
+        filter_frame.grid(row=1, column=0, columnspan=7, sticky=(E, W), pady=(10, 0))
+        
+        self.filter_vars = {}
+        self.filter_boxes = {}
+        for field, label, width in (('remote_url', "Remote:", 35), ('branch', "Ветка:", 15),
+                                    ('folder_name', "Имя:", 15)):
+            ttk.Label(filter_frame, text=label).pack(side=LEFT, padx=(0, 5))
+            self.filter_vars[field] = StringVar(value=self.FILTER_ALL)
+            box = ttk.Combobox(filter_frame, textvariable=self.filter_vars[field], state='readonly',
+                               width=width, values=(self.FILTER_ALL,))
+            box.pack(side=LEFT, padx=(0, 10))
+            box.bind("<<ComboboxSelected>>", lambda event: self.apply_filter())
+            self.filter_boxes[field] = box
+        
+        self.filter_dirty_var = BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="Только с изменениями", variable=self.filter_dirty_var,
+                        command=self.apply_filter).pack(side=LEFT, padx=(0, 10))
+        ttk.Button(filter_frame, text="Сбросить", command=self.reset_filter).pack(side=LEFT)
+        self.filter_count_var = StringVar()
+        ttk.Label(filter_frame, textvariable=self.filter_count_var, foreground="gray").pack(side=RIGHT)
+        self.filter_version = None
+        
+        # Status treeview (iid строки - путь к папке)
         columns = ("folder", "local_path", "branch", "status", "changes", "last_commit")
+        self.tree_columns = columns
+        self.row_values = {}
+        self.hidden_rows = set()
+        self.last_commit_cache = {}
         self.tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=12)
         
         self.tree.heading("folder", text="Имя папки")
@@ -277,7 +439,7 @@ class GitWatcherGUI:
         self.tree.column("local_path", width=250)
         self.tree.column("branch", width=100)
         self.tree.column("status", width=100)
-        self.tree.column("changes", width=80)
+        self.tree.column("changes", width=180)
         self.tree.column("last_commit", width=150)
         
         self.tree.grid(row=2, column=0, columnspan=6, sticky=(N, S, E, W), pady=(10, 0))
@@ -337,18 +499,37 @@ class GitWatcherGUI:
         self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
 
     def log_message(self, message):
+        """Можно вызывать из любого потока: строка попадает в кольцевой буфер и в файл лога"""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        self.log_text.insert(END, f"[{timestamp}] {message}\n")
-        self.log_text.see(END)
-        self.root.update()
+        self.log_buffer.append(f"[{timestamp}] {message}\n")
+        if self.log_file is not None:
+            self.log_file.write(message)
+
+    def flush_log(self):
+        """Пачка накопленных строк выводится одной вставкой, в окне остаются последние log_max_lines строк"""
+        lines = []
+        while True:
+            try:
+                lines.append(self.log_buffer.popleft())
+            except IndexError:
+                break
+        
+        if lines:
+            self.log_text.insert(END, ''.join(lines))
+            line_count = int(self.log_text.index('end-1c').split('.')[0])
+            if line_count > self.log_max_lines:
+                self.log_text.delete('1.0', f"{line_count - self.log_max_lines}.0")
+            self.log_text.see(END)
+        
+        self.root.after(200, self.flush_log)
 
     def browse_repository(self):
         """Показать браузер репозиториев GitHub"""
-        browser = GitHubBrowser(self.root, self.clone_repository)
+        browser = GitHubBrowser(self.root, self.clone_repository, self.engine.github, self.engine.store_clone_options)
         browser.show()
 
-    def clone_repository(self, repo_url, branch):
-        """Клонировать репозиторий с выбранной веткой"""
+    def clone_repository(self, repo_url, branch, options=None):
+        """Клонировать репозиторий с выбранной веткой; options - режим клонирования из GitHubBrowser"""
         if not repo_url:
             return
         
@@ -373,25 +554,35 @@ class GitWatcherGUI:
             
             progress_window = Toplevel(self.root)
             progress_window.title("Клонирование...")
-            progress_window.geometry("300x100")
+            progress_window.geometry("420x130")
             progress_window.transient(self.root)
             progress_window.grab_set()
             
-            ttk.Label(progress_window, text="Клонирование...").pack(pady=10)
-            progress_bar = ttk.Progressbar(progress_window, mode='indeterminate')
-            progress_bar.pack(pady=10, padx=20, fill=X)
-            progress_bar.start()
+            stage_var = StringVar(value="Подключение к репозиторию...")
+            details_var = StringVar()
+            ttk.Label(progress_window, textvariable=stage_var).pack(pady=(10, 5))
+            progress_bar = ttk.Progressbar(progress_window, mode='determinate', maximum=100)
+            progress_bar.pack(pady=5, padx=20, fill=X)
+            ttk.Label(progress_window, textvariable=details_var, foreground="gray").pack()
+            
+            def show_progress(info):
+                if not progress_window.winfo_exists():
+                    return
+                stage_var.set(info['stage'])
+                progress_bar['value'] = info['fraction'] * 100
+                details_var.set(self.format_clone_progress(info))
             
             def clone_thread():
                 try:
-                    # Клонируем репозиторий
-                    repo = Repo.clone_from(repo_url, target_path, branch=branch)
+                    # Клонируем через общее хранилище remote (worktree)
+                    repo = self.engine.clone_repository(repo_url, target_path, branch, options,
+                                                        progress=lambda info: self.ui.post(show_progress, info))
                     
-                    progress_window.destroy()
-                    self.add_cloned_repo(repo, target_path, repo_url, branch)
+                    self.ui.post(progress_window.destroy)
+                    self.ui.post(self.add_cloned_repo, repo, target_path, repo_url, branch)
                 except Exception as e:
-                    progress_window.destroy()
-                    messagebox.showerror("Ошибка", f"Ошибка клонирования: {str(e)}")
+                    self.ui.post(progress_window.destroy)
+                    self.ui.post(messagebox.showerror, "Ошибка", f"Ошибка клонирования: {str(e)}")
             
             threading.Thread(target=clone_thread, daemon=True).start()
             
@@ -399,23 +590,22 @@ class GitWatcherGUI:
             self.log_message(f"Ошибка клонирования: {str(e)}")
             messagebox.showerror("Ошибка", f"Не удалось клонировать репозиторий: {str(e)}")
 
+    @staticmethod
+    def format_clone_progress(info):
+        """Строка под индикатором клонирования: объекты, объем, скорость, оставшееся время"""
+        parts = []
+        if info['total']:
+            parts.append(f"{info['objects']}/{info['total']}")
+        if info['transferred']:
+            parts.append(info['transferred'])
+        if info['speed']:
+            parts.append(info['speed'])
+        if info['eta'] is not None:
+            parts.append(f"осталось ~{int(info['eta']) + 1} с")
+        return ' · '.join(parts)
+
     def add_cloned_repo(self, repo, target_path, repo_url, branch):
-        folder_name = Path(target_path).name
-        
-        self.watched_folders[target_path] = {
-            'repo_path': target_path,
-            'folder_name': folder_name,
-            'remote_url': repo_url,
-            'branch': branch,
-            'handler': None,
-            'observer': None,
-            'repo': repo,
-            'changes': False
-        }
-        
-        self.save_config()
-        self.start_folder_monitoring(target_path)
-        self.refresh_status()
+        folder_name = self.engine.register_folder(target_path, repo, repo_url, branch)
         self.log_message(f"Успешно клонирован и добавлен: {folder_name} (ветка: {branch})")
 
     def add_folder(self):
@@ -440,15 +630,9 @@ class GitWatcherGUI:
             if messagebox.askyesno("Git репозиторий", 
                                  f"Папка '{folder_name}' не является git репозиторием.\n\nХотите инициализировать git в этой папке?"):
                 try:
-                    repo = Repo.init(folder_path)
+                    repo = self.engine.init_repository(folder_path)
                     is_git_repo = True
                     
-                    try:
-                        repo.git.add(A=True)
-                        repo.index.commit("Initial commit")
-                    except:
-                        pass
-                    
                     self.log_message(f"Инициализирован git репозиторий: {folder_name}")
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Не удалось инициализировать git: {str(e)}")
@@ -469,149 +653,36 @@ class GitWatcherGUI:
         if remote_url and repo is not None:
             try:
                 # Настраиваем ветку
-                self.setup_project_branch(repo, branch, remote_url)
+                self.engine.setup_project_branch(repo, branch, remote_url, folder_path)
             except Exception as e:
                 self.log_message(f"Ошибка при настройке ветки: {str(e)}")
         
-        self.watched_folders[folder_path] = {
-            'repo_path': folder_path,
-            'folder_name': folder_name,
-            'remote_url': remote_url,
-            'branch': branch,
-            'handler': None,
-            'observer': None,
-            'repo': repo,
-            'changes': False
-        }
-        
-        self.save_config()
-        self.start_folder_monitoring(folder_path)
-        self.refresh_status()
+        self.engine.register_folder(folder_path, repo, remote_url, branch)
         self.log_message(f"Добавлена папка: {folder_name} (ветка: {branch})")
 
-    def setup_project_branch(self, repo, branch_name, remote_url):
-        """Настройка ветки для проекта"""
-        try:
-            # Делаем fetch чтобы получить актуальные ветки
-            if 'origin' in repo.remotes:
-                origin = repo.remote('origin')
-                origin.fetch()
-            
-            # Проверяем существование ветки локально и удаленно
-            local_branches = [head.name for head in repo.heads]
-            remote_branches = []
-            
-            if 'origin' in repo.remotes:
-                for ref in repo.remotes.origin.refs:
-                    if ref.remote_head != 'HEAD' and not ref.name.endswith('/HEAD'):
-                        remote_branches.append(ref.remote_head)
-            
-            branch_exists_locally = branch_name in local_branches
-            branch_exists_remotely = branch_name in remote_branches
-            
-            if branch_exists_locally:
-                # Переключаемся на существующую локальную ветку
-                repo.git.checkout(branch_name)
-                self.log_message(f"Переключен на существующую ветку: {branch_name}")
-            elif branch_exists_remotely:
-                # Создаем локальную ветку для отслеживания удаленной
-                repo.git.checkout('-b', branch_name, f'origin/{branch_name}')
-                self.log_message(f"Создана локальная ветка для отслеживания удаленной: {branch_name}")
-            else:
-                # Создаем новую ветку
-                repo.git.checkout('-b', branch_name)
-                self.log_message(f"Создана новая ветка: {branch_name}")
-            
-            # Настраиваем remote
-            if 'origin' in repo.remotes:
-                origin = repo.remote('origin')
-                origin.set_url(remote_url)
-            else:
-                repo.create_remote('origin', remote_url)
-            
-            self.log_message(f"Настроен remote origin: {remote_url}")
-            
-            # Пытаемся настроить upstream
-            try:
-                repo.git.push('--set-upstream', 'origin', branch_name)
-                self.log_message(f"Установлен upstream для ветки: {branch_name}")
-                return True
-            except GitCommandError as e:
-                if "rejected" in str(e):
-                    self.log_message(f"Конфликт при пуше: {str(e)}")
-                    return False
-                else:
-                    raise e
-                    
-        except Exception as e:
-            self.log_message(f"Ошибка настройки ветки: {str(e)}")
-            return False
-
-    def refresh_branches(self, folder_path):
-        """Принудительное обновление информации о ветках"""
-        data = self.watched_folders[folder_path]
-        repo = data['repo']
-        
-        try:
-            if 'origin' in repo.remotes:
-                origin = repo.remote('origin')
-                origin.fetch()
-                self.log_message(f"Обновлена информация о ветках для: {data['folder_name']}")
-                return True
-        except Exception as e:
-            self.log_message(f"Ошибка обновления веток для {data['folder_name']}: {str(e)}")
-        
-        return False
-
     def refresh_branches_selected(self):
         """Обновить информацию о ветках для выбранного проекта"""
-        selection = self.tree.selection()
-        if not selection:
-            return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
+        folder_path = self.selected_folder()
         
         if folder_path:
-            if self.refresh_branches(folder_path):
+            if self.engine.refresh_branches(folder_path):
                 messagebox.showinfo("Успех", "Информация о ветках обновлена")
             else:
                 messagebox.showerror("Ошибка", "Не удалось обновить информацию о ветках")
 
     def switch_branch(self):
         """Смена ветки для выбранного проекта"""
-        selection = self.tree.selection()
-        if not selection:
-            return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
+        folder_path = self.selected_folder()
         
         if not folder_path:
             return
         
-        # Автоматически обновляем информацию о ветках при открытии диалога
-        self.refresh_branches(folder_path)
-        
         data = self.watched_folders[folder_path]
         repo = data['repo']
         
-        # Получаем список доступных веток (локальных и удаленных)
+        # Диалог открывается сразу из кэша веток, устаревший кэш обновляется в фоне
         try:
-            # Получаем локальные ветки
-            local_branches = [head.name for head in repo.heads]
-            
-            # Получаем удаленные ветки
-            remote_branches = []
-            if 'origin' in repo.remotes:
-                for ref in repo.remotes.origin.refs:
-                    if ref.remote_head != 'HEAD' and not ref.name.endswith('/HEAD'):
-                        branch_name = ref.name.replace('origin/', '')
-                        remote_branches.append(branch_name)
-            
-            # Объединяем и убираем дубликаты
-            all_branches = list(set(local_branches + remote_branches))
-            all_branches.sort()
+            _, all_branches = self.engine.list_branches(folder_path)
             
             current_branch = repo.active_branch.name
             
@@ -625,6 +696,9 @@ class GitWatcherGUI:
             ttk.Label(branch_window, text=f"Текущая ветка: {current_branch}").pack(pady=10)
             ttk.Label(branch_window, text="Выберите новую ветку:").pack()
             
+            cache_label = ttk.Label(branch_window, text="", foreground="gray")
+            cache_label.pack()
+            
             # Фрейм для поиска
             search_frame = ttk.Frame(branch_window)
             search_frame.pack(fill=X, padx=20, pady=5)
@@ -647,14 +721,38 @@ class GitWatcherGUI:
             
             # Заполняем список веток
             def update_branches_list(search_text=""):
+                # Сохраняем выбор при обновлении списка на месте
+                selected = [branches_listbox.get(i) for i in branches_listbox.curselection()]
                 branches_listbox.delete(0, END)
                 filtered_branches = [b for b in all_branches if search_text.lower() in b.lower()]
                 for branch in filtered_branches:
                     branches_listbox.insert(END, branch)
                     if branch == current_branch:
                         branches_listbox.itemconfig(END, {'fg': 'green'})
+                    if branch in selected:
+                        branches_listbox.selection_set(END)
+            
+            def update_cache_label(refreshing=False):
+                if refreshing:
+                    cache_label.config(text="Обновление списка веток...")
+                    return
+                age = self.engine.branch_cache_age(folder_path)
+                if age is None:
+                    cache_label.config(text="Ветки из локального репозитория")
+                else:
+                    cache_label.config(text=f"Ветки обновлены {int(age // 60)} мин назад")
+            
+            def on_branches_refreshed(local_branches, branches):
+                def apply():
+                    if not branch_window.winfo_exists():
+                        return
+                    all_branches[:] = branches
+                    update_branches_list(search_var.get())
+                    update_cache_label()
+                self.ui.post(apply)
             
             update_branches_list()
+            update_cache_label(self.engine.refresh_branches_async(folder_path, on_branches_refreshed))
             
             # Обработчик поиска
             def on_search_change(*args):
@@ -675,19 +773,8 @@ class GitWatcherGUI:
                     return
                 
                 try:
-                    # Проверяем, существует ли ветка локально
-                    if new_branch in local_branches:
-                        # Переключаемся на существующую локальную ветку
-                        repo.git.checkout(new_branch)
-                    else:
-                        # Создаем локальную ветку для отслеживания удаленной
-                        repo.git.checkout('-b', new_branch, f'origin/{new_branch}')
-                    
-                    data['branch'] = new_branch
-                    self.save_config()
-                    self.refresh_status()
+                    self.engine.checkout_branch(folder_path, new_branch)
                     branch_window.destroy()
-                    self.log_message(f"Переключен на ветку: {new_branch} для проекта {folder_name}")
                     messagebox.showinfo("Успех", f"Успешно переключен на ветку: {new_branch}")
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Ошибка переключения ветки: {str(e)}")
@@ -702,12 +789,7 @@ class GitWatcherGUI:
             messagebox.showerror("Ошибка", f"Ошибка получения списка веток: {str(e)}")
 
     def pull_selected(self):
-        selection = self.tree.selection()
-        if not selection:
-            return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
+        folder_path = self.selected_folder()
         
         if folder_path:
             self.pull_changes(folder_path)
@@ -733,40 +815,18 @@ class GitWatcherGUI:
             
             def pull_thread():
                 try:
-                    repo = data['repo']
-                    branch = data.get('branch', 'main')
-                    
-                    # Переключаемся на нужную ветку
-                    if repo.active_branch.name != branch:
-                        repo.git.checkout(branch)
-                    
-                    current_commit = repo.head.commit.hexsha
-                    
-                    # Настраиваем upstream если нужно
-                    if not hasattr(repo.active_branch, 'tracking_branch') or not repo.active_branch.tracking_branch():
-                        self.setup_project_branch(repo, branch, data['remote_url'])
+                    files_changed = self.engine.pull_folder(folder_path)
                     
-                    origin = repo.remote('origin')
-                    origin.fetch()
-                    
-                    pull_info = origin.pull()
-                    new_commit = repo.head.commit.hexsha
-                    
-                    files_changed = (current_commit != new_commit)
-                    
-                    progress_window.destroy()
+                    self.ui.post(progress_window.destroy)
                     
                     if files_changed:
-                        self.log_message(f"Успешно обновлено: {data['folder_name']} (ветка: {branch})")
-                        messagebox.showinfo("Успех", "Проект успешно обновлен с GitHub!")
-                        self.refresh_status()
+                        self.ui.post(messagebox.showinfo, "Успех", "Проект успешно обновлен с GitHub!")
                     else:
-                        self.log_message(f"Нет новых изменений для: {data['folder_name']}")
-                        messagebox.showinfo("Информация", "Нет новых изменений для загрузки.")
+                        self.ui.post(messagebox.showinfo, "Информация", "Нет новых изменений для загрузки.")
                     
                 except Exception as e:
-                    progress_window.destroy()
-                    messagebox.showerror("Ошибка", f"Ошибка при обновлении: {str(e)}")
+                    self.ui.post(progress_window.destroy)
+                    self.ui.post(messagebox.showerror, "Ошибка", f"Ошибка при обновлении: {str(e)}")
             
             threading.Thread(target=pull_thread, daemon=True).start()
             
@@ -775,12 +835,7 @@ class GitWatcherGUI:
             messagebox.showerror("Ошибка", f"Ошибка при обновлении: {str(e)}")
 
     def edit_paths(self):
-        selection = self.tree.selection()
-        if not selection:
-            return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
+        folder_path = self.selected_folder()
         
         if not folder_path:
             return
@@ -789,7 +844,7 @@ class GitWatcherGUI:
         
         edit_window = Toplevel(self.root)
         edit_window.title("Редактирование настроек")
-        edit_window.geometry("500x300")
+        edit_window.geometry("500x460")
         edit_window.transient(self.root)
         edit_window.grab_set()
         
@@ -810,15 +865,39 @@ class GitWatcherGUI:
         url_entry = ttk.Entry(edit_window, textvariable=url_var, width=50)
         url_entry.pack(padx=20, pady=(5, 10), fill=X)
         
+        ttk.Label(edit_window, text="Не отслеживать (шаблоны .gitignore через запятую):").pack(anchor=W, padx=20, pady=(0, 0))
+        exclude_var = StringVar(value=", ".join(data.get('exclude', [])))
+        exclude_entry = ttk.Entry(edit_window, textvariable=exclude_var, width=50)
+        exclude_entry.pack(padx=20, pady=(5, 10), fill=X)
+        
         auto_push_var = BooleanVar(value=data.get('auto_push', True))
         auto_push_cb = ttk.Checkbutton(edit_window, text="Автоматически пушить изменения после коммита", 
                                       variable=auto_push_var)
         auto_push_cb.pack(anchor=W, padx=20, pady=(5, 10))
         
+        policy = self.engine.auto_commit.get_policy(data)
+        auto_commit_var = BooleanVar(value=policy['enabled'])
+        auto_commit_cb = ttk.Checkbutton(edit_window, text="Автоматически коммитить после паузы в изменениях", 
+                                        variable=auto_commit_var)
+        auto_commit_cb.pack(anchor=W, padx=20, pady=(0, 5))
+        
+        policy_frame = ttk.Frame(edit_window)
+        policy_frame.pack(anchor=W, padx=40, pady=(0, 10))
+        
+        quiet_var = IntVar(value=policy['quiet_seconds'])
+        interval_var = IntVar(value=policy['min_interval_minutes'])
+        batch_var = IntVar(value=policy['max_batch_files'])
+        for column, (label, var) in enumerate((("Пауза, с:", quiet_var),
+                                               ("Не чаще раза в, мин:", interval_var),
+                                               ("Сразу при файлах:", batch_var))):
+            ttk.Label(policy_frame, text=label).grid(row=0, column=column * 2, padx=(0, 5))
+            ttk.Entry(policy_frame, textvariable=var, width=6).grid(row=0, column=column * 2 + 1, padx=(0, 10))
+        
         def save_changes():
             new_name = name_var.get().strip()
             new_branch = branch_var.get().strip()
             new_url = url_var.get().strip()
+            new_exclude = [pattern.strip() for pattern in exclude_var.get().split(',') if pattern.strip()]
             
             if not new_name:
                 messagebox.showwarning("Внимание", "Имя папки обязательно!")
@@ -828,85 +907,214 @@ class GitWatcherGUI:
                 messagebox.showwarning("Внимание", "Имя ветки обязательно!")
                 return
             
+            try:
+                new_policy = {
+                    'enabled': auto_commit_var.get(),
+                    'quiet_seconds': max(0, quiet_var.get()),
+                    'min_interval_minutes': max(0, interval_var.get()),
+                    'max_batch_files': max(1, batch_var.get()),
+                }
+            except TclError:
+                messagebox.showwarning("Внимание", "Параметры автокоммита должны быть целыми числами!")
+                return
+            
             self.watched_folders[folder_path]['folder_name'] = new_name
             self.watched_folders[folder_path]['branch'] = new_branch
             self.watched_folders[folder_path]['remote_url'] = new_url
             self.watched_folders[folder_path]['auto_push'] = auto_push_var.get()
+            self.watched_folders[folder_path]['auto_commit'] = new_policy
+            
+            if new_exclude != data.get('exclude', []):
+                self.watched_folders[folder_path]['exclude'] = new_exclude
+                self.engine.start_folder_monitoring(folder_path)
             
             # Обновляем ветку если она изменилась
             if new_branch != data.get('branch', 'main'):
                 try:
                     repo = self.watched_folders[folder_path]['repo']
-                    self.setup_project_branch(repo, new_branch, new_url)
+                    self.engine.setup_project_branch(repo, new_branch, new_url, folder_path)
                 except Exception as e:
                     self.log_message(f"Ошибка смены ветки: {str(e)}")
             
             if new_url and new_url != data.get('remote_url', ''):
                 try:
-                    repo = self.watched_folders[folder_path]['repo']
-                    if 'origin' in repo.remotes:
-                        origin = repo.remote('origin')
-                        origin.set_url(new_url)
-                    else:
-                        repo.create_remote('origin', new_url)
-                    self.log_message(f"Обновлен remote origin: {new_url}")
+                    self.engine.set_remote_url(folder_path, new_url)
                 except Exception as e:
                     self.log_message(f"Ошибка обновления remote: {str(e)}")
             
-            self.save_config()
-            self.refresh_status()
+            self.engine.save_config()
+            self.engine.status_engine.rescan(folder_path)
+            self.engine.auto_commit.wake()
+            self.engine.notify([folder_path], head_changed=True)
             edit_window.destroy()
             self.log_message(f"Обновлены настройки для: {new_name}")
         
         ttk.Button(edit_window, text="Сохранить", command=save_changes).pack(pady=10)
 
-    def start_folder_monitoring(self, folder_path):
-        folder_data = self.watched_folders[folder_path]
-        
-        def change_callback(folder_name):
-            folder_data['changes'] = True
-            self.refresh_status()
-        
-        event_handler = ChangeHandler(folder_data['folder_name'], change_callback)
-        observer = Observer()
-        observer.schedule(event_handler, folder_path, recursive=True)
-        observer.start()
-        
-        folder_data['handler'] = event_handler
-        folder_data['observer'] = observer
-
     def start_monitoring(self):
-        for folder_path in self.watched_folders.keys():
-            self.start_folder_monitoring(folder_path)
+        self.engine.start_monitoring()
         self.refresh_status()
-        self.log_message("Мониторинг запущен")
 
-    def refresh_status(self):
-        for item in self.tree.get_children():
-            if self.tree.exists(item):  # Добавляем проверку существования элемента
-                self.tree.delete(item)
-        
-        for folder_path, data in self.watched_folders.items():
-            status = "Есть изменения" if data['changes'] else "Нет изменений"
-            changes = "●" if data['changes'] else "○"
-            branch = data.get('branch', 'main')
+    def on_engine_update(self, folder_paths, head_changed=False):
+        """Ядро сообщило об изменении состояния папок (вызывается из рабочих потоков).
+        
+        Уведомления накапливаются и применяются к таблице одним проходом в главном потоке.
+        """
+        with self.pending_lock:
+            self.pending_refresh.update(folder_paths)
+            if head_changed:
+                self.pending_head_changes.update(folder_paths)
+            if self.refresh_posted:
+                return
+            self.refresh_posted = True
+        self.ui.post(self.flush_pending_refresh)
+
+    def flush_pending_refresh(self):
+        with self.pending_lock:
+            folder_paths, self.pending_refresh = self.pending_refresh, set()
+            head_changes, self.pending_head_changes = self.pending_head_changes, set()
+            self.refresh_posted = False
+        
+        for folder_path in head_changes:
+            self.last_commit_cache.pop(folder_path, None)
+        self.refresh_status(list(folder_paths))
+
+    def refresh_status(self, folder_paths=None):
+        """Обновление таблицы: перерисовываются только строки с изменившимися значениями.
+        
+        folder_paths - папки, состояние которых могло измениться; None - полная проверка всех папок.
+        """
+        if folder_paths is None:
+            # Полная проверка перечитывает и коммиты (например, сделанные из терминала)
+            self.last_commit_cache.clear()
+            folder_paths = list(self.watched_folders.keys())
+        
+        # Убираем строки папок, которые больше не отслеживаются
+        for item in list(self.row_values.keys()):
+            if item not in self.watched_folders:
+                if self.tree.exists(item):
+                    self.tree.delete(item)
+                del self.row_values[item]
+                self.hidden_rows.discard(item)
+                self.last_commit_cache.pop(item, None)
+        
+        for folder_path in folder_paths:
+            data = self.watched_folders.get(folder_path)
+            if data is None:
+                continue
+            
+            values = self.build_row_values(folder_path, data)
+            old_values = self.row_values.get(folder_path)
+            
+            if old_values is None or not self.tree.exists(folder_path):
+                self.tree.insert("", "end", iid=folder_path, values=values)
+            else:
+                for column, old_value, new_value in zip(self.tree_columns, old_values, values):
+                    if old_value != new_value:
+                        self.tree.set(folder_path, column, new_value)
             
+            self.row_values[folder_path] = values
+        
+        self.refresh_filter_choices()
+        self.apply_filter(folder_paths)
+
+    def refresh_filter_choices(self):
+        """Списки фильтров - значения индексов реестра; перестраиваются, только когда индексы изменились"""
+        if self.filter_version == self.watched_folders.version:
+            return
+        self.filter_version = self.watched_folders.version
+        for field, box in self.filter_boxes.items():
+            values = sorted(key for key in self.watched_folders.counts(field) if key)
+            box['values'] = [self.FILTER_ALL] + values
+
+    def filter_criteria(self):
+        criteria = {field: var.get() for field, var in self.filter_vars.items() if var.get() != self.FILTER_ALL}
+        if self.filter_dirty_var.get():
+            criteria['dirty'] = True
+        return criteria
+
+    def reset_filter(self):
+        for var in self.filter_vars.values():
+            var.set(self.FILTER_ALL)
+        self.filter_dirty_var.set(False)
+        self.apply_filter()
+
+    def apply_filter(self, folder_paths=None):
+        """Скрыть строки, не подходящие под быстрый фильтр (detach), и вернуть подходящие.
+        
+        folder_paths - строки, которые могли изменить видимость; None - все строки.
+        """
+        criteria = self.filter_criteria()
+        matches = set(self.watched_folders.find(**criteria)) if criteria else None
+        
+        restored = False
+        for folder_path in (list(self.row_values) if folder_paths is None else folder_paths):
+            if folder_path not in self.row_values:
+                continue
+            visible = matches is None or folder_path in matches
+            if not visible and folder_path not in self.hidden_rows:
+                self.tree.selection_remove(folder_path)
+                self.tree.detach(folder_path)
+                self.hidden_rows.add(folder_path)
+            elif visible and folder_path in self.hidden_rows:
+                self.hidden_rows.discard(folder_path)
+                restored = True
+        
+        if restored:
+            # Возвращенные строки встают на свои места в порядке добавления папок
+            visible_paths = [path for path in self.watched_folders
+                             if path in self.row_values and path not in self.hidden_rows]
+            for index, folder_path in enumerate(visible_paths):
+                self.tree.move(folder_path, "", index)
+        
+        total = len(self.row_values)
+        self.filter_count_var.set(f"Показано {total - len(self.hidden_rows)} из {total}" if self.hidden_rows else "")
+
+    def build_row_values(self, folder_path, data):
+        if data.get('loading'):
+            return (data['folder_name'], folder_path, data.get('branch', 'main'), "Загрузка...", "…", "…")
+        
+        status = "Есть изменения" if data['changes'] else "Нет изменений"
+        changes = self.format_changes(data)
+        branch = data.get('branch', 'main')
+        
+        return (
+            data['folder_name'],
+            folder_path,
+            branch,
+            status,
+            changes,
+            self.get_last_commit(folder_path, data)
+        )
+
+    def format_changes(self, data):
+        summary = data.get('status_summary')
+        if summary is None:
+            return "● Есть изменения" if data['changes'] else "○"
+        if not summary['total']:
+            return "○"
+        
+        parts = [f"{label}{summary[state]}" for state, label in
+                 (('modified', 'M'), ('added', 'A'), ('deleted', 'D'), ('untracked', '?')) if summary[state]]
+        return f"● {' '.join(parts)} · {self.format_size(summary['bytes'])}"
+
+    @staticmethod
+    def format_size(size):
+        for unit in ("Б", "КБ", "МБ"):
+            if size < 1024:
+                return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} ГБ"
+
+    def get_last_commit(self, folder_path, data):
+        """Дата последнего коммита; читается из репозитория только после сброса кэша"""
+        if folder_path not in self.last_commit_cache:
             try:
-                last_commit = data['repo'].head.commit.committed_datetime.strftime("%Y-%m-%d %H:%M")
+                last_commit = self.engine.head_commit(folder_path)['committed_datetime'].strftime("%Y-%m-%d %H:%M")
             except:
                 last_commit = "Нет коммитов"
-            
-            item = self.tree.insert("", "end", values=(
-                data['folder_name'],
-                folder_path,
-                branch,
-                status,
-                changes,
-                last_commit
-            ))
-            
-            if data['changes']:
-                self.tree.set(item, "changes", "● Есть изменения")
+            self.last_commit_cache[folder_path] = last_commit
+        return self.last_commit_cache[folder_path]
 
     def on_tree_select(self, event):
         selection = self.tree.selection()
@@ -925,19 +1133,15 @@ class GitWatcherGUI:
             self.switch_branch_btn.config(state=DISABLED)
             self.refresh_branches_btn.config(state=DISABLED)
 
-    def find_folder_by_name(self, folder_name):
-        for path, data in self.watched_folders.items():
-            if data['folder_name'] == folder_name:
-                return path
+    def selected_folder(self):
+        """Путь выбранной папки: iid строки таблицы - путь, имена папок могут совпадать"""
+        selection = self.tree.selection()
+        if selection and selection[0] in self.watched_folders:
+            return selection[0]
         return None
 
     def commit_selected(self):
-        selection = self.tree.selection()
-        if not selection:
-            return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
+        folder_path = self.selected_folder()
         
         if folder_path:
             self.commit_folder(folder_path)
@@ -976,46 +1180,23 @@ class GitWatcherGUI:
                 commit_window.destroy()
                 
                 data['auto_push'] = auto_push
-                self.save_config()
-                
-                repo = data['repo']
-                branch = data.get('branch', 'main')
-                
-                # Убеждаемся, что мы в правильной ветке
-                if repo.active_branch.name != branch:
-                    repo.git.checkout(branch)
-                
-                repo.git.add(A=True)
-                repo.index.commit(message)
+                self.engine.save_config()
+                threading.Thread(target=commit_thread, args=(message, auto_push), daemon=True).start()
+            
+            def commit_thread(message, auto_push):
+                try:
+                    result, details = self.engine.commit_and_push(folder_path, message, auto_push)
+                except Exception as e:
+                    self.log_message(f"Ошибка коммита {data['folder_name']}: {str(e)}")
+                    self.ui.post(messagebox.showerror, "Ошибка", f"Ошибка при коммите: {str(e)}")
+                    return
                 
-                if auto_push and data.get('remote_url'):
-                    try:
-                        origin = repo.remote(name='origin')
-                        origin.push(branch)
-                        self.log_message(f"Успешный коммит и пуш: {data['folder_name']} (ветка: {branch})")
-                        messagebox.showinfo("Успех", "Изменения успешно запушены в GitHub!")
-                    except GitCommandError as e:
-                        if "no upstream branch" in str(e):
-                            if self.setup_project_branch(repo, branch, data['remote_url']):
-                                try:
-                                    origin.push(branch)
-                                    self.log_message(f"Успешный коммит и пуш (после настройки upstream): {data['folder_name']}")
-                                    messagebox.showinfo("Успех", "Изменения успешно запушены в GitHub!")
-                                except Exception as e2:
-                                    self.log_message(f"Коммит выполнен, но пуш не удался после настройки upstream: {data['folder_name']} - {str(e2)}")
-                                    messagebox.showwarning("Предупреждение", f"Коммит выполнен, но пуш не удался:\n{str(e2)}")
-                            else:
-                                self.log_message(f"Коммит выполнен, но не удалось настроить upstream: {data['folder_name']}")
-                                messagebox.showwarning("Предупреждение", "Коммит выполнен, но не удалось настроить автоматическую синхронизацию с GitHub.")
-                        else:
-                            self.log_message(f"Коммит выполнен, но пуш не удался: {data['folder_name']} - {str(e)}")
-                            messagebox.showwarning("Предупреждение", f"Коммит выполнен, но пуш не удался:\n{str(e)}")
+                if result == 'pushed':
+                    self.ui.post(messagebox.showinfo, "Успех", "Изменения успешно запушены в GitHub!")
+                elif result == 'committed':
+                    self.ui.post(messagebox.showinfo, "Успех", "Коммит выполнен успешно!")
                 else:
-                    self.log_message(f"Коммит выполнен (без пуша): {data['folder_name']} (ветка: {branch})")
-                    messagebox.showinfo("Успех", "Коммит выполнен успешно!")
-                
-                data['changes'] = False
-                self.refresh_status()
+                    self.ui.post(messagebox.showwarning, "Предупреждение", f"Коммит выполнен, но пуш не удался:\n{details}")
             
             ttk.Button(commit_window, text="Выполнить коммит", command=do_commit).pack(pady=10)
             
@@ -1024,161 +1205,193 @@ class GitWatcherGUI:
             messagebox.showerror("Ошибка", f"Ошибка при коммите: {str(e)}")
 
     def commit_all(self):
-        has_changes = any(data['changes'] for data in self.watched_folders.values())
+        dirty_folders = self.engine.dirty_folders()
         
-        if not has_changes:
+        if not dirty_folders:
             messagebox.showinfo("Информация", "Нет изменений для коммита")
             return
         
-        if messagebox.askyesno("Подтверждение", "Коммитнуть все изменения во всех папках?"):
-            for folder_path in self.watched_folders.keys():
-                if self.watched_folders[folder_path]['changes']:
-                    self.commit_folder(folder_path)
+        if messagebox.askyesno("Подтверждение", f"Коммитнуть все изменения во всех папках ({len(dirty_folders)})?"):
+            self.log_message(f"Пакетный коммит: папок {len(dirty_folders)}, потоков {self.engine.commit_workers}")
+            threading.Thread(target=self.run_batch_commit, args=(dirty_folders,), daemon=True).start()
+
+    def run_batch_commit(self, folder_paths):
+        results, elapsed = self.engine.run_batch_commit(folder_paths)
+        self.ui.post(self.show_commit_summary, results, elapsed)
+
+    def show_commit_summary(self, results, elapsed):
+        """Одно итоговое окно пакетного коммита с таблицей результатов по папкам"""
+        labels = {
+            'pushed': "Коммит и пуш",
+            'committed': "Коммит (без пуша)",
+            'push_failed': "Пуш не удался",
+            'failed': "Ошибка",
+        }
+        succeeded = sum(1 for _, result, _, _ in results if result in ('pushed', 'committed'))
+        
+        summary_window = Toplevel(self.root)
+        summary_window.title("Результаты коммита")
+        summary_window.geometry("700x350")
+        summary_window.transient(self.root)
+        
+        ttk.Label(summary_window, text=f"Папок: {len(results)}, успешно: {succeeded}, "
+                                       f"с ошибками: {len(results) - succeeded}, время: {elapsed:.1f} с").pack(pady=10)
+        
+        columns = ("folder", "branch", "result", "time", "details")
+        results_tree = ttk.Treeview(summary_window, columns=columns, show="headings", height=10)
+        results_tree.heading("folder", text="Имя папки")
+        results_tree.heading("branch", text="Ветка")
+        results_tree.heading("result", text="Результат")
+        results_tree.heading("time", text="Время, с")
+        results_tree.heading("details", text="Подробности")
+        results_tree.column("folder", width=130)
+        results_tree.column("branch", width=90)
+        results_tree.column("result", width=120)
+        results_tree.column("time", width=60)
+        results_tree.column("details", width=280)
+        results_tree.pack(fill=BOTH, expand=True, padx=10)
+        
+        for folder_path, result, details, duration in results:
+            data = self.watched_folders.get(folder_path, {})
+            results_tree.insert("", "end", values=(
+                data.get('folder_name', folder_path),
+                data.get('branch', 'main'),
+                labels[result],
+                f"{duration:.1f}",
+                details.splitlines()[0] if details else ""
+            ))
+        
+        ttk.Button(summary_window, text="Закрыть", command=summary_window.destroy).pack(pady=10)
+
+    def show_statistics(self):
+        """Окно статистики: время git- и сетевых операций по папкам и частота событий watcher"""
+        stats_window = Toplevel(self.root)
+        stats_window.title("Статистика")
+        stats_window.geometry("900x420")
+        stats_window.transient(self.root)
+        
+        events_label = ttk.Label(stats_window, text="")
+        events_label.pack(pady=10)
+        
+        columns = ("operation", "folder", "count", "errors", "avg", "p50", "p95")
+        stats_tree = ttk.Treeview(stats_window, columns=columns, show="headings", height=14)
+        for column, title, width in (("operation", "Операция", 120), ("folder", "Папка", 310),
+                                     ("count", "Вызовов", 70), ("errors", "Ошибок", 70),
+                                     ("avg", "Среднее, с", 90), ("p50", "p50, с", 80), ("p95", "p95, с", 80)):
+            stats_tree.heading(column, text=title)
+            stats_tree.column(column, width=width)
+        stats_tree.pack(fill=BOTH, expand=True, padx=10)
+        
+        previous = {'time': time.monotonic(), 'events': self.engine.watcher_counters()['filehive_watcher_events_total']}
+        
+        def update_statistics():
+            if not stats_window.winfo_exists():
+                return
+            
+            counters = self.engine.watcher_counters()
+            now = time.monotonic()
+            events = counters['filehive_watcher_events_total']
+            rate = (events - previous['events']) / max(now - previous['time'], 1e-6)
+            previous.update(time=now, events=events)
+            events_label.config(text=f"События watcher: {events} ({rate:.1f}/с), "
+                                     f"уведомлений: {counters['filehive_watcher_notifications_total']}, "
+                                     f"отброшено исключенных: {counters['filehive_watcher_events_ignored_total']}")
+            
+            stats_tree.delete(*stats_tree.get_children())
+            for row in self.engine.metrics.snapshot():
+                stats_tree.insert("", "end", values=(
+                    row['operation'], row['folder'] or "-", row['count'], row['errors'],
+                    f"{row['avg']:.3f}", f"{row['p50']:.3f}", f"{row['p95']:.3f}"
+                ))
+            stats_window.after(2000, update_statistics)
+        
+        update_statistics()
+        ttk.Button(stats_window, text="Закрыть", command=stats_window.destroy).pack(pady=10)
 
     def remove_folder(self):
-        selection = self.tree.selection()
-        if not selection:
+        folder_path = self.selected_folder()
+        if not folder_path:
             return
-            
-        folder_name = self.tree.item(selection[0])['values'][0]
-        folder_path = self.find_folder_by_name(folder_name)
-        
-        if folder_path and messagebox.askyesno("Подтверждение", 
-                                             f"Удалить папку {folder_name} из отслеживания?\n\nФайлы на диске не будут удалены."):
-            if self.watched_folders[folder_path]['observer']:
-                self.watched_folders[folder_path]['observer'].stop()
-                self.watched_folders[folder_path]['observer'].join()
-            
-            del self.watched_folders[folder_path]
-            self.save_config()
-            self.refresh_status()
+        folder_name = self.watched_folders[folder_path]['folder_name']
+        
+        if messagebox.askyesno("Подтверждение", 
+                               f"Удалить папку {folder_name} из отслеживания?\n\nФайлы на диске не будут удалены."):
+            self.engine.unregister_folder(folder_path)
             self.log_message(f"Удалена папка: {folder_name}")
 
-    def load_config(self):
-        if os.path.exists(self.config_file):
+    def check_self_update(self, ask_restart=False):
+        """Проверка обновлений программы: сеть - в фоновом потоке, диалоги - в главном"""
+        def probe():
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    self.watched_folders = config.get('watched_folders', {})
-                    
-                    for folder_path, data in self.watched_folders.items():
-                        try:
-                            data['repo'] = Repo(data['repo_path'])
-                            # Устанавливаем ветку по умолчанию если не указана
-                            if 'branch' not in data:
-                                data['branch'] = 'main'
-                        except:
-                            data['repo'] = None
+                latest_version = self.engine.probe_update()
             except Exception as e:
-                self.watched_folders = {}
-                self.log_message(f"Ошибка загрузки конфигурации: {str(e)}")
-
-    def save_config(self):
-        config = {'watched_folders': {}}
-        
-        for folder_path, data in self.watched_folders.items():
-            config['watched_folders'][folder_path] = {
-                'repo_path': data['repo_path'],
-                'folder_name': data['folder_name'],
-                'remote_url': data.get('remote_url', ''),
-                'branch': data.get('branch', 'main'),
-                'auto_push': data.get('auto_push', True),
-                'changes': data['changes']
-            }
-        
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+                self.log_message(f"Ошибка проверки обновлений: {str(e)}")
+                self.ui.post(messagebox.showerror, "Ошибка", f"Не удалось проверить обновления: {str(e)}")
+                return
+            self.ui.post(self.offer_self_update, latest_version, ask_restart)
+        
+        threading.Thread(target=probe, daemon=True).start()
 
-    def check_self_update(self):
-        """Проверка обновлений программы"""
-        try:
-            # Конфигурация репозитория обновлений
-            UPDATE_REPO_URL = "https://github.com/vasabi224/bots.git"
-            UPDATE_BRANCH = "main"
-            VERSION_FILE = "version.txt"
-            
-            # Текущая версия программы
-            CURRENT_VERSION = "1.0.0"
-            
-            self.log_message("Проверка обновлений...")
-            
-            # Создаем временную папку для проверки обновлений
-            temp_dir = os.path.join(os.path.dirname(__file__), "temp_update_check")
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            
-            # Клонируем репозиторий обновлений
-            Repo.clone_from(UPDATE_REPO_URL, temp_dir, branch=UPDATE_BRANCH, depth=1)
-            
-            # Проверяем файл версии
-            version_path = os.path.join(temp_dir, VERSION_FILE)
-            if os.path.exists(version_path):
-                with open(version_path, 'r', encoding='utf-8') as f:
-                    latest_version = f.read().strip()
-                
-                if latest_version != CURRENT_VERSION:
-                    if messagebox.askyesno("Обновление доступно", 
-                                         f"Доступна новая версия {latest_version}\nТекущая версия: {CURRENT_VERSION}\n\nОбновить программу?"):
-                        self.perform_self_update(temp_dir, latest_version)
-                        return True
-                else:
-                    messagebox.showinfo("Обновление", "У вас установлена последняя версия программы")
-            
-            # Очищаем временную папку
-            shutil.rmtree(temp_dir)
-            return False
-            
-        except Exception as e:
-            self.log_message(f"Ошибка проверки обновлений: {str(e)}")
-            messagebox.showerror("Ошибка", f"Не удалось проверить обновления: {str(e)}")
-            return False
+    def offer_self_update(self, latest_version, ask_restart):
+        if latest_version is None:
+            return
+        
+        if latest_version == self.engine.CURRENT_VERSION:
+            messagebox.showinfo("Обновление", "У вас установлена последняя версия программы")
+            return
+        
+        if messagebox.askyesno("Обновление доступно", 
+                             f"Доступна новая версия {latest_version}\nТекущая версия: {self.engine.CURRENT_VERSION}\n\nОбновить программу?"):
+            # Файлы обновления скачиваются только после подтверждения
+            self.perform_self_update(latest_version, ask_restart)
+        else:
+            self.engine.discard_update()
 
-    def perform_self_update(self, update_dir, new_version):
+    def perform_self_update(self, new_version, ask_restart=False):
         """Выполнение обновления программы"""
+        def update_thread():
+            try:
+                backup_dir = self.engine.perform_self_update(new_version)
+            except Exception as e:
+                self.log_message(f"Ошибка обновления: {str(e)}")
+                self.ui.post(messagebox.showerror, "Ошибка обновления", f"Не удалось обновить программу: {str(e)}")
+                return
+            self.ui.post(self.on_self_update_done, new_version, backup_dir, ask_restart)
+        
+        threading.Thread(target=update_thread, daemon=True).start()
+
+    def on_self_update_done(self, new_version, backup_dir, ask_restart):
+        messagebox.showinfo("Обновление завершено", 
+                          f"Программа успешно обновлена до версии {new_version}\n"
+                          f"Backup сохранен в: {backup_dir}\n\n"
+                          f"Перезапустите программу для применения изменений.")
+        if ask_restart and messagebox.askyesno("Обновление", "Перезапустить программу сейчас?"):
+            self.restart_program()
+
+    def rollback_self_update(self):
+        """Откат последнего обновления программы из backup"""
+        backups = [backup for _, backup in self.engine.list_backups() if not backup.get('rolled_back')]
+        if not backups:
+            messagebox.showinfo("Откат обновления", "Нет обновлений для отката")
+            return
+        
+        backup = backups[0]
+        if not messagebox.askyesno("Откат обновления",
+                                   f"Вернуть версию {backup['from_version']} вместо {backup['to_version']}?"):
+            return
         try:
-            # Создаем backup текущей версии
-            backup_dir = os.path.join(os.path.dirname(__file__), f"backup_v{new_version}")
-            if os.path.exists(backup_dir):
-                shutil.rmtree(backup_dir)
-            
-            # Копируем текущие файлы в backup
-            current_dir = os.path.dirname(__file__)
-            shutil.copytree(current_dir, backup_dir, 
-                           ignore=shutil.ignore_patterns('temp_*', 'backup_*', '.git'))
-            
-            # Копируем новые файлы (исключая временные файлы и конфиги)
-            for item in os.listdir(update_dir):
-                if item not in ['temp_update_check', 'backup_*', 'watcher_config.json']:
-                    src_path = os.path.join(update_dir, item)
-                    dst_path = os.path.join(current_dir, item)
-                    
-                    if os.path.isdir(src_path):
-                        if os.path.exists(dst_path):
-                            shutil.rmtree(dst_path)
-                        shutil.copytree(src_path, dst_path)
-                    else:
-                        shutil.copy2(src_path, dst_path)
-            
-            self.log_message(f"Программа обновлена до версии {new_version}")
-            messagebox.showinfo("Обновление завершено", 
-                              f"Программа успешно обновлена до версии {new_version}\n"
-                              f"Backup сохранен в: {backup_dir}\n\n"
-                              f"Перезапустите программу для применения изменений.")
-            
-            # Очищаем временные файлы
-            shutil.rmtree(update_dir)
-            
+            version = self.engine.rollback_update()
         except Exception as e:
-            self.log_message(f"Ошибка обновления: {str(e)}")
-            messagebox.showerror("Ошибка обновления", f"Не удалось обновить программу: {str(e)}")
+            self.log_message(f"Ошибка отката: {str(e)}")
+            messagebox.showerror("Ошибка", f"Не удалось откатить обновление: {str(e)}")
+            return
+        if messagebox.askyesno("Откат обновления", f"Восстановлена версия {version}.\n\nПерезапустить программу сейчас?"):
+            self.restart_program()
 
     def on_closing(self):
-        for data in self.watched_folders.values():
-            if data.get('observer'):
-                data['observer'].stop()
-                data['observer'].join()
-        
-        self.save_config()
+        self.engine.shutdown()
+        if self.log_file is not None:
+            self.log_file.close()
         self.root.destroy()
 
 def main():
@@ -0,0 +1,46 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    """Коммиты в тестовых репозиториях не зависят от настроек git пользователя"""
+    for name in ('GIT_AUTHOR_NAME', 'GIT_COMMITTER_NAME'):
+        monkeypatch.setenv(name, 'Watcher Test')
+    for name in ('GIT_AUTHOR_EMAIL', 'GIT_COMMITTER_EMAIL'):
+        monkeypatch.setenv(name, 'watcher@example.com')
+    monkeypatch.setenv('GIT_CONFIG_GLOBAL', os.devnull)
+
+def git(cwd, *args):
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+def make_repo(path, dirs=(), branch='main'):
+    """Репозиторий с одним коммитом; dirs - каталоги с файлом внутри"""
+    os.makedirs(path, exist_ok=True)
+    git(path, 'init', '-q', '-b', branch)
+    with open(os.path.join(path, 'README'), 'w') as f:
+        f.write('readme\n')
+    for name in dirs:
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+        with open(os.path.join(path, name, 'file.txt'), 'w') as f:
+            f.write(name)
+    git(path, 'add', '-A')
+    git(path, 'commit', '-qm', 'init')
+    return str(path)
+
+@pytest.fixture
+def remote_url(tmp_path):
+    """Bare remote с несколькими коммитами; partial clone разрешен"""
+    work = make_repo(tmp_path / 'seed', dirs=('src', 'docs'))
+    for i in range(3):
+        with open(os.path.join(work, 'src', 'file.txt'), 'a') as f:
+            f.write(f'change {i}\n')
+        git(work, 'commit', '-qam', f'change {i}')
+    remote = str(tmp_path / 'remote.git')
+    git(tmp_path, 'clone', '-q', '--bare', work, remote)
+    git(remote, 'config', 'uploadpack.allowFilter', 'true')
+    return f'file://{remote}'
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+from git import Repo
+
+from watcher_core import SharedRepoStore
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedRepoStore(str(tmp_path / 'store'), log=lambda message: None)
+
+@pytest.mark.parametrize('options', [{'depth': 1}, {'filter': 'blob:none'}], ids=['shallow', 'partial'])
+def test_second_clone_uses_store_mode(tmp_path, store, remote_url, options):
+    store.add_worktree(remote_url, 'main', str(tmp_path / 'first'), options)
+    mode = store.store_options(Repo(store.store_path(remote_url)))
+    assert {key: mode[key] for key in options} == options
+    
+    # Без режима или с тем же режимом папка создается из хранилища; ветка main уже занята первой папкой
+    for name, second_options in (('second', None), ('third', options)):
+        repo = store.add_worktree(remote_url, 'main', str(tmp_path / name), second_options)
+        assert repo.active_branch.name == 'main'
+        assert os.path.exists(os.path.join(repo.working_tree_dir, 'src', 'file.txt'))
+
+@pytest.mark.parametrize('first_options, second_options', [
+    ({'depth': 1}, {'filter': 'blob:none'}),
+    ({'filter': 'blob:none'}, {'depth': 1}),
+    ({}, {'depth': 1}),
+    ({'depth': 1}, {'depth': 2}),
+], ids=['shallow-then-partial', 'partial-then-shallow', 'full-then-shallow', 'other-depth'])
+def test_incompatible_mode_rejected(tmp_path, store, remote_url, first_options, second_options):
+    store.add_worktree(remote_url, 'main', str(tmp_path / 'first'), first_options)
+    with pytest.raises(ValueError):
+        store.add_worktree(remote_url, 'main', str(tmp_path / 'second'), second_options)
+    assert not os.path.exists(tmp_path / 'second')
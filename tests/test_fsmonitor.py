@@ -0,0 +1,43 @@
+import os
+import threading
+
+from git import Repo
+
+from conftest import git, make_repo
+from watcher_core import FsMonitorProvider
+
+def test_cookies_not_staged_during_sync(tmp_path):
+    work = make_repo(tmp_path / 'work', dirs=('d0', 'd1', 'd2', 'd3'))
+    provider = FsMonitorProvider(str(tmp_path / 'data'))
+    provider.COOKIE_TIMEOUT = 0.2
+    assert provider.configure(Repo(work))
+    watch_dirs = [work] + [os.path.join(work, f'd{i}') for i in range(4)]
+    provider.add_folder(work, watch_dirs)
+    journal = provider.journals[os.path.normcase(os.path.normpath(work))]
+    
+    # Событий cookie нет (нет observer), поэтому каждый sync держит cookie-файлы COOKIE_TIMEOUT
+    stop = threading.Event()
+    def run_sync():
+        while not stop.is_set():
+            provider.sync(journal)
+    thread = threading.Thread(target=run_sync)
+    thread.start()
+    try:
+        for _ in range(20):
+            git(work, 'add', '-A')
+            assert FsMonitorProvider.COOKIE_PREFIX not in git(work, 'status', '--porcelain', '--untracked-files=all')
+    finally:
+        stop.set()
+        thread.join()
+    
+    assert FsMonitorProvider.COOKIE_PREFIX not in git(work, 'diff', '--cached', '--name-only')
+    assert not [name for name in os.listdir(work) if FsMonitorProvider.is_cookie(name)]
+
+def test_exclude_pattern_added_once(tmp_path):
+    work = make_repo(tmp_path / 'work')
+    provider = FsMonitorProvider(str(tmp_path / 'data'))
+    provider.configure(Repo(work))
+    provider.configure(Repo(work))
+    with open(os.path.join(work, '.git', 'info', 'exclude'), encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines.count(f"{FsMonitorProvider.COOKIE_PREFIX}*") == 1
@@ -0,0 +1,38 @@
+import hashlib
+import os
+
+import pytest
+
+from watcher_core import WatcherEngine
+
+@pytest.fixture
+def engine(tmp_path):
+    install_dir = tmp_path / 'install'
+    install_dir.mkdir()
+    return WatcherEngine(str(install_dir / 'watcher_config.json'), log=lambda message: None,
+                         install_dir=str(install_dir))
+
+@pytest.mark.parametrize('rel_path', ['../outside.py', 'sub/../../outside.py', '/tmp/outside.py', '..', ''])
+def test_manifest_path_outside_install_dir_rejected(tmp_path, engine, monkeypatch, rel_path):
+    content = b'print("update")\n'
+    manifest = {'version': '9.9.9', 'files': {
+        'watcher_core_extra.py': hashlib.sha256(content).hexdigest(),
+        rel_path: hashlib.sha256(content).hexdigest(),
+    }}
+    downloads = []
+    def download(tip, path, target_path):
+        downloads.append(path)
+        with open(target_path, 'wb') as f:
+            f.write(content)
+    monkeypatch.setattr(engine, 'read_remote_manifest', lambda tip: manifest)
+    monkeypatch.setattr(engine, 'download_release_file', download)
+    
+    with pytest.raises(ValueError):
+        engine.perform_self_update('9.9.9', tip='abc')
+    assert downloads == []
+    assert not os.path.exists(tmp_path / 'outside.py')
+    assert not os.path.exists(os.path.join(engine.install_dir, 'watcher_core_extra.py'))
+
+def test_manifest_path_inside_install_dir_accepted(engine):
+    engine.check_update_path('watcher_core.py')
+    engine.check_update_path('lib/helpers.py')
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+from git import Repo
+
+from watcher_core import SharedRepoStore
+
+@pytest.mark.parametrize('options', [{'depth': 1}, {'filter': 'blob:none'}, {}],
+                         ids=['shallow', 'partial', 'full'])
+def test_second_clone_of_checked_out_branch(tmp_path, remote_url, options):
+    store = SharedRepoStore(str(tmp_path / 'store'), log=lambda message: None)
+    first = store.add_worktree(remote_url, 'main', str(tmp_path / 'first'), options)
+    second = store.add_worktree(remote_url, 'main', str(tmp_path / 'second'), options)
+    
+    assert second.active_branch.name == 'main'
+    assert second.head.commit.hexsha == first.head.commit.hexsha
+    assert not os.path.exists(os.path.join(second.git_dir, 'objects', 'info', 'alternates'))
+    assert open(os.path.join(second.working_tree_dir, 'src', 'file.txt')).read().count('change') == 3
+    
+    mode = store.store_options(Repo(store.store_path(remote_url)))
+    assert mode['depth'] == options.get('depth', 0)
+    assert mode['filter'] == options.get('filter', '')
+    assert os.path.exists(os.path.join(second.git_dir, 'shallow')) == bool(options.get('depth'))
+    
+    third = store.add_worktree(remote_url, 'feature', str(tmp_path / 'third'), options)
+    fourth = store.add_worktree(remote_url, 'feature', str(tmp_path / 'fourth'), options)
+    assert third.active_branch.name == fourth.active_branch.name == 'feature'
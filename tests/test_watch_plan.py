@@ -0,0 +1,44 @@
+import os
+
+from conftest import make_repo
+from watcher_core import ChangeHandler, IgnoreMatcher, WatchPlanner
+
+class Collector:
+    def __init__(self):
+        self.events = []
+
+    def add_event(self, folder_path, event_type, path):
+        self.events.append((event_type, path))
+
+def test_repo_with_many_top_level_dirs_has_one_watch(tmp_path):
+    work = make_repo(tmp_path / 'work', dirs=[f'd{i}' for i in range(15)])
+    for split in (True, False):
+        plan, saved = WatchPlanner(IgnoreMatcher(work), split=split).plan(work)
+        assert plan == [(work, True)]
+        assert saved == 0
+
+def test_large_ignored_dir_split_only_with_inotify(tmp_path):
+    work = make_repo(tmp_path / 'work', dirs=[f'd{i}' for i in range(15)])
+    with open(os.path.join(work, '.gitignore'), 'w') as f:
+        f.write('node_modules/\n')
+    for i in range(25):
+        os.makedirs(os.path.join(work, 'node_modules', f'pkg{i}'))
+    
+    plan, saved = WatchPlanner(IgnoreMatcher(work), split=True).plan(work)
+    assert (work, False) in plan
+    assert len(plan) == 16
+    assert saved == 26
+    
+    plan, saved = WatchPlanner(IgnoreMatcher(work), split=False).plan(work)
+    assert plan == [(work, True)]
+
+def test_git_dir_events_dropped(tmp_path):
+    work = make_repo(tmp_path / 'work')
+    collector = Collector()
+    handler = ChangeHandler(collector)
+    handler.add_folder(work, IgnoreMatcher(work))
+    handler.route('modified', os.path.join(work, '.git', 'index'))
+    handler.route_directory(os.path.join(work, '.git', 'objects', 'ab'))
+    handler.route('modified', os.path.join(work, 'README'))
+    assert collector.events == [('modified', os.path.join(work, 'README'))]
+    assert handler.events_ignored == 2
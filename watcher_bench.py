@@ -0,0 +1,244 @@
+"""Офлайн-бенчмарк пути запись -> обнаружение -> коммит -> пуш.
+
+Создает синтетические репозитории с локальными bare-репозиториями в роли remote,
+запускает WatcherEngine без GUI, генерирует шторм изменений и пишет результаты в JSON.
+
+    python watcher_bench.py --folders 4 --files 2000 --storm 200 --rounds 3 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+from git import Repo
+from watcher_core import WatcherEngine
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Бенчмарк GitHub Auto-Commit Watcher (без сети)")
+    parser.add_argument("--folders", type=int, default=4, help="число отслеживаемых папок")
+    parser.add_argument("--files", type=int, default=1000, help="файлов в каждом репозитории")
+    parser.add_argument("--size", type=int, default=2048, help="размер файла, байт")
+    parser.add_argument("--depth", type=int, default=3, help="глубина дерева каталогов")
+    parser.add_argument("--fanout", type=int, default=4, help="подкаталогов на каждом уровне")
+    parser.add_argument("--storm", type=int, default=100, help="изменяемых файлов за раунд в каждой папке")
+    parser.add_argument("--create", type=int, default=10, help="создаваемых файлов за раунд в каждой папке")
+    parser.add_argument("--rounds", type=int, default=3, help="число раундов шторма")
+    parser.add_argument("--timeout", type=float, default=120, help="таймаут ожидания раунда, с")
+    parser.add_argument("--workdir", help="рабочая папка (по умолчанию временная, удаляется)")
+    parser.add_argument("--output", default="bench_results.json", help="файл результатов JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+def tree_dirs(depth, fanout):
+    dirs = ['']
+    level = ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, f"d{i}") for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+def build_repo(base, index, args, rnd):
+    """Синтетический репозиторий с bare-remote; возвращает (путь, список файлов)"""
+    remote_path = os.path.join(base, f"remote{index}.git")
+    work_path = os.path.join(base, f"folder{index}")
+    Repo.init(remote_path, bare=True)
+    repo = Repo.init(work_path)
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'bench')
+        config.set_value('user', 'email', 'bench@localhost')
+
+    dirs = tree_dirs(args.depth, args.fanout)
+    files = []
+    for i in range(args.files):
+        rel_path = os.path.join(rnd.choice(dirs), f"f{i}.dat")
+        full_path = os.path.join(work_path, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        files.append(rel_path)
+
+    repo.git.add(A=True)
+    repo.index.commit("initial")
+    repo.git.branch('-M', 'main')
+    repo.create_remote('origin', remote_path)
+    repo.git.push('-u', 'origin', 'main')
+    return work_path, files, dirs
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {'count': len(values), 'min': values[0], 'max': values[-1], 'mean': statistics.fmean(values),
+              'p50': values[len(values) // 2]}
+    result['p95'] = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in result.items()}
+
+def process_stats():
+    stats = {'cpu_seconds': round(time.process_time(), 3), 'threads': threading.active_count()}
+    if psutil is not None:
+        stats['rss_mb'] = round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux - килобайты, macOS - байты
+        stats['peak_rss_mb'] = round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+    return stats
+
+class BenchEngine(WatcherEngine):
+    """WatcherEngine, отмечающий момент окончания коммита и пуша каждой папки"""
+
+    def __init__(self, *args, **kwargs):
+        self.pushed_at = {}
+        super().__init__(*args, **kwargs)
+
+    def commit_and_push(self, folder_path, message, auto_push, push_limit=None):
+        result = super().commit_and_push(folder_path, message, auto_push, push_limit)
+        self.pushed_at[folder_path] = time.monotonic()
+        return result
+
+def run(args):
+    rnd = random.Random(args.seed)
+    base = args.workdir or tempfile.mkdtemp(prefix="watcher_bench_")
+    os.makedirs(base, exist_ok=True)
+
+    setup_started = time.monotonic()
+    folders = {}
+    for i in range(args.folders):
+        work_path, files, dirs = build_repo(base, i, args, rnd)
+        folders[work_path] = (files, dirs)
+    setup_time = time.monotonic() - setup_started
+
+    config_path = os.path.join(base, "bench_config.json")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'watched_folders': {
+            path: {'repo_path': path, 'folder_name': os.path.basename(path),
+                   'remote_url': os.path.join(base, f"remote{i}.git"), 'branch': 'main', 'changes': False}
+            for i, path in enumerate(folders)
+        }}, f)
+
+    log_lines = []
+    # Кэши и хранилища бенчмарка не должны попадать в папку программы
+    engine = BenchEngine(config_path, log=log_lines.append, install_dir=base)
+
+    detected = {}
+    committed = {}
+    condition = threading.Condition()
+
+    def on_update(folder_paths, head_changed=False):
+        now = time.monotonic()
+        with condition:
+            for folder_path in folder_paths:
+                data = engine.watched_folders.get(folder_path)
+                if head_changed:
+                    committed.setdefault(folder_path, now)
+                elif data is not None and data.get('changes'):
+                    detected.setdefault(folder_path, now)
+            condition.notify_all()
+
+    engine.add_listener(on_update)
+    start_started = time.monotonic()
+    engine.start_monitoring()
+    engine.wait_until_loaded()
+    startup_time = time.monotonic() - start_started
+    time.sleep(1.0)
+
+    rounds = []
+    baseline = process_stats()
+    for round_index in range(args.rounds):
+        # Перепроверки и пересканирование после коммита прошлого раунда не должны попасть в замер
+        settle_started = time.monotonic()
+        settled = engine.wait_until_idle(timeout=args.timeout)
+        settle_time = time.monotonic() - settle_started
+        with condition:
+            detected.clear()
+            committed.clear()
+        engine.pushed_at.clear()
+        events_before = engine.aggregator.get_stats()['events_received']
+
+        # Шторм: изменения и новые файлы во всех папках
+        written_at = {}
+        storm_started = time.monotonic()
+        for folder_path, (files, dirs) in folders.items():
+            for rel_path in rnd.sample(files, min(args.storm, len(files))):
+                with open(os.path.join(folder_path, rel_path), 'r+b') as f:
+                    f.write(os.urandom(64))
+            for i in range(args.create):
+                rel_path = os.path.join(rnd.choice(dirs), f"r{round_index}_{i}.dat")
+                os.makedirs(os.path.join(folder_path, os.path.dirname(rel_path)), exist_ok=True)
+                with open(os.path.join(folder_path, rel_path), 'wb') as f:
+                    f.write(os.urandom(args.size))
+                files.append(rel_path)
+            written_at[folder_path] = time.monotonic()
+        storm_time = time.monotonic() - storm_started
+
+        with condition:
+            condition.wait_for(lambda: len(detected) == len(folders), timeout=args.timeout)
+        detect_done = time.monotonic()
+        events = engine.aggregator.get_stats()['events_received'] - events_before
+
+        results, batch_time = engine.run_batch_commit(list(folders))
+
+        rounds.append({
+            'round': round_index + 1,
+            'settle_seconds': round(settle_time, 3),
+            'settled': settled,
+            'storm_seconds': round(storm_time, 3),
+            'events': events,
+            'events_per_second': round(events / max(detect_done - storm_started, 1e-6), 1),
+            'write_to_detect': percentiles([detected[path] - written_at[path] for path in detected]),
+            'write_to_commit': percentiles([committed[path] - written_at[path] for path in committed]),
+            'write_to_push': percentiles([engine.pushed_at[path] - written_at[path] for path in engine.pushed_at]),
+            'batch_commit_seconds': round(batch_time, 3),
+            'results': {result: sum(1 for _, r, _, _ in results if r == result) for _, result, _, _ in results},
+            'undetected': len(folders) - len(detected),
+            'process': process_stats(),
+        })
+        print(f"Раунд {round_index + 1}: событий {events}, обнаружение p50 "
+              f"{rounds[-1]['write_to_detect']['p50'] if rounds[-1]['write_to_detect'] else '-'} с, "
+              f"коммит+пуш {batch_time:.2f} с")
+
+    engine.shutdown()
+
+    report = {
+        'created_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'version': engine.CURRENT_VERSION,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')},
+        'setup_seconds': round(setup_time, 3),
+        'startup_seconds': round(startup_time, 3),
+        'baseline_process': baseline,
+        'rounds': rounds,
+        'log_lines': len(log_lines),
+    }
+
+    if not args.workdir:
+        shutil.rmtree(base, ignore_errors=True)
+    return report
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = run(args)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты записаны в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
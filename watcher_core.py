@@ -0,0 +1,3792 @@
+import os
+import re
+import sys
+import time
+import json
+import secrets
+import threading
+import shutil
+import subprocess
+import hashlib
+import fnmatch
+import queue
+import logging
+import logging.handlers
+import http.server
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, contextmanager
+from collections import deque
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from git import Repo, Git, GitCommandError, RemoteProgress
+
+class Metrics:
+    """Время git- и сетевых операций: гистограммы по операции и папке, счетчики ошибок.
+    
+    Папка в метках - ее путь: имена папок (и имена в конфигурации) могут повторяться.
+    Формат выгрузки - текстовый формат Prometheus (render_prometheus).
+    """
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    RECENT_SAMPLES = 200
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, operation, folder=''):
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.observe(operation, folder, time.monotonic() - started, error=True)
+            raise
+        self.observe(operation, folder, time.monotonic() - started)
+
+    def observe(self, operation, folder, seconds, error=False):
+        with self.lock:
+            entry = self.series.get((operation, folder))
+            if entry is None:
+                entry = {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0, 'errors': 0,
+                         'recent': deque(maxlen=self.RECENT_SAMPLES)}
+                self.series[(operation, folder)] = entry
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += seconds
+            entry['count'] += 1
+            entry['recent'].append(seconds)
+            if error:
+                entry['errors'] += 1
+
+    def snapshot(self):
+        """Строки для панели статистики: операция, папка, число, ошибки, среднее, p50/p95 последних замеров"""
+        with self.lock:
+            items = [(key, dict(entry, recent=sorted(entry['recent']))) for key, entry in self.series.items()]
+        
+        rows = []
+        for (operation, folder), entry in sorted(items):
+            recent = entry['recent']
+            rows.append({
+                'operation': operation,
+                'folder': folder,
+                'count': entry['count'],
+                'errors': entry['errors'],
+                'avg': entry['sum'] / entry['count'] if entry['count'] else 0.0,
+                'p50': recent[len(recent) // 2] if recent else 0.0,
+                'p95': recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+            })
+        return rows
+
+    @staticmethod
+    def escape_label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render_prometheus(self, counters=None):
+        """Текстовый формат Prometheus; counters - дополнительные счетчики {имя: значение}"""
+        lines = [
+            "# HELP filehive_operation_duration_seconds Длительность git- и сетевых операций",
+            "# TYPE filehive_operation_duration_seconds histogram",
+        ]
+        errors = []
+        with self.lock:
+            for (operation, folder), entry in sorted(self.series.items()):
+                labels = f'operation="{self.escape_label(operation)}",folder="{self.escape_label(folder)}"'
+                for bound, count in zip(self.BUCKETS, entry['buckets']):
+                    lines.append(f'filehive_operation_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'filehive_operation_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                lines.append(f'filehive_operation_duration_seconds_sum{{{labels}}} {entry["sum"]:.6f}')
+                lines.append(f'filehive_operation_duration_seconds_count{{{labels}}} {entry["count"]}')
+                errors.append(f'filehive_operation_errors_total{{{labels}}} {entry["errors"]}')
+        
+        lines.append("# HELP filehive_operation_errors_total Операции, завершившиеся ошибкой")
+        lines.append("# TYPE filehive_operation_errors_total counter")
+        lines.extend(errors)
+        
+        for name, value in (counters or {}).items():
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    """Выгрузка метрик: локальный HTTP endpoint (/metrics) и/или файл, перезаписываемый по таймеру"""
+
+    DEFAULT_SETTINGS = {
+        'port': 0,
+        'file': '',
+        'interval_seconds': 15,
+    }
+
+    def __init__(self, render, settings, log=print):
+        self.render = render
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.log = log
+        self.server = None
+        self.stop_event = threading.Event()
+        self.file_thread = None
+
+    def start(self):
+        if self.settings['port']:
+            render = self.render
+            
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?', 1)[0] != '/metrics':
+                        self.send_error(404)
+                        return
+                    body = render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                
+                def log_message(self, format, *args):
+                    pass
+            
+            try:
+                self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.settings['port']), Handler)
+            except OSError as e:
+                self.log(f"Не удалось открыть порт метрик {self.settings['port']}: {str(e)}")
+            else:
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                self.log(f"Метрики: http://127.0.0.1:{self.settings['port']}/metrics")
+        
+        if self.settings['file']:
+            self.file_thread = threading.Thread(target=self._write_loop, daemon=True)
+            self.file_thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.stop_event.set()
+        if self.file_thread:
+            self.file_thread.join()
+            self.file_thread = None
+
+    def write_file(self):
+        path = self.settings['file']
+        try:
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            self.log(f"Не удалось записать файл метрик: {str(e)}")
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.settings['interval_seconds']):
+            self.write_file()
+        self.write_file()
+
+
+class IgnoreMatcher:
+    """Скомпилированные правила исключений папки: .gitignore, .git/info/exclude и exclude из конфигурации"""
+
+    ALWAYS_IGNORED = ['.git/']
+
+    def __init__(self, root, extra_patterns=None):
+        self.root = root
+        self.flags = re.IGNORECASE if os.name == 'nt' else 0
+        self.rules = []
+        self.dir_cache = {}
+        
+        self.add_patterns(self.ALWAYS_IGNORED)
+        self.load_file(os.path.join(root, '.gitignore'))
+        self.load_file(os.path.join(root, '.git', 'info', 'exclude'))
+        self.add_patterns(extra_patterns or [])
+
+    def load_file(self, file_path, base=''):
+        """Загрузить файл правил; base - каталог файла относительно корня папки"""
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                self.add_patterns(f.read().splitlines(), base)
+        except OSError:
+            pass
+
+    def add_patterns(self, lines, base=''):
+        for line in lines:
+            rule = self.compile_rule(line, base)
+            if rule:
+                self.rules.append(rule)
+        self.dir_cache.clear()
+
+    def compile_rule(self, line, base):
+        line = line.rstrip('\n\r')
+        if not line.strip() or line.startswith('#'):
+            return None
+        if not line.endswith('\\ '):
+            line = line.rstrip()
+        
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+        
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+        
+        # Шаблон со слешем привязан к каталогу файла правил, без слеша - сравнивается с именем
+        anchored = '/' in line
+        line = line.lstrip('/')
+        regex = re.compile(self.translate(line) + r'\Z', self.flags)
+        return (base, regex, negate, dir_only, anchored)
+
+    @staticmethod
+    def translate(pattern):
+        """Перевод glob-шаблона gitignore в регулярное выражение"""
+        result = []
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            if c == '*':
+                if pattern.startswith('**/', i):
+                    result.append('(?:.*/)?')
+                    i += 3
+                    continue
+                if pattern.startswith('**', i):
+                    result.append('.*')
+                    i += 2
+                    continue
+                result.append('[^/]*')
+            elif c == '?':
+                result.append('[^/]')
+            elif c == '[':
+                end = pattern.find(']', i + 2)
+                if end == -1:
+                    result.append(re.escape(c))
+                else:
+                    body = pattern[i + 1:end]
+                    if body.startswith('!'):
+                        body = '^' + body[1:]
+                    result.append('[' + body.replace('\\', '\\\\') + ']')
+                    i = end
+            elif c == '\\' and i + 1 < n:
+                i += 1
+                result.append(re.escape(pattern[i]))
+            else:
+                result.append(re.escape(c))
+            i += 1
+        return ''.join(result)
+
+    def match_rules(self, rel_path, is_dir):
+        """Результат последнего подходящего правила: True/False, None - ни одно не подошло"""
+        name = rel_path.rsplit('/', 1)[-1]
+        result = None
+        for base, regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not rel_path.startswith(base + '/'):
+                    continue
+                subject = rel_path[len(base) + 1:] if anchored else name
+            else:
+                subject = rel_path if anchored else name
+            if regex.match(subject):
+                result = not negate
+        return result
+
+    def is_dir_ignored(self, rel_dir):
+        """Каталог исключен сам или через родителя (git не заходит в исключенные каталоги)"""
+        cached = self.dir_cache.get(rel_dir)
+        if cached is not None:
+            return cached
+        
+        parent = rel_dir.rsplit('/', 1)[0] if '/' in rel_dir else ''
+        ignored = bool(parent and self.is_dir_ignored(parent)) or bool(self.match_rules(rel_dir, True))
+        self.dir_cache[rel_dir] = ignored
+        return ignored
+
+    def is_ignored(self, rel_path, is_dir=False):
+        if not rel_path:
+            return False
+        if is_dir:
+            return self.is_dir_ignored(rel_path)
+        if '/' in rel_path and self.is_dir_ignored(rel_path.rsplit('/', 1)[0]):
+            return True
+        return bool(self.match_rules(rel_path, False))
+
+class WatchPlanner:
+    """Подбор набора watch-ей для папки, при котором большие исключенные каталоги не отслеживаются.
+    
+    Обычно папка покрывается одним рекурсивным watch. Если внутри есть крупный исключенный каталог
+    (venv, node_modules...), каталог отслеживается без рекурсии, а его неисключенные подкаталоги
+    планируются отдельно. Это имеет смысл только для inotify (split=True), где рекурсивный watch -
+    это watch на каждый каталог; в Windows рекурсивный watch - один handle, разбиение ничего не дает.
+    Мелкие исключенные каталоги и .git остаются внутри рекурсивных watch-ей: их события отбрасывает
+    ChangeHandler, а лишние emitter-ы (по потоку на каждый) дороже.
+    """
+
+    def __init__(self, matcher, prune_min_dirs=20, split=None):
+        self.matcher = matcher
+        self.prune_min_dirs = prune_min_dirs
+        self.split = sys.platform.startswith('linux') if split is None else split
+
+    def plan(self, root):
+        """Возвращает (список (путь, recursive), число каталогов без inotify-watch).
+        
+        Исключенные каталоги, оставшиеся вовсе без watch, после вызова лежат в self.pruned.
+        """
+        self.saved = 0
+        self.pruned = []
+        watches = self._plan_dir(root, '')
+        return watches, self.saved
+
+    def _child_dirs(self, abs_dir):
+        try:
+            with os.scandir(abs_dir) as entries:
+                return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return []
+
+    def _count_dirs(self, abs_dir):
+        count = 1
+        for entry in self._child_dirs(abs_dir):
+            count += self._count_dirs(entry.path)
+        return count
+
+    def _plan_dir(self, abs_dir, rel_dir):
+        if rel_dir:
+            self.matcher.load_file(os.path.join(abs_dir, '.gitignore'), rel_dir)
+        
+        split = False
+        child_watches = []
+        ignored_sizes = 0
+        ignored = []
+        for entry in self._child_dirs(abs_dir):
+            child_rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if self.matcher.is_ignored(child_rel, is_dir=True):
+                if entry.name == '.git' or not self.split:
+                    continue
+                size = self._count_dirs(entry.path)
+                if size >= self.prune_min_dirs:
+                    split = True
+                ignored_sizes += size
+                ignored.append(child_rel)
+                continue
+            
+            watches = self._plan_dir(entry.path, child_rel)
+            if watches != [(entry.path, True)]:
+                split = True
+            child_watches.extend(watches)
+        
+        if not split:
+            return [(abs_dir, True)]
+        
+        # Каталог отслеживается без рекурсии: исключенные подкаталоги не получают watch вовсе
+        self.saved += ignored_sizes
+        self.pruned.extend(ignored)
+        return [(abs_dir, False)] + child_watches
+
+class ChangeHandler(FileSystemEventHandler):
+    """Общий обработчик для всех отслеживаемых папок: событие относится к папке по префиксу пути.
+    
+    События в исключенных путях отбрасываются до агрегатора. Появление каталога в каталоге,
+    отслеживаемом без рекурсии, или изменение .gitignore сообщается через layout_callback,
+    чтобы набор watch-ей папки был построен заново. Создание, удаление и перемещение
+    неисключенных каталогов сообщается через directory_callback(folder_path, path).
+    Журнал fsmonitor (journal) получает все события папки, в том числе исключенные.
+    """
+
+    def __init__(self, aggregator, layout_callback=None, directory_callback=None, journal=None):
+        self.aggregator = aggregator
+        self.journal = journal
+        self.layout_callback = layout_callback
+        self.directory_callback = directory_callback
+        self.roots = {}
+        self.shallow_dirs = {}
+        self.events_ignored = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize_path(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    def add_folder(self, folder_path, matcher=None, shallow_dirs=()):
+        root = self.normalize_path(folder_path)
+        with self.lock:
+            self.roots[root] = (folder_path, matcher)
+            self.shallow_dirs[root] = {self.normalize_path(path) for path in shallow_dirs}
+
+    def remove_folder(self, folder_path):
+        root = self.normalize_path(folder_path)
+        with self.lock:
+            self.roots.pop(root, None)
+            self.shallow_dirs.pop(root, None)
+
+    def resolve_folder(self, path):
+        """Ближайшая отслеживаемая папка, содержащая path (вложенная папка имеет приоритет).
+        
+        Возвращает (нормализованный корень, путь папки, matcher) или None.
+        """
+        current = self.normalize_path(path)
+        with self.lock:
+            while True:
+                entry = self.roots.get(current)
+                if entry is not None:
+                    return (current,) + entry
+                parent = os.path.dirname(current)
+                if parent == current:
+                    return None
+                current = parent
+
+    @staticmethod
+    def relative_path(root, path):
+        return path[len(root):].lstrip(os.sep).replace(os.sep, '/')
+
+    @staticmethod
+    def is_git_internal(rel_path):
+        """Путь внутри .git (папки или вложенного репозитория): такие события не нужны ни журналу, ни агрегатору"""
+        return '.git' in rel_path.split('/')
+
+    def route(self, event_type, path):
+        resolved = self.resolve_folder(path)
+        if resolved is None:
+            return
+        root, folder_path, matcher = resolved
+        if self.is_git_internal(self.relative_path(root, self.normalize_path(path))):
+            self.events_ignored += 1
+            return
+        if self.journal is not None and self.journal.record(root, path):
+            return
+        
+        if matcher is not None:
+            rel_path = self.relative_path(root, self.normalize_path(path))
+            if matcher.is_ignored(rel_path):
+                self.events_ignored += 1
+                return
+            if rel_path.rsplit('/', 1)[-1] == '.gitignore':
+                self.notify_layout(folder_path)
+        
+        self.aggregator.add_event(folder_path, event_type, path)
+
+    def route_directory(self, path):
+        """Каталог создан/удален/перемещен: важно только для каталогов, отслеживаемых без рекурсии"""
+        resolved = self.resolve_folder(path)
+        if resolved is None:
+            return
+        root, folder_path, matcher = resolved
+        if self.is_git_internal(self.relative_path(root, self.normalize_path(path))):
+            self.events_ignored += 1
+            return
+        if self.journal is not None and self.journal.record(root, path, is_dir=True):
+            return
+        parent = os.path.dirname(self.normalize_path(path))
+        with self.lock:
+            shallow = parent in self.shallow_dirs.get(root, ())
+        if shallow:
+            self.notify_layout(folder_path)
+        
+        if self.directory_callback is None:
+            return
+        if matcher is not None and matcher.is_ignored(self.relative_path(root, self.normalize_path(path)), is_dir=True):
+            return
+        self.directory_callback(folder_path, path)
+
+    def notify_layout(self, folder_path):
+        if self.layout_callback:
+            self.layout_callback(folder_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.route('modified', event.src_path)
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.route_directory(event.src_path)
+        else:
+            self.route('created', event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.route_directory(event.src_path)
+        else:
+            self.route('deleted', event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.route_directory(event.src_path)
+            self.route_directory(event.dest_path)
+        else:
+            self.route('deleted', event.src_path)
+            self.route('created', event.dest_path)
+
+class PollingWatcher:
+    """Опрос папок, из которых события файловой системы не приходят (SMB/NFS, диски Windows в WSL, FUSE).
+    
+    Для папки хранится снимок: mtime каталогов и (mtime, размер) файлов. За один опрос проверяются
+    mtime всех каталогов и заново читаются только изменившиеся каталоги и недавно менявшиеся
+    ("горячие"); остальные каталоги перечитываются по кругу в пределах entries_per_poll записей -
+    так находятся изменения файлов на месте, которые mtime каталога не меняют. Интервал опроса
+    после изменений падает до min_interval, в простое растет до max_interval и не бывает меньше
+    длительности опроса / max_duty. Изменения передаются в ChangeHandler, как события watchdog.
+    """
+
+    DEFAULT_SETTINGS = {
+        'min_interval': 2.0,
+        'max_interval': 30.0,
+        'entries_per_poll': 5000,
+        'max_duty': 0.1,
+    }
+    HOT_SECONDS = 60
+    NETWORK_FILESYSTEMS = {'cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', '9p', 'drvfs', 'virtiofs', 'vboxsf',
+                           'davfs', 'ceph', 'glusterfs', 'afpfs', 'fuse.sshfs', 'fuse.rclone', 'fuse.davfs2',
+                           'fuse.vmhgfs-fuse'}
+
+    def __init__(self, handler, settings=None, log=print):
+        self.handler = handler
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.log = log
+        self.folders = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.polls = 0
+        self.entries_scanned = 0
+
+    @classmethod
+    def is_network_path(cls, path):
+        """Папка на сетевом или смонтированном диске, изменения на котором watchdog может не увидеть"""
+        path = os.path.realpath(path)
+        if os.name == 'nt':
+            if path.startswith('\\\\'):
+                return True
+            import ctypes
+            DRIVE_REMOTE = 4
+            return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + '\\') == DRIVE_REMOTE
+        
+        try:
+            with open('/proc/self/mounts', 'r', encoding='utf-8') as f:
+                mounts = [line.split()[1:3] for line in f]
+        except OSError:
+            return False
+        best, fstype = '', ''
+        for mount_point, kind in mounts:
+            mount_point = mount_point.replace('\\040', ' ')
+            inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+            if inside and len(mount_point) >= len(best):
+                best, fstype = mount_point, kind
+        return fstype in cls.NETWORK_FILESYSTEMS
+
+    def add_folder(self, folder_path, matcher=None):
+        """Начать опрос папки; повторный вызов (новые правила исключений) перечитывает все каталоги"""
+        with self.condition:
+            state = self.folders.get(folder_path)
+            if state is None:
+                state = {'dirs': {}, 'files': {}, 'children': {}, 'hot': {}, 'sweep': [], 'baseline': True,
+                         'interval': self.settings['min_interval'], 'last_duration': 0}
+                self.folders[folder_path] = state
+            state['matcher'] = matcher
+            state['full'] = True
+            state['next_due'] = time.monotonic()
+            self.condition.notify_all()
+
+    def remove_folder(self, folder_path):
+        with self.condition:
+            self.folders.pop(folder_path, None)
+
+    def is_polled(self, folder_path):
+        return folder_path in self.folders
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                if not self.folders:
+                    self.condition.wait()
+                    continue
+                folder_path, state = min(self.folders.items(), key=lambda item: item[1]['next_due'])
+                remaining = state['next_due'] - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+            self.poll(folder_path, state)
+
+    def poll(self, folder_path, state):
+        started = time.monotonic()
+        changes = 0
+        try:
+            if not os.path.isdir(folder_path):
+                # Диск недоступен: снимок сохраняется до его возвращения, удалений не сообщаем
+                pass
+            elif state['full']:
+                state['full'] = False
+                changes = self.full_scan(folder_path, state)
+                if state['baseline']:
+                    state['baseline'] = False
+                    state['hot'].clear()
+                    files = sum(len(files) for files in state['files'].values())
+                    self.log(f"Опрос {Path(folder_path).name}: каталогов {len(state['dirs'])}, файлов {files}, "
+                             f"снимок за {time.monotonic() - started:.2f} с")
+            else:
+                changes = self.incremental_scan(folder_path, state)
+        except Exception as e:
+            self.log(f"Ошибка опроса {Path(folder_path).name}: {str(e)}")
+        duration = time.monotonic() - started
+        
+        with self.condition:
+            if self.folders.get(folder_path) is not state:
+                return
+            if changes:
+                state['interval'] = self.settings['min_interval']
+            else:
+                state['interval'] = min(self.settings['max_interval'], state['interval'] * 1.5)
+            state['last_duration'] = duration
+            state['next_due'] = time.monotonic() + max(state['interval'], duration / self.settings['max_duty'])
+            self.polls += 1
+
+    def emitter(self, state):
+        if state['baseline']:
+            return lambda event_type, path: None
+        
+        def emit(event_type, path):
+            if event_type == 'directory':
+                self.handler.route_directory(path)
+            else:
+                self.handler.route(event_type, path)
+        return emit
+
+    def full_scan(self, folder_path, state):
+        """Перечитать все известные каталоги (и найти новые); первый проход только строит снимок"""
+        emit = self.emitter(state)
+        changes = 0
+        scanned = set()
+        for rel_dir in [''] + sorted(state['dirs']):
+            if rel_dir not in scanned and (rel_dir == '' or rel_dir in state['dirs']):
+                changes += self.scan_tree(folder_path, state, rel_dir, emit, scanned)[0]
+        return changes
+
+    def incremental_scan(self, folder_path, state):
+        emit = self.emitter(state)
+        now = time.monotonic()
+        changes = 0
+        scanned = set()
+        
+        # Создание, удаление и переименование меняют mtime каталога
+        for rel_dir, mtime in list(state['dirs'].items()):
+            if rel_dir in scanned or rel_dir not in state['dirs']:
+                continue
+            try:
+                current = os.stat(os.path.join(folder_path, rel_dir)).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                changes += self.scan_tree(folder_path, state, rel_dir, emit, scanned)[0]
+        
+        budget = self.settings['entries_per_poll']
+        for rel_dir, until in list(state['hot'].items()):
+            if until < now:
+                del state['hot'][rel_dir]
+            elif rel_dir not in scanned and rel_dir in state['dirs']:
+                found, entries = self.scan_tree(folder_path, state, rel_dir, emit, scanned)
+                changes += found
+                budget -= entries
+        
+        # Изменения файлов на месте: остальные каталоги по кругу, не больше бюджета записей
+        refilled = False
+        while budget > 0:
+            if not state['sweep']:
+                if refilled:
+                    break
+                state['sweep'] = list(state['dirs'])
+                refilled = True
+            rel_dir = state['sweep'].pop()
+            if rel_dir in scanned or rel_dir not in state['dirs']:
+                continue
+            found, entries = self.scan_tree(folder_path, state, rel_dir, emit, scanned)
+            changes += found
+            budget -= max(1, entries)
+        return changes
+
+    def scan_tree(self, folder_path, state, rel_dir, emit, scanned):
+        """Перечитать каталог; новые подкаталоги читаются целиком. Возвращает (изменений, записей)"""
+        changes = entries = 0
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            found, count, new_dirs = self.scan_dir(folder_path, state, current, emit)
+            scanned.add(current)
+            changes += found
+            entries += count
+            stack.extend(new_dirs)
+        self.entries_scanned += entries
+        return changes, entries
+
+    def scan_dir(self, folder_path, state, rel_dir, emit):
+        """Сравнить каталог со снимком; возвращает (изменений, записей, новые подкаталоги)"""
+        abs_dir = os.path.join(folder_path, rel_dir) if rel_dir else folder_path
+        matcher = state['matcher']
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime_ns
+            with os.scandir(abs_dir) as iterator:
+                entries = list(iterator)
+        except OSError:
+            return self.drop_dir(folder_path, state, rel_dir, emit), 0, []
+        if rel_dir and rel_dir not in state['dirs'] and matcher is not None:
+            matcher.load_file(os.path.join(abs_dir, '.gitignore'), rel_dir)
+        
+        old_files = state['files'].get(rel_dir, {})
+        files = {}
+        subdirs = set()
+        changes = 0
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if matcher is None or not matcher.is_ignored(rel_path, is_dir=True):
+                        subdirs.add(rel_path)
+                    continue
+                if matcher is not None and matcher.is_ignored(rel_path):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            old = old_files.get(entry.name)
+            if old is None:
+                emit('created', entry.path)
+                changes += 1
+            elif old != files[entry.name]:
+                emit('modified', entry.path)
+                changes += 1
+        for name in old_files.keys() - files.keys():
+            emit('deleted', os.path.join(abs_dir, name))
+            changes += 1
+        
+        state['dirs'][rel_dir] = dir_mtime
+        state['files'][rel_dir] = files
+        old_subdirs = state['children'].get(rel_dir, set())
+        state['children'][rel_dir] = subdirs
+        for child in old_subdirs - subdirs:
+            changes += self.drop_dir(folder_path, state, child, emit)
+        new_dirs = [child for child in subdirs if child not in state['dirs']]
+        for child in new_dirs:
+            emit('directory', os.path.join(folder_path, child))
+        changes += len(new_dirs)
+        if changes:
+            state['hot'][rel_dir] = time.monotonic() + self.HOT_SECONDS
+        return changes, len(entries), new_dirs
+
+    def drop_dir(self, folder_path, state, rel_dir, emit):
+        """Каталог исчез (или стал исключенным): удалить его поддерево из снимка"""
+        if rel_dir not in state['dirs']:
+            return 0
+        changes = 0
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            state['dirs'].pop(current, None)
+            state['hot'].pop(current, None)
+            for name in state['files'].pop(current, {}):
+                emit('deleted', os.path.join(folder_path, current, name))
+                changes += 1
+            stack.extend(state['children'].pop(current, ()))
+        emit('directory', os.path.join(folder_path, rel_dir))
+        return changes + 1
+
+class FsMonitorProvider:
+    """Провайдер core.fsmonitor (hook версии 2): git спрашивает, что изменилось с момента токена,
+    и получает ответ из журнала событий watchdog вместо обхода всего дерева.
+    
+    Хук fsmonitor_hook.py обращается к локальному HTTP endpoint, порт и секрет читает из STATE_FILE.
+    Перед ответом в каждый отслеживаемый каталог папки пишется cookie-файл: когда события cookie
+    дошли до журнала, все более ранние изменения в нем уже есть. Чтобы параллельные git status и
+    git add -A не увидели cookie, configure() добавляет их шаблон в info/exclude репозитория. Если точно ответить нельзя (токен
+    от другого запуска, журнал переполнен, watch-и перестраиваются, изменился каталог, часть папки
+    не отслеживается), ответ - "/", и git сам обходит дерево.
+    
+    Переполнение очереди событий ОС (IN_Q_OVERFLOW inotify, FILE_ACTION_OVERFLOW Windows) watchdog
+    не сообщает. Поэтому токены, выданные до всплеска событий (больше BURST_EVENTS за BURST_SECONDS
+    по всем папкам), и токены старше TOKEN_MAX_AGE считаются недействительными.
+    """
+
+    STATE_FILE = "fsmonitor_state.json"
+    HOOK_FILE = "fsmonitor_hook.py"
+    COOKIE_PREFIX = ".fsmonitor-cookie-"
+    TOKEN_PREFIX = "filehive:"
+    JOURNAL_LIMIT = 100000
+    COOKIE_TIMEOUT = 1.0
+    TOKEN_MAX_AGE = 3600
+    BURST_EVENTS = 2000
+    BURST_SECONDS = 1.0
+
+    def __init__(self, install_dir, log=print):
+        self.state_path = os.path.join(install_dir, self.STATE_FILE)
+        # Хук лежит рядом с программой, даже если данные хранятся в другом каталоге
+        self.hook_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.HOOK_FILE)
+        self.log = log
+        self.instance = secrets.token_hex(6)
+        self.secret = secrets.token_hex(16)
+        # нормализованный корень папки -> журнал событий
+        self.journals = {}
+        self.cookies = set()
+        self.cookie_counter = 0
+        self.burst_started = 0.0
+        self.burst_events = 0
+        # Время (мс) последнего события всплеска: токены, выданные не позже, недействительны
+        self.resync_ms = 0
+        self.condition = threading.Condition()
+        self.server = None
+        self.queries = 0
+        self.full_answers = 0
+
+    def hook_command(self):
+        """Значение core.fsmonitor: интерпретатор и хук (git запускает команду через shell и дописывает
+        аргументы в конец).
+        
+        Хук остается в конфигурации репозитория и после выхода из программы - тогда он просто отвечает
+        ошибкой и git обходит дерево сам. Если программу перенесли или удалили, команда молча завершается
+        с ошибкой, не запуская отсутствующий файл; при следующем запуске путь в конфигурации обновится.
+        """
+        executable = sys.executable
+        if os.path.basename(executable).lower() == 'pythonw.exe':
+            executable = os.path.join(os.path.dirname(executable), 'python.exe')
+        executable, hook, state = (f'"{path}"'.replace('\\', '/')
+                                   for path in (executable, self.hook_path, self.state_path))
+        return f'[ -f {executable} ] && [ -f {hook} ] || exit 1; exec {executable} {hook} {state}'
+
+    def configure(self, repo, enabled=True):
+        """Прописать (или убрать) хук и untracked cache в конфигурации репозитория.
+        
+        Чужой core.fsmonitor (watchman, встроенный демон git, явное false) не трогаем.
+        Возвращает True, если git репозитория будет спрашивать этот провайдер.
+        """
+        try:
+            output = repo.git.config('--get-regexp', r'^core\.(fsmonitor|fsmonitorhookversion|untrackedcache)$')
+        except GitCommandError:
+            # Код 1: ни одного ключа нет
+            output = ''
+        current = {}
+        for line in output.splitlines():
+            key, _, value = line.partition(' ')
+            current[key.lower()] = value
+        
+        command = self.hook_command()
+        configured = current.get('core.fsmonitor')
+        ours = configured is not None and self.HOOK_FILE in configured
+        if not enabled:
+            if ours:
+                repo.git.config('--unset', 'core.fsmonitor')
+            return False
+        if configured is not None and not ours:
+            return False
+        
+        self.exclude_cookies(repo)
+        if configured != command:
+            repo.git.config('core.fsmonitor', command)
+        if current.get('core.fsmonitorhookversion') != '2':
+            repo.git.config('core.fsmonitorHookVersion', '2')
+        if current.get('core.untrackedcache') != 'true':
+            repo.git.config('core.untrackedCache', 'true')
+        return True
+
+    @classmethod
+    def is_cookie(cls, path):
+        return os.path.basename(path).startswith(cls.COOKIE_PREFIX)
+
+    def exclude_cookies(self, repo):
+        """Шаблон cookie-файлов в info/exclude (общем для всех worktree репозитория)"""
+        pattern = f"{self.COOKIE_PREFIX}*"
+        exclude_path = os.path.join(repo.common_dir, 'info', 'exclude')
+        try:
+            with open(exclude_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = ''
+        if pattern in content.splitlines():
+            return
+        os.makedirs(os.path.dirname(exclude_path), exist_ok=True)
+        with open(exclude_path, 'a', encoding='utf-8') as f:
+            if content and not content.endswith('\n'):
+                f.write('\n')
+            f.write(f"# cookie-файлы fsmonitor GitHub Auto-Commit Watcher\n{pattern}\n")
+
+    def add_folder(self, folder_path, watch_dirs, exact=True):
+        """Начать журнал папки заново после постановки watch-ей; exact=False - отвечать только "/"
+        
+        Токены, выданные раньше, становятся недействительными: события могли быть потеряны.
+        """
+        root = ChangeHandler.normalize_path(folder_path)
+        with self.condition:
+            journal = self.journals.get(root)
+            if journal is None:
+                journal = {'folder_path': folder_path, 'seq': 0, 'entries': deque(maxlen=self.JOURNAL_LIMIT)}
+                self.journals[root] = journal
+            journal['seq'] += 1
+            journal['valid_from'] = journal['seq']
+            journal['entries'].clear()
+            journal['watch_dirs'] = list(watch_dirs)
+            journal['exact'] = exact
+
+    def suspend(self, folder_path):
+        """Watch-и папки будут перестроены: до нового add_folder события могут теряться"""
+        with self.condition:
+            journal = self.journals.get(ChangeHandler.normalize_path(folder_path))
+            if journal is not None:
+                journal['exact'] = False
+
+    def remove_folder(self, folder_path):
+        with self.condition:
+            self.journals.pop(ChangeHandler.normalize_path(folder_path), None)
+
+    def record(self, root, path, is_dir=False):
+        """Событие от ChangeHandler; True - это cookie провайдера, дальше его передавать не нужно"""
+        if self.is_cookie(path):
+            with self.condition:
+                self.cookies.discard(ChangeHandler.normalize_path(path))
+                self.condition.notify_all()
+            return True
+        
+        with self.condition:
+            journal = self.journals.get(root)
+            if journal is None:
+                return False
+            now = time.monotonic()
+            if now - self.burst_started > self.BURST_SECONDS:
+                self.burst_started = now
+                self.burst_events = 0
+            self.burst_events += 1
+            if self.burst_events > self.BURST_EVENTS:
+                # Очередь событий ОС могла переполниться, а потерянные события не видны
+                self.resync_ms = int(now * 1000)
+            journal['seq'] += 1
+            # Какие файлы внутри каталога затронуты, неизвестно: такой интервал - только полный обход
+            rel_path = None if is_dir else ChangeHandler.relative_path(root, os.path.normpath(path))
+            journal['entries'].append((journal['seq'], rel_path))
+        return False
+
+    def changes_since(self, journal, token):
+        """Пути, измененные после токена; None - ответить точно нельзя"""
+        prefix = f"{self.TOKEN_PREFIX}{self.instance}:"
+        if not journal['exact'] or not token.startswith(prefix):
+            return None
+        try:
+            since, issued_ms = (int(part) for part in token[len(prefix):].split(':'))
+        except ValueError:
+            return None
+        if issued_ms <= self.resync_ms or time.monotonic() * 1000 - issued_ms > self.TOKEN_MAX_AGE * 1000:
+            return None
+        
+        entries = journal['entries']
+        oldest = entries[0][0] if entries else journal['seq'] + 1
+        if since < journal['valid_from'] or since > journal['seq'] or since < oldest - 1:
+            return None
+        
+        paths = set()
+        for seq, rel_path in reversed(entries):
+            if seq <= since:
+                break
+            if rel_path is None:
+                return None
+            paths.add(rel_path)
+        return sorted(paths)
+
+    def sync(self, journal):
+        """Записать cookie в каждый отслеживаемый каталог и дождаться их событий"""
+        with self.condition:
+            self.cookie_counter += 1
+            name = f"{self.COOKIE_PREFIX}{os.getpid()}-{self.cookie_counter}"
+            cookies = {ChangeHandler.normalize_path(os.path.join(path, name)): os.path.join(path, name)
+                       for path in journal['watch_dirs']}
+            self.cookies.update(cookies)
+        
+        written = []
+        try:
+            for path in cookies.values():
+                with open(path, 'w'):
+                    pass
+                written.append(path)
+            with self.condition:
+                return self.condition.wait_for(lambda: self.cookies.isdisjoint(cookies), self.COOKIE_TIMEOUT)
+        except OSError:
+            return False
+        finally:
+            with self.condition:
+                self.cookies.difference_update(cookies)
+            for path in written:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def query(self, root_path, token):
+        """Ответ хуку: новый токен и измененные пути, каждый с NUL в конце; None - папка не отслеживается"""
+        with self.condition:
+            journal = self.journals.get(ChangeHandler.normalize_path(root_path))
+            if journal is None:
+                return None
+            self.queries += 1
+            synced = journal['exact'] and bool(journal['watch_dirs'])
+        
+        synced = synced and self.sync(journal)
+        with self.condition:
+            # Новый токен берется после синхронизации: все изменения до него уже в журнале
+            seq = journal['seq']
+            issued_ms = int(time.monotonic() * 1000)
+            paths = self.changes_since(journal, token) if synced else None
+            if paths is None:
+                self.full_answers += 1
+                paths = ['/']
+        items = [f"{self.TOKEN_PREFIX}{self.instance}:{seq}:{issued_ms}"] + paths
+        return ''.join(f"{item}\0" for item in items).encode('utf-8')
+
+    def start(self):
+        """Endpoint для хука на свободном локальном порту; порт и секрет записываются в STATE_FILE"""
+        provider = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError:
+                    self.send_error(400)
+                    return
+                if (self.path != '/fsmonitor' or not isinstance(request, dict)
+                        or not secrets.compare_digest(str(request.get('secret', '')), provider.secret)):
+                    self.send_error(403)
+                    return
+                body = provider.query(str(request.get('root', '')), str(request.get('token', '')))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        try:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        except OSError as e:
+            self.log(f"fsmonitor: не удалось открыть порт: {str(e)}")
+            return
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+        state = {'port': self.server.server_address[1], 'secret': self.secret, 'pid': os.getpid()}
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(f"{self.state_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(f"{self.state_path}.tmp", self.state_path)
+        except OSError as e:
+            self.log(f"fsmonitor: не удалось записать {self.STATE_FILE}: {str(e)}")
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        # Файл мог перезаписать другой запущенный экземпляр программы
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                ours = json.load(f).get('secret') == self.secret
+            if ours:
+                os.remove(self.state_path)
+        except (OSError, ValueError):
+            pass
+
+class ChangeAggregator:
+    """Собирает события файловой системы по папкам и выдает одно уведомление после паузы"""
+
+    # Результат наложения нового события на уже накопленное для того же пути
+    MERGE_RULES = {
+        ('created', 'modified'): 'created',
+        ('created', 'deleted'): None,
+        ('deleted', 'created'): 'modified',
+        ('modified', 'deleted'): 'deleted',
+    }
+
+    def __init__(self, callback, quiet_period=1.0, max_delay=10.0):
+        self.callback = callback
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.pending = {}
+        self.events_received = 0
+        self.notifications_emitted = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def add_event(self, folder_path, event_type, path):
+        now = time.monotonic()
+        with self.condition:
+            self.events_received += 1
+            batch = self.pending.get(folder_path)
+            if batch is None:
+                batch = {'changes': {}, 'events': 0, 'first': now, 'last': now}
+                self.pending[folder_path] = batch
+            batch['events'] += 1
+            batch['last'] = now
+            
+            previous = batch['changes'].get(path)
+            merged = self.MERGE_RULES.get((previous, event_type), event_type) if previous else event_type
+            if merged is None:
+                del batch['changes'][path]
+            else:
+                batch['changes'][path] = merged
+            self.condition.notify()
+
+    def discard(self, folder_path):
+        """Забыть накопленные события папки (например, после удаления из отслеживания)"""
+        with self.condition:
+            self.pending.pop(folder_path, None)
+
+    def pending_paths(self, folder_path):
+        """Пути, события которых накоплены, но еще не выданы"""
+        with self.condition:
+            batch = self.pending.get(folder_path)
+            return set(batch['changes']) if batch else set()
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'events_received': self.events_received,
+                'notifications_emitted': self.notifications_emitted,
+                'pending_folders': len(self.pending),
+            }
+
+    def _due_time(self, batch):
+        return min(batch['last'] + self.quiet_period, batch['first'] + self.max_delay)
+
+    def _run(self):
+        while True:
+            ready = []
+            with self.condition:
+                if not self.running:
+                    return
+                
+                now = time.monotonic()
+                timeout = None
+                for folder_path, batch in list(self.pending.items()):
+                    due = self._due_time(batch)
+                    if due <= now:
+                        ready.append((folder_path, self.pending.pop(folder_path)))
+                    elif timeout is None or due - now < timeout:
+                        timeout = due - now
+                
+                # Файлы, созданные и удаленные внутри одной паузы, изменений не дают
+                ready = [(path, batch) for path, batch in ready if batch['changes']]
+                if not ready:
+                    self.condition.wait(timeout)
+                    continue
+                
+                self.notifications_emitted += len(ready)
+            
+            # Колбэк вызывается вне блокировки, чтобы watchdog не ждал GUI
+            for folder_path, batch in ready:
+                try:
+                    self.callback(folder_path, batch['changes'], batch['events'])
+                except Exception:
+                    pass
+
+class StatusEngine:
+    """Фоновая проверка реального состояния рабочей копии.
+    
+    Проверяются только пути, о которых сообщил watcher: git status запускается с pathspec
+    этих путей, а пути, чей stat (mtime, размер) не изменился с прошлой проверки, берутся из кэша.
+    Полное сканирование выполняется только при старте и после коммита/pull/смены ветки.
+    """
+
+    FULL = None
+    STATES = ('modified', 'added', 'deleted', 'untracked')
+    PATHSPEC_CHUNK = 200
+
+    def __init__(self, repo_getter, callback, metrics=None):
+        self.repo_getter = repo_getter
+        self.callback = callback
+        self.metrics = metrics
+        self.dirty = {}
+        self.stat_cache = {}
+        self.pending = {}
+        self.busy = False
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def is_idle(self):
+        """Нет ни ожидающих, ни выполняющихся проверок"""
+        with self.condition:
+            return not self.pending and not self.busy
+
+    def verify_paths(self, folder_path, paths):
+        """Проверить только перечисленные абсолютные пути"""
+        with self.condition:
+            if folder_path in self.pending and self.pending[folder_path] is self.FULL:
+                return
+            self.pending.setdefault(folder_path, set()).update(paths)
+            self.condition.notify()
+
+    def rescan(self, folder_path):
+        """Полная проверка папки (после коммита, pull, смены ветки)"""
+        with self.condition:
+            self.pending[folder_path] = self.FULL
+            self.condition.notify()
+
+    def discard(self, folder_path):
+        with self.condition:
+            self.pending.pop(folder_path, None)
+            self.dirty.pop(folder_path, None)
+            self.stat_cache.pop(folder_path, None)
+
+    def get_summary(self, folder_path):
+        with self.condition:
+            return self._summary(self.dirty.get(folder_path, {}))
+
+    def dirty_paths(self, folder_path):
+        """Относительные пути, которые последняя проверка нашла измененными"""
+        with self.condition:
+            return set(self.dirty.get(folder_path, {}))
+
+    def _summary(self, entries):
+        summary = {state: 0 for state in self.STATES}
+        summary['bytes'] = 0
+        for state, size in entries.values():
+            summary[state] += 1
+            summary['bytes'] += size
+        summary['total'] = len(entries)
+        return summary
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                folder_path = next(iter(self.pending))
+                paths = self.pending.pop(folder_path)
+                self.busy = True
+            
+            try:
+                repo = self.repo_getter(folder_path)
+                if repo is None or repo.working_tree_dir is None:
+                    continue
+                if paths is self.FULL:
+                    self._scan_full(folder_path, repo)
+                else:
+                    self._scan_paths(folder_path, repo, paths)
+                self.callback(folder_path, self.get_summary(folder_path))
+            except Exception:
+                continue
+            finally:
+                with self.condition:
+                    self.busy = False
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _git_status(self, folder_path, repo, rel_paths=None):
+        """Разбор git status --porcelain -z: {относительный путь: состояние}"""
+        command = ['git', '--literal-pathspecs', 'status', '--porcelain', '-z',
+                   '--no-renames', '--untracked-files=all']
+        if rel_paths is not None:
+            command += ['--'] + rel_paths
+        operation = 'status_full' if rel_paths is None else 'status'
+        with self.metrics.timer(operation, folder_path) if self.metrics else nullcontext():
+            output = repo.git.execute(command)
+        
+        result = {}
+        for record in output.split('\0'):
+            if len(record) < 4:
+                continue
+            code, rel_path = record[:2], record[3:]
+            if code == '??':
+                if FsMonitorProvider.is_cookie(rel_path):
+                    # cookie fsmonitor, если шаблон из info/exclude кто-то удалил
+                    continue
+                result[rel_path] = 'untracked'
+            elif 'D' in code:
+                result[rel_path] = 'deleted'
+            elif code[0] == 'A':
+                result[rel_path] = 'added'
+            else:
+                result[rel_path] = 'modified'
+        return result
+
+    def _entry(self, repo, rel_path, state):
+        stat = self._stat(os.path.join(repo.working_tree_dir, rel_path))
+        size = stat[1] if stat and state != 'deleted' else 0
+        return stat, (state, size)
+
+    def _scan_full(self, folder_path, repo):
+        entries = {}
+        cache = {}
+        for rel_path, state in self._git_status(folder_path, repo).items():
+            stat, entries[rel_path] = self._entry(repo, rel_path, state)
+            cache[rel_path] = (stat, state)
+        
+        with self.condition:
+            self.dirty[folder_path] = entries
+            self.stat_cache[folder_path] = cache
+
+    def _scan_paths(self, folder_path, repo, paths):
+        root = repo.working_tree_dir
+        with self.condition:
+            entries = dict(self.dirty.get(folder_path, {}))
+            cache = dict(self.stat_cache.get(folder_path, {}))
+        
+        to_check = []
+        directories = set()
+        for path in paths:
+            rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+            if rel_path.startswith('../'):
+                continue
+            if os.path.isdir(path) or any(known.startswith(rel_path + '/') for known in entries):
+                # Каталог (или удаленный каталог с известными файлами): stat каталога ничего не говорит о файлах
+                directories.add(rel_path)
+            else:
+                cached = cache.get(rel_path)
+                if cached is not None and cached[0] == self._stat(path):
+                    continue
+            to_check.append(rel_path)
+        
+        for i in range(0, len(to_check), self.PATHSPEC_CHUNK):
+            chunk = to_check[i:i + self.PATHSPEC_CHUNK]
+            states = self._git_status(folder_path, repo, chunk)
+            prefixes = tuple(rel_path + '/' for rel_path in chunk if rel_path in directories)
+            if prefixes:
+                # Файлы каталога заново перечислены git status: прежние записи о них заменяются
+                for known in [known for known in entries if known.startswith(prefixes)]:
+                    del entries[known]
+                for known in [known for known in cache if known.startswith(prefixes)]:
+                    del cache[known]
+                for rel_path, state in states.items():
+                    if rel_path.startswith(prefixes):
+                        stat, entries[rel_path] = self._entry(repo, rel_path, state)
+                        cache[rel_path] = (stat, state)
+            for rel_path in chunk:
+                if rel_path in directories:
+                    continue
+                state = states.get(rel_path)
+                if state is None:
+                    entries.pop(rel_path, None)
+                    cache[rel_path] = (self._stat(os.path.join(root, rel_path)), None)
+                else:
+                    stat, entries[rel_path] = self._entry(repo, rel_path, state)
+                    cache[rel_path] = (stat, state)
+        
+        with self.condition:
+            self.dirty[folder_path] = entries
+            self.stat_cache[folder_path] = cache
+
+class GitWorkerPool:
+    """Долгоживущие процессы git cat-file --batch по репозиториям.
+    
+    Чтение HEAD и метаданных коммита идет через уже запущенный процесс репозитория, а не через
+    новый git на каждый вызов. Процессы, простаивающие дольше idle_seconds, завершаются.
+    """
+
+    def __init__(self, idle_seconds=120, metrics=None):
+        self.idle_seconds = idle_seconds
+        self.metrics = metrics
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.evict_thread = None
+        self.processes_started = 0
+
+    @staticmethod
+    def repo_key(repo):
+        return os.path.normcase(os.path.abspath(repo.working_tree_dir or repo.git_dir))
+
+    def worker(self, repo):
+        key = self.repo_key(repo)
+        with self.lock:
+            worker = self.workers.get(key)
+            if worker is None:
+                worker = {'process': None, 'lock': threading.Lock(), 'last_used': time.monotonic(),
+                          'cwd': repo.working_tree_dir or repo.git_dir}
+                self.workers[key] = worker
+            if self.evict_thread is None:
+                self.evict_thread = threading.Thread(target=self._evict_loop, daemon=True)
+                self.evict_thread.start()
+        return worker
+
+    def _start_process(self, worker):
+        worker['process'] = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=worker['cwd'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        self.processes_started += 1
+
+    @staticmethod
+    def _stop_process(worker):
+        process, worker['process'] = worker['process'], None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=2)
+        except Exception:
+            process.kill()
+
+    def read_object(self, repo, rev):
+        """(sha, тип, содержимое) объекта rev или None, если объекта нет"""
+        worker = self.worker(repo)
+        with worker['lock'], self.metrics.timer('cat_file') if self.metrics else nullcontext():
+            for attempt in range(2):
+                if worker['process'] is None or worker['process'].poll() is not None:
+                    self._start_process(worker)
+                process = worker['process']
+                try:
+                    process.stdin.write(rev.encode('utf-8') + b'\n')
+                    process.stdin.flush()
+                    header = process.stdout.readline().decode('utf-8').split()
+                    if len(header) != 3:
+                        # "<rev> missing" - процесс остается пригодным
+                        if header and header[-1] in ('missing', 'ambiguous'):
+                            worker['last_used'] = time.monotonic()
+                            return None
+                        raise OSError(f"git cat-file: неожиданный ответ {header}")
+                    sha, object_type, size = header
+                    data = process.stdout.read(int(size) + 1)[:-1]
+                    worker['last_used'] = time.monotonic()
+                    return sha, object_type, data
+                except OSError:
+                    # Процесс завершился (например, репозиторий был перемещен): один перезапуск
+                    self._stop_process(worker)
+                    if attempt:
+                        raise
+
+    def head_commit(self, repo):
+        """Метаданные коммита HEAD: {'sha', 'committed_datetime', 'summary'} или None (коммитов нет)"""
+        result = self.read_object(repo, 'HEAD')
+        if result is None or result[1] != 'commit':
+            return None
+        sha, _, data = result
+        headers, _, message = data.decode('utf-8', errors='replace').partition('\n\n')
+        info = {'sha': sha, 'summary': message.split('\n', 1)[0], 'committed_datetime': None}
+        for line in headers.split('\n'):
+            if line.startswith('committer '):
+                timestamp, offset = line.rsplit(' ', 2)[-2:]
+                sign = -1 if offset.startswith('-') else 1
+                tz = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+                info['committed_datetime'] = datetime.fromtimestamp(int(timestamp), tz)
+        return info
+
+    def head_sha(self, repo):
+        info = self.read_object(repo, 'HEAD')
+        return info[0] if info else None
+
+    def discard(self, repo):
+        with self.lock:
+            worker = self.workers.pop(self.repo_key(repo), None)
+        if worker is not None:
+            with worker['lock']:
+                self._stop_process(worker)
+
+    def _evict_loop(self):
+        while not self.stop_event.wait(min(30, self.idle_seconds)):
+            now = time.monotonic()
+            with self.lock:
+                workers = list(self.workers.values())
+            for worker in workers:
+                if worker['process'] is not None and now - worker['last_used'] > self.idle_seconds:
+                    # Занятый процесс не трогаем - выгрузим на следующем проходе
+                    if worker['lock'].acquire(blocking=False):
+                        try:
+                            self._stop_process(worker)
+                        finally:
+                            worker['lock'].release()
+
+    def close_all(self):
+        self.stop_event.set()
+        with self.lock:
+            workers, self.workers = list(self.workers.values()), {}
+        for worker in workers:
+            with worker['lock']:
+                self._stop_process(worker)
+
+    def active_count(self):
+        with self.lock:
+            return sum(1 for worker in self.workers.values() if worker['process'] is not None)
+
+
+class CloneProgress(RemoteProgress):
+    """Прогресс git fetch для определенного индикатора: этап, доля 0..1, объекты, объем, скорость, ETA.
+    
+    Этапы git сведены в одну шкалу; callback(info) вызывается при смене этапа, в конце этапа
+    и не чаще раза в INTERVAL секунд.
+    """
+
+    STAGES = {
+        RemoteProgress.COUNTING: ('Подсчет объектов', 0.0, 0.05),
+        RemoteProgress.COMPRESSING: ('Сжатие объектов', 0.05, 0.1),
+        RemoteProgress.RECEIVING: ('Получение объектов', 0.1, 0.85),
+        RemoteProgress.RESOLVING: ('Обработка изменений', 0.85, 0.95),
+        RemoteProgress.CHECKING_OUT: ('Извлечение файлов', 0.95, 1.0),
+    }
+    TRANSFER_RE = re.compile(r'([\d.]+ [KMGT]?i?B)(?: \| ([\d.]+ [KMGT]?i?B/s))?')
+    INTERVAL = 0.2
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+        self.stage = None
+        self.stage_started = 0
+        self.last_emit = 0
+
+    def update(self, op_code, cur_count, max_count=None, message=''):
+        stage = op_code & self.OP_MASK
+        if stage not in self.STAGES:
+            return
+        now = time.monotonic()
+        changed = stage != self.stage
+        if changed:
+            self.stage = stage
+            self.stage_started = now
+        elif not op_code & self.END and now - self.last_emit < self.INTERVAL:
+            return
+        self.last_emit = now
+        
+        title, start, end = self.STAGES[stage]
+        info = {'stage': title, 'fraction': start, 'objects': int(float(cur_count or 0)),
+                'total': int(float(max_count)) if max_count else None,
+                'transferred': None, 'speed': None, 'eta': None}
+        if max_count:
+            done = min(1.0, float(cur_count or 0) / float(max_count))
+            info['fraction'] = start + (end - start) * done
+            elapsed = now - self.stage_started
+            if stage == self.RECEIVING and 0 < done < 1 and elapsed >= 1:
+                info['eta'] = elapsed * (1 - done) / done
+        match = self.TRANSFER_RE.search(message or '')
+        if match:
+            info['transferred'], info['speed'] = match.group(1), match.group(2)
+        self.callback(info)
+
+    def set_stage(self, title, fraction):
+        """Этап вне git fetch (например, создание worktree): только подпись и доля"""
+        self.stage = None
+        self.callback({'stage': title, 'fraction': fraction, 'objects': 0, 'total': None,
+                       'transferred': None, 'speed': None, 'eta': None})
+
+class SharedRepoStore:
+    """Общие хранилища объектов: одно bare-хранилище на remote, папки с тем же remote - его worktree.
+    
+    Один fetch хранилища обновляет ветки origin для всех его worktree, объекты хранятся
+    и скачиваются один раз. Уже существующие клоны того же remote по желанию пользователя
+    подключаются к хранилищу через objects/info/alternates, после чего дубликаты объектов
+    удаляются repack. Такой клон зависит от хранилища (опасность git clone --shared), поэтому
+    все ref клона закрепляются в хранилище под refs/linked/<id>/, а gc хранилища ничего не удаляет.
+    
+    Режимы первой загрузки хранилища (CLONE_OPTIONS): partial clone с фильтром ('blob:none' -
+    содержимое файлов скачивается по мере надобности), shallow на depth коммитов, только одна
+    ветка и reference - локальный репозиторий, объекты которого не скачиваются повторно.
+    """
+
+    FETCH_REUSE_SECONDS = 30
+    CLONE_OPTIONS = {
+        'filter': '',
+        'depth': 0,
+        'single_branch': False,
+        'reference': '',
+    }
+
+    def __init__(self, root, log):
+        self.root = root
+        self.log = log
+        self.last_fetch = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize_url(url):
+        """URL remote без токена, регистра хоста и суффикса .git - ключ хранилища"""
+        url = url.strip().rstrip('/')
+        if '://' in url:
+            scheme, rest = url.split('://', 1)
+            host, _, path = rest.partition('/')
+            host = host.rsplit('@', 1)[-1].lower()
+            url = f"{scheme.lower()}://{host}/{path}"
+        if url.endswith('.git'):
+            url = url[:-4]
+        return url
+
+    def store_path(self, remote_url):
+        normalized = self.normalize_url(remote_url)
+        name = re.sub(r'[^\w.-]', '_', normalized.rsplit('/', 1)[-1]) or 'repo'
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.root, f"{name}-{digest}.git")
+
+    def has_store(self, remote_url):
+        return os.path.isdir(self.store_path(remote_url))
+
+    def owns(self, repo):
+        """Репозиторий - worktree одного из общих хранилищ"""
+        common_dir = os.path.normcase(os.path.abspath(repo.common_dir))
+        return common_dir.startswith(os.path.normcase(os.path.abspath(self.root)) + os.sep)
+
+    def store_lock(self, store_path):
+        with self.lock:
+            return self.locks.setdefault(os.path.normcase(store_path), threading.Lock())
+
+    def ensure_store(self, remote_url, seed_repo=None, options=None, branch=None, progress=None):
+        """Открыть хранилище remote, создав его при необходимости.
+        
+        seed_repo - локальный клон того же remote: объекты берутся из него без скачивания.
+        options (CLONE_OPTIONS) и branch действуют только при создании хранилища.
+        """
+        store_path = self.store_path(remote_url)
+        with self.store_lock(store_path):
+            if os.path.isdir(store_path):
+                store = Repo(store_path)
+                store.remote('origin').set_url(remote_url)
+                return store
+            
+            os.makedirs(self.root, exist_ok=True)
+            store = Repo.init(store_path, bare=True)
+            self.protect(store)
+            store.create_remote('origin', remote_url)
+            if seed_repo is not None:
+                store.git.fetch(seed_repo.common_dir, '+refs/remotes/origin/*:refs/remotes/origin/*')
+            else:
+                self.initial_fetch(store, options, branch, progress)
+                self.last_fetch[os.path.normcase(store_path)] = time.monotonic()
+            try:
+                store.git.remote('set-head', 'origin', '--auto')
+            except GitCommandError:
+                pass
+            self.log(f"Создано общее хранилище объектов: {store_path}")
+            return store
+
+    @staticmethod
+    def protect(store):
+        """Объекты хранилища могут быть нужны подключенным клонам и worktree: gc их не удаляет"""
+        with store.config_writer() as config:
+            config.set_value('gc', 'auto', 0)
+            config.set_value('gc', 'pruneExpire', 'never')
+
+    def initial_fetch(self, store, options, branch, progress=None):
+        """Первая загрузка объектов хранилища в режиме options"""
+        options = dict(self.CLONE_OPTIONS, **(options or {}))
+        
+        if options['reference']:
+            # Как git clone --reference: хранилище будет читать объекты reference, его нельзя удалять
+            reference = Repo(options['reference'])
+            alternates_path = os.path.join(store.git_dir, 'objects', 'info', 'alternates')
+            os.makedirs(os.path.dirname(alternates_path), exist_ok=True)
+            with open(alternates_path, 'a', encoding='utf-8') as f:
+                f.write(os.path.abspath(os.path.join(reference.common_dir, 'objects')) + '\n')
+            self.log(f"Хранилище использует объекты {options['reference']}: не удаляйте этот репозиторий")
+        
+        if options['single_branch']:
+            fetched = branch if branch and store.git.ls_remote('--heads', 'origin', branch) else None
+            if fetched is None:
+                # Новой ветки на remote нет: она начнется с ветки по умолчанию
+                head = store.git.ls_remote('--symref', 'origin', 'HEAD')
+                match = re.match(r'ref: refs/heads/(\S+)\s+HEAD', head)
+                fetched = match.group(1) if match else None
+            if fetched:
+                store.git.remote('set-branches', 'origin', fetched)
+        
+        kwargs = {}
+        if options['filter']:
+            kwargs['filter'] = options['filter']
+        if options['depth']:
+            kwargs['depth'] = int(options['depth'])
+            # Глубину git не запоминает, а она нужна для клонов в том же режиме
+            store.git.config('filehive.depth', str(kwargs['depth']))
+        store.remote('origin').fetch(progress=progress, **kwargs)
+
+    def mode_conflicts(self, store, options):
+        """Ключи options, которые хранилище, уже загруженное в другом режиме, выполнить не может"""
+        current = self.store_options(store)
+        requested = dict(self.CLONE_OPTIONS, **(options or {}))
+        return [key for key, value in requested.items() if value and value != current[key]]
+
+    @staticmethod
+    def describe_options(options):
+        """Режим загрузки для сообщений пользователю"""
+        parts = []
+        if options.get('filter'):
+            parts.append(f"partial clone ({options['filter']})")
+        if options.get('depth'):
+            parts.append(f"shallow, коммитов: {options['depth']}")
+        if options.get('single_branch'):
+            parts.append("одна ветка")
+        if options.get('reference'):
+            parts.append(f"reference {options['reference']}")
+        return ', '.join(parts) or "полная загрузка"
+
+    def store_options(self, store):
+        """Режим, в котором было загружено хранилище (CLONE_OPTIONS без reference)"""
+        def config(key):
+            try:
+                return store.git.config('--get', key)
+            except GitCommandError:
+                return ''
+        
+        options = dict(self.CLONE_OPTIONS)
+        if config('remote.origin.promisor') == 'true':
+            options['filter'] = config('remote.origin.partialclonefilter') or 'blob:none'
+        if os.path.exists(os.path.join(store.git_dir, 'shallow')):
+            options['depth'] = int(config('filehive.depth') or 1)
+        refspecs = config('remote.origin.fetch')
+        options['single_branch'] = bool(refspecs) and '*' not in refspecs
+        return options
+
+    def fetch_branch(self, store, branch, progress=None):
+        """Хранилище загружено с одной веткой: добавить в него ветку branch, если она есть на remote"""
+        refspecs = store.git.config('--get-all', 'remote.origin.fetch').splitlines()
+        if any('*' in refspec for refspec in refspecs):
+            return False
+        if not store.git.ls_remote('--heads', 'origin', branch):
+            return False
+        store.git.remote('set-branches', '--add', 'origin', branch)
+        store.remote('origin').fetch(progress=progress)
+        return True
+
+    def fetch(self, store_path, force=False, progress=None):
+        """Fetch хранилища; повторный вызов в течение FETCH_REUSE_SECONDS ничего не скачивает"""
+        key = os.path.normcase(os.path.abspath(store_path))
+        with self.store_lock(store_path):
+            last = self.last_fetch.get(key)
+            if not force and last is not None and time.monotonic() - last < self.FETCH_REUSE_SECONDS:
+                return False
+            Repo(store_path).remote('origin').fetch(progress=progress)
+            self.last_fetch[key] = time.monotonic()
+            return True
+
+    def add_worktree(self, remote_url, branch, target_path, options=None, progress=None):
+        """Создать папку target_path как worktree общего хранилища на ветке branch.
+        
+        options - режим загрузки нового хранилища (CLONE_OPTIONS), progress - CloneProgress.
+        Если хранилище уже есть и загружено в другом режиме, options отклоняются (ValueError):
+        папка создается из существующего хранилища и режим изменить нельзя.
+        """
+        created = not self.has_store(remote_url)
+        if not created:
+            store = Repo(self.store_path(remote_url))
+            conflicts = self.mode_conflicts(store, options)
+            if conflicts:
+                raise ValueError(f"Хранилище этого репозитория уже загружено в режиме "
+                                 f"\"{self.describe_options(self.store_options(store))}\", "
+                                 f"режим клонирования ({', '.join(conflicts)}) к нему не применить. "
+                                 f"Клонируйте без выбора режима")
+        store = self.ensure_store(remote_url, options=options, branch=branch, progress=progress)
+        if not created:
+            self.fetch(store.git_dir, progress=progress)
+        
+        store.git.worktree('prune')
+        local_branches = [head.name for head in store.heads]
+        remote_branches = [ref.remote_head for ref in store.remotes.origin.refs]
+        if branch not in local_branches and branch not in remote_branches:
+            with self.store_lock(store.git_dir):
+                if self.fetch_branch(store, branch, progress):
+                    remote_branches.append(branch)
+        
+        if branch in self.checked_out_branches(store):
+            # Ветка уже открыта в другой папке, второй worktree на ней git не создаст
+            return self.clone_independent(remote_url, store, branch, target_path, branch in remote_branches,
+                                          progress)
+        
+        if progress is not None:
+            progress.set_stage('Извлечение файлов', 0.95)
+        
+        if branch in local_branches:
+            store.git.worktree('add', target_path, branch)
+        elif branch in remote_branches:
+            store.git.worktree('add', '--track', '-b', branch, target_path, f'origin/{branch}')
+        else:
+            # Новая ветка начинается с ветки remote по умолчанию
+            store.git.worktree('add', '-b', branch, target_path, 'origin/HEAD')
+        
+        return Repo(target_path)
+
+    @staticmethod
+    def checked_out_branches(store):
+        """Ветки, на которых стоят worktree хранилища"""
+        branches = set()
+        for line in store.git.worktree('list', '--porcelain').splitlines():
+            if line.startswith('branch refs/heads/'):
+                branches.add(line[len('branch refs/heads/'):])
+        return branches
+
+    def clone_independent(self, remote_url, store, branch, target_path, on_remote, progress=None):
+        """Обычный клон вместо worktree; объекты берутся из хранилища и копируются (--dissociate).
+        
+        Shallow и partial хранилище для --reference не годится: такой клон скачивается с remote
+        в режиме хранилища.
+        """
+        mode = self.store_options(store)
+        if mode['filter'] or mode['depth']:
+            kwargs = {'single_branch': mode['single_branch']}
+            if mode['filter']:
+                kwargs['filter'] = mode['filter']
+            if mode['depth']:
+                kwargs['depth'] = mode['depth']
+        else:
+            kwargs = {'reference': store.git_dir, 'dissociate': True}
+        if on_remote:
+            kwargs['branch'] = branch
+        repo = Repo.clone_from(remote_url, target_path, progress=progress, **kwargs)
+        if not on_remote:
+            # Ветки нет на remote: как и для worktree, она начинается с ветки по умолчанию
+            repo.git.checkout('-b', branch)
+        self.log(f"Ветка {branch} уже открыта в другой папке: {Path(target_path).name} создана отдельным клоном")
+        return repo
+
+    @staticmethod
+    def read_alternates(repo):
+        """Строки objects/info/alternates клона и их абсолютные пути"""
+        objects_dir = os.path.join(repo.common_dir, 'objects')
+        alternates_path = os.path.join(objects_dir, 'info', 'alternates')
+        if not os.path.exists(alternates_path):
+            return []
+        with open(alternates_path, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        return [(line, os.path.normcase(os.path.abspath(os.path.join(objects_dir, line)))) for line in lines]
+
+    @staticmethod
+    def write_alternates(repo, lines):
+        alternates_path = os.path.join(repo.common_dir, 'objects', 'info', 'alternates')
+        if not lines:
+            if os.path.exists(alternates_path):
+                os.remove(alternates_path)
+            return
+        os.makedirs(os.path.dirname(alternates_path), exist_ok=True)
+        with open(f"{alternates_path}.tmp", 'w', encoding='utf-8') as f:
+            f.write(''.join(f"{line}\n" for line in lines))
+        os.replace(f"{alternates_path}.tmp", alternates_path)
+
+    def linked_store(self, repo):
+        """Строка alternates клона, указывающая в одно из хранилищ (в том числе перемещенных), или None"""
+        for line, path in self.read_alternates(repo):
+            parts = path.replace(os.sep, '/').split('/')
+            if len(parts) >= 3 and parts[-1] == 'objects' and parts[-3] == os.path.normcase(os.path.basename(self.root)):
+                return line
+        return None
+
+    def pin_refs(self, store, repo):
+        """Закрепить все ref клона в хранилище: нужные клону объекты остаются достижимыми"""
+        pin = hashlib.sha1(os.path.normcase(os.path.abspath(repo.common_dir)).encode('utf-8')).hexdigest()[:12]
+        store.git.fetch('--no-tags', repo.common_dir, *(f'+refs/{kind}/*:refs/linked/{pin}/{kind}/*'
+                                                         for kind in ('heads', 'remotes', 'tags')))
+
+    def link_alternates(self, repo, remote_url, seed_repo=None):
+        """Подключить существующий клон к хранилищу и удалить из него дублирующиеся объекты.
+        
+        Для уже подключенного клона только обновляет закрепленные ref.
+        """
+        if self.owns(repo):
+            return False
+        
+        store = self.ensure_store(remote_url, seed_repo=seed_repo)
+        self.protect(store)
+        objects_dir = os.path.join(repo.common_dir, 'objects')
+        store_objects = os.path.abspath(os.path.join(store.git_dir, 'objects'))
+        
+        with self.store_lock(store.git_dir):
+            self.pin_refs(store, repo)
+        
+        existing = self.read_alternates(repo)
+        if os.path.normcase(store_objects) in [path for _, path in existing]:
+            return False
+        
+        try:
+            # Относительный путь переживает перенос программы вместе с папками
+            line = os.path.relpath(store_objects, objects_dir)
+        except ValueError:
+            line = store_objects
+        self.write_alternates(repo, [line for line, _ in existing] + [line])
+        
+        # -l: в новый пакет не попадают объекты, которые есть в хранилище
+        repo.git.repack('-a', '-d', '-l')
+        return True
+
+    def repair_alternates(self, repo, remote_url):
+        """Хранилище подключенного клона переехало (перенос программы): указать новый путь"""
+        line = self.linked_store(repo)
+        if line is None:
+            return False
+        objects_dir = os.path.join(repo.common_dir, 'objects')
+        if os.path.isdir(os.path.join(objects_dir, line)) or not self.has_store(remote_url):
+            return False
+        store_objects = os.path.abspath(os.path.join(self.store_path(remote_url), 'objects'))
+        try:
+            new_line = os.path.relpath(store_objects, objects_dir)
+        except ValueError:
+            new_line = store_objects
+        self.write_alternates(repo, [new_line if old == line else old for old, _ in self.read_alternates(repo)])
+        return True
+
+    def dissociate(self, repo):
+        """Отключить клон от хранилища: объекты копируются обратно в клон, alternates убирается"""
+        line = self.linked_store(repo)
+        if line is None or not os.path.isdir(os.path.join(repo.common_dir, 'objects', line)):
+            return False
+        # Без -l repack забирает в новый пакет и объекты из alternates
+        repo.git.repack('-a', '-d')
+        self.write_alternates(repo, [old for old, _ in self.read_alternates(repo) if old != line])
+        return True
+
+    def repair_worktree(self, folder_path, remote_url):
+        """Worktree хранилища, которое переехало вместе с программой: git worktree repair"""
+        if not self.has_store(remote_url) or not os.path.isfile(os.path.join(folder_path, '.git')):
+            return False
+        Repo(self.store_path(remote_url)).git.worktree('repair', folder_path)
+        return True
+
+class AutoCommitScheduler:
+    """Автокоммит папок по политике из конфигурации ('auto_commit' папки).
+    
+    Папка коммитится, когда после последнего события прошло quiet_seconds и с прошлого
+    автокоммита прошло не меньше min_interval_minutes. Если изменено max_batch_files файлов
+    и больше, пауза не ждется (ограничение частоты остается). Коммиты выполняются в пуле
+    ядра (run_batch_commit), вне потока GUI.
+    """
+
+    DEFAULT_POLICY = {
+        'enabled': False,
+        'quiet_seconds': 60,
+        'min_interval_minutes': 10,
+        'max_batch_files': 500,
+    }
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.last_activity = {}
+        self.last_commit = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def get_policy(cls, data):
+        policy = dict(cls.DEFAULT_POLICY)
+        policy.update(data.get('auto_commit') or {})
+        return policy
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def note_activity(self, folder_path):
+        with self.condition:
+            self.last_activity[folder_path] = time.monotonic()
+            self.condition.notify()
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify()
+
+    def discard(self, folder_path):
+        with self.condition:
+            self.last_activity.pop(folder_path, None)
+            self.last_commit.pop(folder_path, None)
+
+    def _due_time(self, folder_path, data, now):
+        policy = self.get_policy(data)
+        if not policy['enabled'] or not data.get('changes') or data.get('repo') is None:
+            return None
+        
+        not_before = self.last_commit.get(folder_path, float('-inf')) + policy['min_interval_minutes'] * 60
+        summary = data.get('status_summary') or {}
+        if summary.get('total', 0) >= policy['max_batch_files']:
+            return not_before
+        
+        quiet_until = self.last_activity.setdefault(folder_path, now) + policy['quiet_seconds']
+        return max(quiet_until, not_before)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                
+                now = time.monotonic()
+                due_folders = []
+                timeout = None
+                for folder_path, data in list(self.engine.watched_folders.items()):
+                    due = self._due_time(folder_path, data, now)
+                    if due is None:
+                        continue
+                    if due <= now:
+                        due_folders.append(folder_path)
+                    elif timeout is None or due - now < timeout:
+                        timeout = due - now
+                
+                if not due_folders:
+                    self.condition.wait(timeout)
+                    continue
+                
+                for folder_path in due_folders:
+                    self.last_commit[folder_path] = now
+            
+            self.engine.log_message(f"Автокоммит: папок {len(due_folders)}")
+            self.engine.run_batch_commit(due_folders)
+
+class GitHubError(Exception):
+    """Ошибка GitHub API; status - HTTP-код ответа (0 - лимит исчерпан без запроса)"""
+
+    def __init__(self, message, status=0):
+        super().__init__(message)
+        self.status = status
+
+
+class GitHubClient:
+    """Клиент GitHub API: общий пул соединений, пагинация по Link, кэш ETag на диске, учет лимитов.
+    
+    Повторный запрос отправляется с If-None-Match; ответ 304 не расходует лимит GitHub,
+    тело берется из кэша. Пока лимит исчерпан, данные отдаются из кэша без запросов.
+    """
+
+    API_URL = "https://api.github.com"
+    PER_PAGE = 100
+    MAX_PAGES = 50
+
+    def __init__(self, cache_dir, log=None, timeout=10, metrics=None):
+        self.cache_dir = cache_dir
+        self.log = log or print
+        self.timeout = timeout
+        self.metrics = metrics
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=2)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/vnd.github+json',
+            'User-Agent': 'filehive-updater',
+        })
+        self.lock = threading.Lock()
+        self.rate_limits = {}
+        self.requests_sent = 0
+        self.cache_hits = 0
+
+    def cache_file(self, url, token):
+        # Токен входит в ключ (разные права - разные ответы), но в кэш не записывается
+        key = hashlib.sha1(f"{token or ''}\n{url}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def load_cached(self, url, token):
+        try:
+            with open(self.cache_file(url, token), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_cached(self, url, token, entry):
+        path = self.cache_file(url, token)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.tmp{threading.get_ident()}"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.log(f"Не удалось сохранить кэш GitHub API: {str(e)}")
+
+    def rate_limit_key(self, token):
+        return hashlib.sha1((token or '').encode('utf-8')).hexdigest()
+
+    def update_rate_limit(self, token, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        with self.lock:
+            self.rate_limits[self.rate_limit_key(token)] = (int(remaining), int(reset))
+
+    def rate_limit_reset(self, token):
+        """Время сброса лимита, если он исчерпан, иначе None"""
+        with self.lock:
+            remaining, reset = self.rate_limits.get(self.rate_limit_key(token), (1, 0))
+        if remaining <= 0 and reset > time.time():
+            return reset
+        return None
+
+    def get_page(self, url, token=None):
+        """GET одной страницы: (данные, URL следующей страницы или None)"""
+        cached = self.load_cached(url, token)
+        
+        reset = self.rate_limit_reset(token)
+        if reset is not None:
+            if cached is not None:
+                self.cache_hits += 1
+                return cached['data'], cached.get('next')
+            raise GitHubError(f"Превышен лимит запросов GitHub до {time.strftime('%H:%M', time.localtime(reset))}", 403)
+        
+        headers = {}
+        if token:
+            headers['Authorization'] = f'token {token}'
+        if cached is not None and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        
+        with self.metrics.timer('github_api') if self.metrics else nullcontext():
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        self.requests_sent += 1
+        self.update_rate_limit(token, response)
+        
+        if response.status_code == 304 and cached is not None:
+            self.cache_hits += 1
+            return cached['data'], cached.get('next')
+        if response.status_code != 200:
+            if response.status_code in (403, 429) and cached is not None and self.rate_limit_reset(token):
+                self.cache_hits += 1
+                return cached['data'], cached.get('next')
+            raise GitHubError(f"GitHub API: {response.status_code} для {url}", response.status_code)
+        
+        data = response.json()
+        next_url = response.links.get('next', {}).get('url')
+        if response.headers.get('ETag'):
+            self.store_cached(url, token, {'etag': response.headers['ETag'], 'data': data, 'next': next_url})
+        return data, next_url
+
+    def get(self, path, token=None):
+        data, _ = self.get_page(f"{self.API_URL}{path}", token)
+        return data
+
+    def get_all(self, path, token=None):
+        """Все страницы списка (переход по Link rel="next")"""
+        separator = '&' if '?' in path else '?'
+        url = f"{self.API_URL}{path}{separator}per_page={self.PER_PAGE}"
+        items = []
+        for _ in range(self.MAX_PAGES):
+            data, url = self.get_page(url, token)
+            items.extend(data)
+            if not url:
+                break
+        return items
+
+    def get_repository(self, owner, repo, token=None):
+        return self.get(f"/repos/{owner}/{repo}", token)
+
+    def list_branches(self, owner, repo, token=None):
+        return [branch['name'] for branch in self.get_all(f"/repos/{owner}/{repo}/branches", token)]
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Одна запись лога - одна строка JSON"""
+
+    def format(self, record):
+        return json.dumps({
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }, ensure_ascii=False)
+
+
+class LogFileSink:
+    """Асинхронная запись лога в файл с ротацией по размеру.
+    
+    Вызывающий поток только кладет запись в очередь, файл пишет отдельный поток QueueListener.
+    """
+
+    DEFAULT_SETTINGS = {
+        'file': 'watcher.log',
+        'max_bytes': 5 * 1024 * 1024,
+        'backup_count': 5,
+        'json_lines': False,
+        'max_lines': 1000,
+    }
+
+    def __init__(self, path, max_bytes=5 * 1024 * 1024, backup_count=5, json_lines=False):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        if json_lines:
+            self.file_handler.setFormatter(JsonLineFormatter(datefmt="%Y-%m-%d %H:%M:%S"))
+        else:
+            self.file_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+        
+        # handler можно подключить к logger; write() - для кода без logging
+        self.handler = logging.handlers.QueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+
+    def write(self, message):
+        self.handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+
+    def close(self):
+        self.listener.stop()
+        self.file_handler.close()
+
+
+class ConfigStore:
+    """Отложенная атомарная запись конфигурации.
+    
+    Изменения только помечаются (mark_dirty), запись выполняется в фоне через delay секунд
+    после последнего изменения: временный файл + os.replace, и только если содержимое изменилось.
+    """
+
+    def __init__(self, path, serialize, log=print, delay=1.0):
+        self.path = path
+        self.serialize = serialize
+        self.log = log
+        self.delay = delay
+        self.dirty_since = None
+        self.last_written = self.read_current()
+        self.writes = 0
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def read_current(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Остановить фоновую запись и сохранить несохраненные изменения"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def mark_dirty(self):
+        with self.condition:
+            self.dirty_since = time.monotonic()
+            if self.running:
+                self.condition.notify()
+                return
+        # Фоновая запись не запущена (например, до start_monitoring) - пишем сразу
+        self.flush()
+
+    def flush(self):
+        """Записать конфигурацию, если она изменилась; возвращает True, если файл записан"""
+        with self.condition:
+            self.dirty_since = None
+        
+        with self.write_lock:
+            text = json.dumps(self.serialize(), indent=2, ensure_ascii=False)
+            if text == self.last_written:
+                return False
+            
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                self.log(f"Ошибка сохранения конфигурации: {str(e)}")
+                return False
+            
+            self.last_written = text
+            self.writes += 1
+            return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                if self.dirty_since is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.dirty_since + self.delay - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+            self.flush()
+
+
+class FolderRegistry(dict):
+    """Отслеживаемые папки: словарь путь -> данные папки со вторичными индексами.
+    
+    Индексы по имени папки, remote (SharedRepoStore.normalize_url) и ветке хранят множества
+    путей, поэтому выборки вида "все папки remote X" и "все измененные на ветке Y" не обходят
+    весь словарь. Данные папки меняются на месте: после смены имени, remote или ветки нужен
+    reindex(path), WatcherEngine.notify вызывает его для всех переданных папок.
+    """
+
+    INDEXED_FIELDS = ('folder_name', 'remote_url', 'branch')
+    _missing = object()
+
+    def __init__(self, folders=None):
+        super().__init__()
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+        self.index_keys = {}
+        self.order = {}
+        self.counter = 0
+        # Растет при каждом изменении индексов (например, для обновления списков фильтров)
+        self.version = 0
+        self.lock = threading.Lock()
+        for path, data in (folders or {}).items():
+            self[path] = data
+
+    @staticmethod
+    def index_key(field, data):
+        if field == 'remote_url':
+            url = data.get('remote_url') or ''
+            return SharedRepoStore.normalize_url(url) if url else ''
+        if field == 'branch':
+            return data.get('branch', 'main')
+        return data.get(field) or ''
+
+    def _unindex(self, path):
+        for field, key in self.index_keys.pop(path, {}).items():
+            paths = self.indexes[field].get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self.indexes[field][key]
+
+    def reindex(self, path):
+        """Перечитать индексируемые поля папки после изменения ее данных на месте"""
+        with self.lock:
+            data = self.get(path)
+            if data is None:
+                return
+            keys = {field: self.index_key(field, data) for field in self.INDEXED_FIELDS}
+            if keys == self.index_keys.get(path):
+                return
+            self._unindex(path)
+            for field, key in keys.items():
+                self.indexes[field].setdefault(key, set()).add(path)
+            self.index_keys[path] = keys
+            self.version += 1
+
+    def __setitem__(self, path, data):
+        with self.lock:
+            if path not in self.order:
+                self.counter += 1
+                self.order[path] = self.counter
+            super().__setitem__(path, data)
+        self.reindex(path)
+
+    def __delitem__(self, path):
+        with self.lock:
+            super().__delitem__(path)
+            self._unindex(path)
+            self.order.pop(path, None)
+            self.version += 1
+
+    def pop(self, path, default=_missing):
+        if path not in self:
+            if default is self._missing:
+                raise KeyError(path)
+            return default
+        data = self[path]
+        del self[path]
+        return data
+
+    def find(self, folder_name=None, remote_url=None, branch=None, dirty=None):
+        """Пути папок, подходящих под все заданные условия, в порядке добавления.
+        
+        remote_url сравнивается без токена и суффикса .git; dirty - есть/нет изменений.
+        """
+        criteria = {'folder_name': folder_name, 'branch': branch,
+                    'remote_url': SharedRepoStore.normalize_url(remote_url) if remote_url else remote_url}
+        with self.lock:
+            candidates = [self.indexes[field].get(key, set()) for field, key in criteria.items() if key is not None]
+            if candidates:
+                candidates.sort(key=len)
+                paths = candidates[0].intersection(*candidates[1:])
+            else:
+                paths = set(self.keys())
+            if dirty is not None:
+                paths = {path for path in paths if bool(self[path].get('changes')) == dirty}
+            return sorted(paths, key=self.order.get)
+
+    def counts(self, field):
+        """Значения индекса field с числом папок для каждого"""
+        with self.lock:
+            return {key: len(paths) for key, paths in self.indexes[field].items()}
+
+
+class WatcherEngine:
+    """Ядро без GUI: конфигурация, мониторинг папок, проверка статуса, коммит/пуш/pull и самообновление.
+    
+    Используется и окном (GitWatcherGUI), и headless-режимом (--daemon). Сообщения идут в log,
+    об изменении состояния папок сообщается подписчикам через add_listener.
+    """
+
+    # Конфигурация репозитория обновлений
+    UPDATE_REPO_URL = "https://github.com/vasabi224/bots.git"
+    UPDATE_BRANCH = "main"
+    VERSION_FILE = "version.txt"
+    UPDATE_STATE_FILE = "update_state.json"
+    STAGE_PATHS_LIMIT = 2000
+    RELEASE_MANIFEST = "manifest.json"
+    BACKUP_MANIFEST = "backup_manifest.json"
+    UPDATE_IGNORE = ('.git', 'temp_*', 'backup_*', 'repo_store', 'github_cache', '__pycache__',
+                     'watcher_config.json', 'update_state.json', 'watcher.log*', 'fsmonitor_state.json')
+    
+    # Текущая версия программы
+    CURRENT_VERSION = "1.0.0"
+
+    def __init__(self, config_file="watcher_config.json", log=None, install_dir=None):
+        self.config_file = config_file
+        self.log = log or print
+        self.listeners = []
+        # Каталог данных программы: хранилище объектов, кэш GitHub, метрики, состояние fsmonitor
+        self.install_dir = install_dir or os.path.dirname(os.path.abspath(__file__))
+        
+        self.watched_folders = FolderRegistry()
+        self.debounce_seconds = 1.0
+        self.commit_workers = 4
+        self.push_per_remote = 2
+        self.branch_cache_ttl = 300
+        self.log_settings = dict(LogFileSink.DEFAULT_SETTINGS)
+        self.load_workers = 8
+        # Подключение существующих клонов к общему хранилищу (alternates) - только по желанию пользователя
+        self.share_objects_enabled = False
+        self.fsmonitor_enabled = True
+        self.polling_settings = dict(PollingWatcher.DEFAULT_SETTINGS)
+        self.loaded = threading.Event()
+        self.metrics = Metrics()
+        self.git_workers = GitWorkerPool(metrics=self.metrics)
+        self.metrics_settings = dict(MetricsExporter.DEFAULT_SETTINGS)
+        
+        config_started = time.monotonic()
+        self.load_config()
+        self.config_load_time = time.monotonic() - config_started
+        self.config_store = ConfigStore(self.config_file, self.build_config, self.log_message)
+        self.observer = Observer()
+        self.aggregator = ChangeAggregator(self.on_folder_changed, quiet_period=self.debounce_seconds)
+        self.fsmonitor = FsMonitorProvider(self.install_dir, self.log_message)
+        self.change_handler = ChangeHandler(self.aggregator, self.on_folder_layout_changed,
+                                            self.on_directory_changed,
+                                            self.fsmonitor if self.fsmonitor_enabled else None)
+        self.poller = PollingWatcher(self.change_handler, self.polling_settings, self.log_message)
+        self.status_engine = StatusEngine(self.get_folder_repo, self.on_status_updated, self.metrics)
+        self.auto_commit = AutoCommitScheduler(self)
+        self.shared_store = SharedRepoStore(os.path.join(self.install_dir, 'repo_store'), self.log_message)
+        self.github = GitHubClient(os.path.join(self.install_dir, 'github_cache'), self.log_message,
+                                   metrics=self.metrics)
+        metrics_settings = dict(self.metrics_settings)
+        if metrics_settings.get('file') and not os.path.isabs(metrics_settings['file']):
+            metrics_settings['file'] = os.path.join(self.install_dir, metrics_settings['file'])
+        self.metrics_exporter = MetricsExporter(self.render_metrics, metrics_settings, self.log_message)
+        self.layout_timers = {}
+        self.layout_lock = threading.Lock()
+        self.folder_locks = {}
+        self.folder_locks_lock = threading.Lock()
+        # Пути для следующего коммита; папки нет в словаре - набор неизвестен, нужен полный add -A
+        self.stage_paths = {}
+        self.stage_lock = threading.Lock()
+        self.branch_cache = {}
+        self.branch_refreshing = set()
+        self.branch_callbacks = {}
+        self.branch_lock = threading.Lock()
+
+    def log_message(self, message):
+        self.log(message)
+
+    @staticmethod
+    def read_log_settings(config_file):
+        """Настройки 'log' из файла конфигурации без создания ядра (окну они нужны раньше ядра)"""
+        settings = dict(LogFileSink.DEFAULT_SETTINGS)
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                settings.update(json.load(f).get('log') or {})
+        except (OSError, ValueError, AttributeError):
+            pass
+        return settings
+
+    def open_log_file(self, path=None):
+        """Файл лога по настройкам 'log' конфигурации (None - запись в файл отключена)"""
+        path = path or self.log_settings.get('file')
+        if not path:
+            return None
+        if not os.path.isabs(path):
+            path = os.path.join(self.install_dir, path)
+        return LogFileSink(path, max_bytes=self.log_settings['max_bytes'],
+                           backup_count=self.log_settings['backup_count'],
+                           json_lines=self.log_settings['json_lines'])
+
+    def folder_lock(self, folder_path):
+        """Блокировка git-операций записи папки (ручной коммит, автокоммит, пакетный коммит)"""
+        with self.folder_locks_lock:
+            return self.folder_locks.setdefault(folder_path, threading.Lock())
+
+    def add_listener(self, callback):
+        """callback(folder_paths, head_changed) вызывается при изменении состояния папок"""
+        self.listeners.append(callback)
+
+    def notify(self, folder_paths, head_changed=False):
+        for folder_path in folder_paths:
+            self.watched_folders.reindex(folder_path)
+        for callback in self.listeners:
+            callback(folder_paths, head_changed)
+
+    def register_folder(self, folder_path, repo, remote_url, branch):
+        folder_name = Path(folder_path).name
+        
+        self.watched_folders[folder_path] = {
+            'repo_path': folder_path,
+            'folder_name': folder_name,
+            'remote_url': remote_url,
+            'branch': branch,
+            'watches': {},
+            'exclude': [],
+            'repo': repo,
+            'changes': False
+        }
+        
+        self.save_config()
+        self.start_folder_monitoring(folder_path)
+        self.configure_fsmonitor(folder_path)
+        self.status_engine.rescan(folder_path)
+        self.notify([folder_path])
+        
+        if remote_url and self.share_objects_enabled:
+            threading.Thread(target=self.share_objects, args=(remote_url,), daemon=True).start()
+        return folder_name
+
+    def unregister_folder(self, folder_path):
+        self.stop_folder_monitoring(folder_path)
+        repo = self.watched_folders.pop(folder_path).get('repo')
+        if repo is not None:
+            self.git_workers.discard(repo)
+            self.release_fsmonitor(repo)
+        with self.branch_lock:
+            self.branch_cache.pop(folder_path, None)
+        self.forget_stage_paths(folder_path)
+        self.save_config()
+        self.notify([])
+
+    def setup_project_branch(self, repo, branch_name, remote_url, folder_path=None):
+        """Настройка ветки для проекта; folder_path - метка папки в метриках (по умолчанию путь рабочей копии)"""
+        folder_path = folder_path or os.path.normpath(repo.working_tree_dir)
+        try:
+            # Делаем fetch чтобы получить актуальные ветки
+            if 'origin' in repo.remotes:
+                self.fetch_repo(repo, folder_path=folder_path)
+            
+            # Проверяем существование ветки локально и удаленно
+            local_branches = [head.name for head in repo.heads]
+            remote_branches = []
+            
+            if 'origin' in repo.remotes:
+                for ref in repo.remotes.origin.refs:
+                    if ref.remote_head != 'HEAD' and not ref.name.endswith('/HEAD'):
+                        remote_branches.append(ref.remote_head)
+            
+            branch_exists_locally = branch_name in local_branches
+            branch_exists_remotely = branch_name in remote_branches
+            
+            with self.metrics.timer('checkout', folder_path):
+                if branch_exists_locally:
+                    # Переключаемся на существующую локальную ветку
+                    repo.git.checkout(branch_name)
+                    self.log_message(f"Переключен на существующую ветку: {branch_name}")
+                elif branch_exists_remotely:
+                    # Создаем локальную ветку для отслеживания удаленной
+                    repo.git.checkout('-b', branch_name, f'origin/{branch_name}')
+                    self.log_message(f"Создана локальная ветка для отслеживания удаленной: {branch_name}")
+                else:
+                    # Создаем новую ветку
+                    repo.git.checkout('-b', branch_name)
+                    self.log_message(f"Создана новая ветка: {branch_name}")
+            
+            # Настраиваем remote
+            self.configure_origin(repo, remote_url, folder_path)
+            self.log_message(f"Настроен remote origin: {remote_url}")
+            
+            # Пытаемся настроить upstream
+            try:
+                with self.metrics.timer('push', folder_path):
+                    repo.git.push('--set-upstream', 'origin', branch_name)
+                self.log_message(f"Установлен upstream для ветки: {branch_name}")
+                return True
+            except GitCommandError as e:
+                if "rejected" in str(e):
+                    self.log_message(f"Конфликт при пуше: {str(e)}")
+                    return False
+                else:
+                    raise e
+                    
+        except Exception as e:
+            self.log_message(f"Ошибка настройки ветки: {str(e)}")
+            return False
+
+    def fetch_repo(self, repo, force=False, folder_path=None):
+        """fetch origin; для worktree общего хранилища выполняется один fetch хранилища"""
+        with self.metrics.timer('fetch', folder_path or os.path.normpath(repo.working_tree_dir)):
+            if self.shared_store.owns(repo):
+                self.shared_store.fetch(repo.common_dir, force=force)
+            else:
+                repo.remote('origin').fetch()
+
+    def folders_sharing(self, remote_url):
+        if not remote_url:
+            return []
+        return self.watched_folders.find(remote_url=remote_url)
+
+    def clone_repository(self, repo_url, target_path, branch, options=None, progress=None):
+        """Клонирование через общее хранилище remote: папка создается как его worktree.
+        
+        options - режим загрузки (SharedRepoStore.CLONE_OPTIONS), действует при создании хранилища
+        (для существующего хранилища другой режим отклоняется, см. store_clone_options); progress(info) получает этапы, долю и скорость загрузки (CloneProgress).
+        """
+        shared = self.shared_store.has_store(repo_url)
+        tracker = CloneProgress(progress) if progress else None
+        with self.metrics.timer('clone', target_path):
+            repo = self.shared_store.add_worktree(repo_url, branch, target_path, options, tracker)
+        if shared:
+            self.log_message(f"Папка {Path(target_path).name} создана как worktree существующего хранилища "
+                             f"(повторная загрузка объектов не требуется)")
+        elif options and any(options.get(key) for key in SharedRepoStore.CLONE_OPTIONS):
+            self.log_message(f"Хранилище {Path(target_path).name} загружено в режиме: "
+                             f"{SharedRepoStore.describe_options(options)}")
+        return repo
+
+    def store_clone_options(self, repo_url):
+        """Режим уже существующего хранилища remote (None - хранилища нет, режим можно выбрать)"""
+        if not repo_url or not self.shared_store.has_store(repo_url):
+            return None
+        return self.shared_store.store_options(Repo(self.shared_store.store_path(repo_url)))
+
+    def open_folder_repo(self, folder_path):
+        """Открыть репозиторий папки; пути к хранилищу после переноса программы исправляются"""
+        data = self.watched_folders[folder_path]
+        remote_url = data.get('remote_url')
+        try:
+            repo = Repo(data['repo_path'])
+        except Exception:
+            try:
+                with self.metrics.timer('repair', folder_path):
+                    repaired = remote_url and self.shared_store.repair_worktree(data['repo_path'], remote_url)
+                if not repaired:
+                    return None
+                repo = Repo(data['repo_path'])
+                self.log_message(f"{data['folder_name']}: восстановлена связь worktree с общим хранилищем")
+            except Exception:
+                return None
+        
+        try:
+            if remote_url and self.shared_store.repair_alternates(repo, remote_url):
+                self.log_message(f"{data['folder_name']}: обновлен путь к общему хранилищу объектов")
+        except OSError as e:
+            self.log_message(f"{data['folder_name']}: не удалось обновить путь к хранилищу: {str(e)}")
+        return repo
+
+    def dissociate_all_objects(self):
+        """Подключение клонов выключено: клоны, подключенные раньше, снова хранят все объекты сами"""
+        for folder_path, data in list(self.watched_folders.items()):
+            repo = data.get('repo')
+            if repo is None or self.shared_store.owns(repo) or self.shared_store.linked_store(repo) is None:
+                continue
+            try:
+                with self.folder_lock(folder_path):
+                    with self.metrics.timer('share_objects', folder_path):
+                        dissociated = self.shared_store.dissociate(repo)
+                if dissociated:
+                    self.log_message(f"{data['folder_name']}: объекты скопированы из общего хранилища, "
+                                     f"клон больше от него не зависит")
+            except Exception as e:
+                self.log_message(f"Не удалось отключить {data['folder_name']} от общего хранилища: {str(e)}")
+
+    def share_objects(self, remote_url):
+        """Подключить все клоны remote к общему хранилищу объектов (в фоне, может занять время).
+        
+        Вызывается, только если share_objects включен в конфигурации.
+        """
+        folder_paths = [path for path in self.folders_sharing(remote_url)
+                        if self.watched_folders[path].get('repo') is not None]
+        if len(folder_paths) < 2 and not self.shared_store.has_store(remote_url):
+            return
+        
+        seed_repo = None
+        if not self.shared_store.has_store(remote_url):
+            seed_repo = next((self.watched_folders[path]['repo'] for path in folder_paths
+                              if not self.shared_store.owns(self.watched_folders[path]['repo'])), None)
+        
+        for folder_path in folder_paths:
+            data = self.watched_folders.get(folder_path)
+            if data is None:
+                continue
+            try:
+                with self.folder_lock(folder_path):
+                    with self.metrics.timer('share_objects', folder_path):
+                        linked = self.shared_store.link_alternates(data['repo'], remote_url, seed_repo=seed_repo)
+                    if linked:
+                        self.log_message(f"{data['folder_name']}: объекты перенесены в общее хранилище "
+                                         f"{self.shared_store.store_path(remote_url)}")
+            except Exception as e:
+                self.log_message(f"Не удалось подключить {data['folder_name']} к общему хранилищу: {str(e)}")
+
+    def share_all_objects(self):
+        remote_urls = {}
+        for data in list(self.watched_folders.values()):
+            if data.get('remote_url'):
+                remote_urls.setdefault(SharedRepoStore.normalize_url(data['remote_url']), data['remote_url'])
+        for remote_url in remote_urls.values():
+            self.share_objects(remote_url)
+
+    def refresh_branches(self, folder_path):
+        """Принудительное обновление информации о ветках"""
+        data = self.watched_folders[folder_path]
+        repo = data['repo']
+        
+        try:
+            if 'origin' in repo.remotes:
+                self.fetch_repo(repo, force=True, folder_path=folder_path)
+                self.update_branch_cache(folder_path, fetched=True)
+                self.log_message(f"Обновлена информация о ветках для: {data['folder_name']}")
+                return True
+        except Exception as e:
+            self.log_message(f"Ошибка обновления веток для {data['folder_name']}: {str(e)}")
+        
+        return False
+
+    def update_branch_cache(self, folder_path, fetched=False):
+        """Перечитать ветки из локальных ref (без сети); fetched - только что выполнен fetch"""
+        local_branches, all_branches = self.read_branches(folder_path)
+        with self.branch_lock:
+            previous = self.branch_cache.get(folder_path, {})
+            entry = {
+                'local': local_branches,
+                'all': all_branches,
+                'fetched_at': time.time() if fetched else previous.get('fetched_at', 0),
+            }
+            self.branch_cache[folder_path] = entry
+        return entry
+
+    def branch_cache_age(self, folder_path):
+        """Секунд с последнего fetch веток папки (None - еще не было)"""
+        with self.branch_lock:
+            fetched_at = self.branch_cache.get(folder_path, {}).get('fetched_at', 0)
+        return time.time() - fetched_at if fetched_at else None
+
+    def list_branches(self, folder_path):
+        """Ветки папки из кэша: (local_branches, all_branches); сеть не используется"""
+        with self.branch_lock:
+            entry = self.branch_cache.get(folder_path)
+        if entry is None:
+            entry = self.update_branch_cache(folder_path)
+        return entry['local'], entry['all']
+
+    def refresh_branches_async(self, folder_path, callback=None):
+        """Фоновый fetch, если кэш веток старше branch_cache_ttl.
+        
+        callback(local_branches, all_branches) вызывается из фонового потока после обновления.
+        Возвращает True, если обновление запущено (или уже идет).
+        """
+        age = self.branch_cache_age(folder_path)
+        if age is not None and age < self.branch_cache_ttl:
+            return False
+        
+        with self.branch_lock:
+            if folder_path in self.branch_refreshing:
+                self.branch_callbacks.setdefault(folder_path, []).append(callback)
+                return True
+            self.branch_refreshing.add(folder_path)
+            self.branch_callbacks[folder_path] = [callback]
+        
+        def run():
+            try:
+                self.refresh_branches(folder_path)
+            finally:
+                with self.branch_lock:
+                    self.branch_refreshing.discard(folder_path)
+                    callbacks = self.branch_callbacks.pop(folder_path, [])
+            if folder_path not in self.watched_folders:
+                return
+            local_branches, all_branches = self.list_branches(folder_path)
+            for callback in callbacks:
+                if callback is not None:
+                    callback(local_branches, all_branches)
+        
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def read_branches(self, folder_path):
+        """Локальные ветки и ветки origin папки: (local_branches, all_branches)"""
+        repo = self.watched_folders[folder_path]['repo']
+        
+        # Получаем локальные ветки
+        local_branches = [head.name for head in repo.heads]
+        
+        # Получаем удаленные ветки
+        remote_branches = []
+        if 'origin' in repo.remotes:
+            for ref in repo.remotes.origin.refs:
+                if ref.remote_head != 'HEAD' and not ref.name.endswith('/HEAD'):
+                    branch_name = ref.name.replace('origin/', '')
+                    remote_branches.append(branch_name)
+        
+        # Объединяем и убираем дубликаты
+        all_branches = list(set(local_branches + remote_branches))
+        all_branches.sort()
+        return local_branches, all_branches
+
+    def checkout_branch(self, folder_path, new_branch):
+        data = self.watched_folders[folder_path]
+        repo = data['repo']
+        
+        # Автокоммит не должен попасть между проверкой ветки и переключением
+        with self.folder_lock(folder_path):
+            # Проверяем, существует ли ветка локально
+            with self.metrics.timer('checkout', folder_path):
+                if new_branch in [head.name for head in repo.heads]:
+                    # Переключаемся на существующую локальную ветку
+                    repo.git.checkout(new_branch)
+                else:
+                    # Создаем локальную ветку для отслеживания удаленной
+                    repo.git.checkout('-b', new_branch, f'origin/{new_branch}')
+            data['branch'] = new_branch
+        
+        self.save_config()
+        self.update_branch_cache(folder_path)
+        self.status_engine.rescan(folder_path)
+        self.notify([folder_path], head_changed=True)
+        self.log_message(f"Переключен на ветку: {new_branch} для проекта {data['folder_name']}")
+
+    def configure_origin(self, repo, remote_url, folder_path):
+        """Задать URL remote origin (создав его при необходимости)"""
+        with self.metrics.timer('set_remote', folder_path):
+            if 'origin' in repo.remotes:
+                repo.remote('origin').set_url(remote_url)
+            else:
+                repo.create_remote('origin', remote_url)
+
+    def set_remote_url(self, folder_path, new_url):
+        self.configure_origin(self.watched_folders[folder_path]['repo'], new_url, folder_path)
+        self.log_message(f"Обновлен remote origin: {new_url}")
+
+    def init_repository(self, folder_path):
+        """git init папки и первый коммит всех ее файлов (если есть что коммитить)"""
+        with self.metrics.timer('init', folder_path):
+            repo = Repo.init(folder_path)
+        try:
+            with self.metrics.timer('add', folder_path):
+                repo.git.add(A=True)
+            with self.metrics.timer('commit', folder_path):
+                repo.index.commit("Initial commit")
+        except Exception:
+            pass
+        return repo
+
+    def pull_folder(self, folder_path):
+        """Fetch и pull ветки папки; возвращает True, если пришли новые коммиты"""
+        data = self.watched_folders[folder_path]
+        repo = data['repo']
+        branch = data.get('branch', 'main')
+        
+        with self.folder_lock(folder_path):
+            # Переключаемся на нужную ветку
+            if repo.active_branch.name != branch:
+                with self.metrics.timer('checkout', folder_path):
+                    repo.git.checkout(branch)
+            
+            current_commit = self.git_workers.head_sha(repo)
+            
+            # Настраиваем upstream если нужно
+            if not hasattr(repo.active_branch, 'tracking_branch') or not repo.active_branch.tracking_branch():
+                self.setup_project_branch(repo, branch, data['remote_url'], folder_path)
+            
+            # Один fetch (для общего хранилища - на все его папки), затем merge ветки upstream
+            self.fetch_repo(repo, folder_path=folder_path)
+            self.update_branch_cache(folder_path, fetched=True)
+            tracking_branch = repo.active_branch.tracking_branch()
+            with self.metrics.timer('merge', folder_path):
+                if tracking_branch is not None:
+                    repo.git.merge(tracking_branch.name)
+                else:
+                    repo.remote('origin').pull()
+            new_commit = self.git_workers.head_sha(repo)
+        
+        if current_commit == new_commit:
+            self.log_message(f"Нет новых изменений для: {data['folder_name']}")
+            return False
+        
+        self.log_message(f"Успешно обновлено: {data['folder_name']} (ветка: {branch})")
+        self.status_engine.rescan(folder_path)
+        self.notify([folder_path], head_changed=True)
+        return True
+
+    def commit_and_push(self, folder_path, message, auto_push, push_limit=None):
+        """Коммит (и пуш) папки без диалогов.
+        
+        Возвращает (результат, подробности): 'pushed', 'committed' или 'push_failed'.
+        Ошибка самого коммита пробрасывается. push_limit - семафор, ограничивающий
+        число одновременных пушей в один remote.
+        """
+        data = self.watched_folders[folder_path]
+        repo = data['repo']
+        branch = data.get('branch', 'main')
+        
+        with self.folder_lock(folder_path):
+            # Убеждаемся, что мы в правильной ветке
+            if repo.active_branch.name != branch:
+                with self.metrics.timer('checkout', folder_path):
+                    repo.git.checkout(branch)
+            
+            try:
+                with self.metrics.timer('add', folder_path):
+                    self.stage_changes(folder_path, repo)
+                with self.metrics.timer('commit', folder_path):
+                    repo.index.commit(message)
+            except Exception:
+                self.forget_stage_paths(folder_path)
+                raise
+            data['changes'] = False
+        self.status_engine.rescan(folder_path)
+        self.notify([folder_path], head_changed=True)
+        
+        if not (auto_push and data.get('remote_url')):
+            self.log_message(f"Коммит выполнен (без пуша): {data['folder_name']} (ветка: {branch})")
+            return 'committed', ''
+        
+        with push_limit or nullcontext():
+            try:
+                origin = repo.remote(name='origin')
+                with self.metrics.timer('push', folder_path):
+                    origin.push(branch)
+                self.log_message(f"Успешный коммит и пуш: {data['folder_name']} (ветка: {branch})")
+                return 'pushed', ''
+            except GitCommandError as e:
+                if "no upstream branch" not in str(e):
+                    self.log_message(f"Коммит выполнен, но пуш не удался: {data['folder_name']} - {str(e)}")
+                    return 'push_failed', str(e)
+            
+            if not self.setup_project_branch(repo, branch, data['remote_url'], folder_path):
+                self.log_message(f"Коммит выполнен, но не удалось настроить upstream: {data['folder_name']}")
+                return 'push_failed', "Не удалось настроить автоматическую синхронизацию с GitHub."
+            
+            try:
+                with self.metrics.timer('push', folder_path):
+                    origin.push(branch)
+                self.log_message(f"Успешный коммит и пуш (после настройки upstream): {data['folder_name']}")
+                return 'pushed', ''
+            except Exception as e2:
+                self.log_message(f"Коммит выполнен, но пуш не удался после настройки upstream: {data['folder_name']} - {str(e2)}")
+                return 'push_failed', str(e2)
+
+    def note_stage_paths(self, folder_path, paths):
+        """Запомнить пути, измененные после последнего коммита (пути от watcher)"""
+        with self.stage_lock:
+            staged = self.stage_paths.get(folder_path)
+            if staged is None:
+                return
+            staged.update(paths)
+            if len(staged) > self.STAGE_PATHS_LIMIT:
+                # Слишком много путей: дешевле один полный add -A
+                del self.stage_paths[folder_path]
+
+    def forget_stage_paths(self, folder_path):
+        """Набор путей больше не достоверен: следующий коммит индексирует всю папку"""
+        with self.stage_lock:
+            self.stage_paths.pop(folder_path, None)
+
+    def stage_changes(self, folder_path, repo):
+        """git add только путей, о которых сообщил watcher с прошлого коммита.
+        
+        Полный add -A выполняется, если набор путей неизвестен (запуск, перестройка watch-ей,
+        ошибка прошлого коммита) или переполнен.
+        """
+        with self.stage_lock:
+            paths = self.stage_paths.get(folder_path)
+            self.stage_paths[folder_path] = set()
+        
+        root = repo.working_tree_dir
+        rel_paths = None
+        if paths is not None:
+            rel_paths = set(self.status_engine.dirty_paths(folder_path))
+            for path in paths | self.aggregator.pending_paths(folder_path):
+                rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+                if not rel_path.startswith('../') and rel_path != '.':
+                    rel_paths.add(rel_path)
+        
+        if rel_paths is None or len(rel_paths) > self.STAGE_PATHS_LIMIT:
+            repo.git.add(A=True)
+            return
+        
+        # Исчезнувший путь, которого нет в индексе (временный файл), git add не примет
+        missing = [rel_path for rel_path in rel_paths if not os.path.lexists(os.path.join(root, rel_path))]
+        if missing:
+            tracked = set()
+            for i in range(0, len(missing), StatusEngine.PATHSPEC_CHUNK):
+                output = repo.git.execute(['git', '--literal-pathspecs', 'ls-files', '-z', '--']
+                                          + missing[i:i + StatusEngine.PATHSPEC_CHUNK])
+                tracked.update(entry for entry in output.split('\0') if entry)
+            for rel_path in missing:
+                prefix = rel_path + '/'
+                if rel_path not in tracked and not any(entry.startswith(prefix) for entry in tracked):
+                    rel_paths.discard(rel_path)
+        
+        rel_paths = sorted(rel_paths)
+        try:
+            for i in range(0, len(rel_paths), StatusEngine.PATHSPEC_CHUNK):
+                repo.git.execute(['git', '--literal-pathspecs', 'add', '-A', '--']
+                                 + rel_paths[i:i + StatusEngine.PATHSPEC_CHUNK])
+        except GitCommandError as e:
+            self.log_message(f"Частичная индексация не удалась ({str(e).strip().splitlines()[-1]}), выполняется полная")
+            repo.git.add(A=True)
+
+    def dirty_folders(self):
+        return [path for path in self.watched_folders.find(dirty=True)
+                if self.watched_folders[path].get('repo') is not None]
+
+    def run_batch_commit(self, folder_paths):
+        """Параллельный коммит/пуш папок в ограниченном пуле потоков.
+        
+        Возвращает (список (папка, результат, подробности, длительность), общее время).
+        """
+        started = time.monotonic()
+        push_limits = {}
+        for folder_path in folder_paths:
+            remote_url = self.watched_folders[folder_path].get('remote_url') or ''
+            push_limits.setdefault(remote_url, threading.BoundedSemaphore(self.push_per_remote))
+        
+        def commit_job(folder_path):
+            data = self.watched_folders[folder_path]
+            job_started = time.monotonic()
+            message = f"Auto-commit: {data['folder_name']} - {time.strftime('%Y-%m-%d %H:%M')}"
+            try:
+                result, details = self.commit_and_push(folder_path, message, data.get('auto_push', True),
+                                                       push_limits[data.get('remote_url') or ''])
+            except Exception as e:
+                self.log_message(f"Ошибка коммита {data['folder_name']}: {str(e)}")
+                result, details = 'failed', str(e)
+            return folder_path, result, details, time.monotonic() - job_started
+        
+        with ThreadPoolExecutor(max_workers=min(self.commit_workers, len(folder_paths))) as pool:
+            results = list(pool.map(commit_job, folder_paths))
+        
+        elapsed = time.monotonic() - started
+        succeeded = sum(1 for _, result, _, _ in results if result in ('pushed', 'committed'))
+        self.log_message(f"Пакетный коммит завершен за {elapsed:.1f} с: успешно {succeeded} из {len(results)}")
+        self.save_config()
+        return results, elapsed
+
+    def start_folder_monitoring(self, folder_path):
+        """Добавить папку в общий observer (новый observer и его поток не создаются).
+        
+        Повторный вызов перестраивает набор watch-ей: ставятся только новые и снимаются лишние.
+        """
+        folder_data = self.watched_folders[folder_path]
+        
+        matcher = IgnoreMatcher(folder_path, folder_data.get('exclude', []))
+        if self.use_polling(folder_path):
+            self.start_folder_polling(folder_path, matcher)
+            return
+        self.poller.remove_folder(folder_path)
+        planner = WatchPlanner(matcher)
+        plan, saved = planner.plan(folder_path)
+        self.change_handler.add_folder(folder_path, matcher, [path for path, recursive in plan if not recursive])
+        
+        old_watches = folder_data.get('watches') or {}
+        watches = {}
+        complete = True
+        for key in plan:
+            if key in old_watches:
+                watches[key] = old_watches[key]
+                continue
+            path, recursive = key
+            try:
+                watches[key] = self.observer.schedule(self.change_handler, path, recursive=recursive)
+            except Exception as e:
+                complete = False
+                self.log_message(f"Не удалось начать мониторинг {folder_data['folder_name']} ({path}): {str(e)}")
+        
+        for key, watch in old_watches.items():
+            if key not in watches:
+                self.unschedule_watch(watch)
+        
+        folder_data['watches'] = watches
+        folder_data['watches_saved'] = saved
+        self.fsmonitor.add_folder(folder_path, [path for path, recursive in watches],
+                                  complete and self.fsmonitor_exact(folder_path, planner.pruned))
+        if saved:
+            self.log_message(f"Мониторинг {folder_data['folder_name']}: watch-ей {len(watches)}, "
+                             f"не отслеживается исключенных каталогов: {saved}")
+
+    def use_polling(self, folder_path):
+        """Опрашивать папку вместо событий: watch_mode 'poll' или 'auto' на сетевом/смонтированном диске"""
+        data = self.watched_folders[folder_path]
+        mode = data.get('watch_mode', 'auto')
+        if mode == 'auto' and 'network_share' not in data:
+            data['network_share'] = PollingWatcher.is_network_path(folder_path)
+        return mode == 'poll' or (mode == 'auto' and data['network_share'])
+
+    def start_folder_polling(self, folder_path, matcher):
+        """Папка без событий файловой системы: watch-и снимаются, изменения находит PollingWatcher"""
+        folder_data = self.watched_folders[folder_path]
+        for watch in (folder_data.get('watches') or {}).values():
+            self.unschedule_watch(watch)
+        folder_data['watches'] = {}
+        folder_data['watches_saved'] = 0
+        
+        self.change_handler.add_folder(folder_path, matcher)
+        first = not self.poller.is_polled(folder_path)
+        self.poller.add_folder(folder_path, matcher)
+        # Опрос не синхронизируется cookie-файлами: такую папку git обходит сам
+        self.fsmonitor.add_folder(folder_path, [], exact=False)
+        if first:
+            self.log_message(f"Мониторинг {folder_data['folder_name']}: сетевой или смонтированный диск, "
+                             f"изменения ищутся опросом")
+
+    def unschedule_watch(self, watch):
+        try:
+            self.observer.unschedule(watch)
+        except KeyError:
+            pass
+
+    def stop_folder_monitoring(self, folder_path):
+        folder_data = self.watched_folders[folder_path]
+        
+        for watch in (folder_data.get('watches') or {}).values():
+            self.unschedule_watch(watch)
+        folder_data['watches'] = {}
+        
+        timer = self.layout_timers.pop(folder_path, None)
+        if timer:
+            timer.cancel()
+        
+        self.change_handler.remove_folder(folder_path)
+        self.poller.remove_folder(folder_path)
+        self.fsmonitor.remove_folder(folder_path)
+        self.aggregator.discard(folder_path)
+        self.status_engine.discard(folder_path)
+        self.auto_commit.discard(folder_path)
+
+    def on_folder_layout_changed(self, folder_path):
+        """Появился/исчез каталог или изменился .gitignore: перестроить watch-и папки с задержкой"""
+        self.fsmonitor.suspend(folder_path)
+        with self.layout_lock:
+            if folder_path in self.layout_timers:
+                return
+            timer = threading.Timer(self.debounce_seconds, self.rebuild_folder_watches, args=(folder_path,))
+            timer.daemon = True
+            self.layout_timers[folder_path] = timer
+            timer.start()
+
+    def rebuild_folder_watches(self, folder_path):
+        with self.layout_lock:
+            self.layout_timers.pop(folder_path, None)
+        if folder_path in self.watched_folders:
+            # Пока watch-и перестраивались, события могли быть потеряны: файлы в новых каталогах
+            # и ставшие неисключенными после правки .gitignore находит только полная проверка
+            self.forget_stage_paths(folder_path)
+            self.start_folder_monitoring(folder_path)
+            self.status_engine.rescan(folder_path)
+            self.auto_commit.note_activity(folder_path)
+
+    def fsmonitor_exact(self, folder_path, pruned):
+        """Журнал fsmonitor полон, если каталоги без watch исключает сам git и в них нет версионных файлов"""
+        pruned = [path for path in pruned if path.rsplit('/', 1)[-1] != '.git']
+        if not pruned:
+            return True
+        data = self.watched_folders[folder_path]
+        # Исключения из конфигурации git не знает: такие каталоги он обходит сам
+        if data.get('exclude') or data.get('repo') is None:
+            return False
+        try:
+            with self.metrics.timer('ls_files', folder_path):
+                return not data['repo'].git.ls_files('--', *pruned)
+        except GitCommandError:
+            return False
+
+    def configure_fsmonitor(self, folder_path):
+        """Подключить репозиторий папки к провайдеру fsmonitor (или отключить, если он выключен в конфигурации)"""
+        data = self.watched_folders.get(folder_path)
+        if data is None or data.get('repo') is None:
+            return
+        enabled = self.fsmonitor_enabled and not self.poller.is_polled(folder_path)
+        try:
+            if not self.fsmonitor.configure(data['repo'], enabled) and enabled:
+                self.log_message(f"fsmonitor: в {data['folder_name']} уже настроен другой core.fsmonitor, он оставлен")
+        except GitCommandError as e:
+            self.log_message(f"fsmonitor: не удалось настроить {data['folder_name']}: {str(e)}")
+
+    def release_fsmonitor(self, repo):
+        """Убрать хук из репозитория удаленной папки, если его конфигурацию не делит другая папка (worktree)"""
+        common_dir = os.path.normcase(os.path.abspath(repo.common_dir))
+        for data in self.watched_folders.values():
+            other = data.get('repo')
+            if other is not None and os.path.normcase(os.path.abspath(other.common_dir)) == common_dir:
+                return
+        try:
+            self.fsmonitor.configure(repo, enabled=False)
+        except GitCommandError as e:
+            self.log_message(f"fsmonitor: не удалось отключить хук: {str(e)}")
+
+    def on_directory_changed(self, folder_path, path):
+        """Каталог создан/удален/перемещен: о его файлах отдельных событий может не быть.
+        
+        Каталог идет в агрегатор как обычный путь - StatusEngine проверит его pathspec каталога,
+        коммит проиндексирует его целиком.
+        """
+        self.aggregator.add_event(folder_path, 'modified', path)
+
+    def on_folder_changed(self, folder_path, changes, events_count):
+        """Пакетное уведомление от агрегатора: папка изменилась после паузы"""
+        data = self.watched_folders.get(folder_path)
+        if data is None:
+            return
+        
+        # Событие еще не значит изменение: реальное состояние проверит StatusEngine
+        self.status_engine.verify_paths(folder_path, changes.keys())
+        self.note_stage_paths(folder_path, changes.keys())
+        self.auto_commit.note_activity(folder_path)
+        
+        stats = self.aggregator.get_stats()
+        self.log_message(f"Изменения в {data['folder_name']}: файлов {len(changes)}, событий {events_count} "
+                         f"(всего событий: {stats['events_received']}, уведомлений: {stats['notifications_emitted']}, "
+                         f"отброшено исключенных: {self.change_handler.events_ignored})")
+
+    def watcher_counters(self):
+        stats = self.aggregator.get_stats()
+        return {
+            'filehive_watcher_events_total': stats['events_received'],
+            'filehive_watcher_notifications_total': stats['notifications_emitted'],
+            'filehive_watcher_events_ignored_total': self.change_handler.events_ignored,
+            'filehive_git_workers_started_total': self.git_workers.processes_started,
+            'filehive_fsmonitor_queries_total': self.fsmonitor.queries,
+            'filehive_fsmonitor_full_answers_total': self.fsmonitor.full_answers,
+            'filehive_poll_scans_total': self.poller.polls,
+            'filehive_poll_entries_total': self.poller.entries_scanned,
+        }
+
+    def render_metrics(self):
+        """Метрики в текстовом формате Prometheus"""
+        return self.metrics.render_prometheus(self.watcher_counters())
+
+    def head_commit(self, folder_path):
+        """Метаданные последнего коммита папки через постоянный процесс cat-file (None - коммитов нет)"""
+        repo = self.get_folder_repo(folder_path)
+        if repo is None:
+            return None
+        return self.git_workers.head_commit(repo)
+
+    def get_folder_repo(self, folder_path):
+        data = self.watched_folders.get(folder_path)
+        return data.get('repo') if data else None
+
+    def on_status_updated(self, folder_path, summary):
+        """Результат проверки рабочей копии от StatusEngine"""
+        data = self.watched_folders.get(folder_path)
+        if data is None:
+            return
+        
+        data['status_summary'] = summary
+        data['changes'] = summary['total'] > 0
+        self.notify([folder_path])
+        self.auto_commit.wake()
+
+    def start_monitoring(self):
+        self.config_store.start()
+        self.metrics_exporter.start()
+        if self.fsmonitor_enabled:
+            self.fsmonitor.start()
+        self.aggregator.start()
+        self.status_engine.start()
+        self.auto_commit.start()
+        self.observer.start()
+        self.poller.start()
+        threading.Thread(target=self.load_folders, daemon=True).start()
+
+    def load_folder(self, folder_path):
+        """Открыть репозиторий папки и поставить ее watch-и; возвращает (время открытия, время watch-ей)"""
+        data = self.watched_folders[folder_path]
+        started = time.monotonic()
+        data['repo'] = self.open_folder_repo(folder_path)
+        opened = time.monotonic()
+        
+        self.start_folder_monitoring(folder_path)
+        self.configure_fsmonitor(folder_path)
+        watched = time.monotonic()
+        
+        data['loading'] = False
+        self.status_engine.rescan(folder_path)
+        self.notify([folder_path], head_changed=True)
+        return opened - started, watched - opened
+
+    def load_folders(self):
+        """Параллельная загрузка папок из конфигурации; каждая папка сообщает о готовности сразу"""
+        started = time.monotonic()
+        folder_paths = [path for path, data in self.watched_folders.items() if data.get('loading')]
+        timings = {}
+        
+        def load(folder_path):
+            try:
+                timings[folder_path] = self.load_folder(folder_path)
+            except Exception as e:
+                self.watched_folders[folder_path]['loading'] = False
+                self.notify([folder_path])
+                self.log_message(f"Ошибка загрузки {self.watched_folders[folder_path]['folder_name']}: {str(e)}")
+        
+        with ThreadPoolExecutor(max_workers=max(1, self.load_workers)) as executor:
+            list(executor.map(load, folder_paths))
+        
+        elapsed = time.monotonic() - started
+        saved = sum(data.get('watches_saved', 0) for data in self.watched_folders.values())
+        self.log_message(f"Мониторинг запущен (исключенных каталогов без watch: {saved})")
+        if timings:
+            slowest = max(timings, key=lambda path: sum(timings[path]))
+            self.log_message(
+                f"Запуск: конфигурация {self.config_load_time * 1000:.0f} мс, папок {len(timings)} за {elapsed:.2f} с "
+                f"(потоков {self.load_workers}); открытие репозиториев {sum(t[0] for t in timings.values()):.2f} с, "
+                f"watch-и {sum(t[1] for t in timings.values()):.2f} с суммарно; "
+                f"самая медленная: {self.watched_folders[slowest]['folder_name']} {sum(timings[slowest]):.2f} с")
+        self.loaded.set()
+        
+        if self.share_objects_enabled:
+            self.share_all_objects()
+        else:
+            self.dissociate_all_objects()
+
+    def wait_until_loaded(self, timeout=None):
+        return self.loaded.wait(timeout)
+
+    def is_idle(self):
+        """Нет накопленных событий, проверок рабочих копий и отложенных перестроек watch-ей"""
+        with self.layout_lock:
+            if self.layout_timers:
+                return False
+        return self.aggregator.get_stats()['pending_folders'] == 0 and self.status_engine.is_idle()
+
+    def wait_until_idle(self, timeout=None, settle=0.2):
+        """Дождаться, пока ядро простаивает settle секунд подряд; False - не дождались за timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        idle_since = None
+        while True:
+            now = time.monotonic()
+            if not self.is_idle():
+                idle_since = None
+            elif idle_since is None:
+                idle_since = now
+            elif now - idle_since >= settle:
+                return True
+            if deadline is not None and now >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def shutdown(self):
+        if self.observer.is_alive():
+            self.observer.stop()
+            self.observer.join()
+        self.poller.stop()
+        self.auto_commit.stop()
+        self.aggregator.stop()
+        self.status_engine.stop()
+        self.metrics_exporter.stop()
+        self.fsmonitor.stop()
+        self.git_workers.close_all()
+        
+        self.config_store.stop()
+
+    def load_config(self):
+        if os.path.exists(self.config_file):
+            try:
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                    self.watched_folders = FolderRegistry(config.get('watched_folders', {}))
+                    self.debounce_seconds = config.get('debounce_seconds', 1.0)
+                    self.commit_workers = config.get('commit_workers', 4)
+                    self.push_per_remote = config.get('push_per_remote', 2)
+                    self.branch_cache_ttl = config.get('branch_cache_ttl', 300)
+                    self.load_workers = config.get('load_workers', 8)
+                    self.share_objects_enabled = config.get('share_objects', False)
+                    self.fsmonitor_enabled = config.get('fsmonitor', True)
+                    self.polling_settings.update(config.get('polling') or {})
+                    self.metrics_settings.update(config.get('metrics') or {})
+                    self.log_settings.update(config.get('log') or {})
+                    
+                    for folder_path, data in self.watched_folders.items():
+                        # Репозитории открываются в фоне при start_monitoring (load_folders)
+                        data['repo'] = None
+                        data['loading'] = True
+                        # Устанавливаем ветку по умолчанию если не указана
+                        if 'branch' not in data:
+                            data['branch'] = 'main'
+            except Exception as e:
+                self.watched_folders = FolderRegistry()
+                self.log_message(f"Ошибка загрузки конфигурации: {str(e)}")
+
+    def save_config(self):
+        """Отметить изменение конфигурации; файл запишется в фоне (ConfigStore)"""
+        self.config_store.mark_dirty()
+
+    def build_config(self):
+        config = {
+            'debounce_seconds': self.debounce_seconds,
+            'commit_workers': self.commit_workers,
+            'push_per_remote': self.push_per_remote,
+            'branch_cache_ttl': self.branch_cache_ttl,
+            'load_workers': self.load_workers,
+            'share_objects': self.share_objects_enabled,
+            'fsmonitor': self.fsmonitor_enabled,
+            'polling': self.polling_settings,
+            'metrics': self.metrics_settings,
+            'log': self.log_settings,
+            'watched_folders': {}
+        }
+        
+        for folder_path, data in list(self.watched_folders.items()):
+            config['watched_folders'][folder_path] = {
+                'repo_path': data['repo_path'],
+                'folder_name': data['folder_name'],
+                'remote_url': data.get('remote_url', ''),
+                'branch': data.get('branch', 'main'),
+                'auto_push': data.get('auto_push', True),
+                'exclude': data.get('exclude', []),
+                'watch_mode': data.get('watch_mode', 'auto'),
+                'auto_commit': AutoCommitScheduler.get_policy(data),
+                'changes': data['changes']
+            }
+        return config
+
+    def load_update_state(self):
+        try:
+            with open(os.path.join(self.install_dir, self.UPDATE_STATE_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_update_state(self, state):
+        path = os.path.join(self.install_dir, self.UPDATE_STATE_FILE)
+        try:
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            self.log_message(f"Не удалось сохранить состояние обновлений: {str(e)}")
+
+    def update_tip(self):
+        """Коммит ветки обновлений через ls-remote (без скачивания объектов)"""
+        with self.metrics.timer('update_probe'):
+            output = Git().ls_remote(self.UPDATE_REPO_URL, f"refs/heads/{self.UPDATE_BRANCH}")
+        if not output.strip():
+            raise RuntimeError(f"Ветка {self.UPDATE_BRANCH} не найдена в {self.UPDATE_REPO_URL}")
+        return output.split()[0]
+
+    def raw_update_url(self, tip, rel_path):
+        """URL файла коммита tip на raw.githubusercontent.com; None, если remote не GitHub"""
+        match = re.search(r'github\.com[/:]([^/]+)/([^/]+?)(?:\.git)?/?$', self.UPDATE_REPO_URL)
+        if not match:
+            return None
+        # Адрес по хэшу коммита неизменяем, повторно он запрашивается только при новом tip
+        return f"https://raw.githubusercontent.com/{match.group(1)}/{match.group(2)}/{tip}/{rel_path}"
+
+    def read_remote_version(self, tip):
+        """version.txt коммита tip; None, если remote не GitHub или файла нет"""
+        url = self.raw_update_url(tip, self.VERSION_FILE)
+        if url is None:
+            return None
+        response = self.github.session.get(url, timeout=10)
+        if response.status_code != 200:
+            return None
+        return response.text.strip()
+
+    def probe_update(self):
+        """Последняя версия программы (None - файл версии не найден) без клонирования.
+        
+        Пока коммит ветки обновлений не изменился, версия берется из update_state.json.
+        """
+        self.log_message("Проверка обновлений...")
+        tip = self.update_tip()
+        
+        state = self.load_update_state()
+        if state.get('tip') == tip and 'version' in state:
+            return state['version']
+        
+        version = self.read_remote_version(tip)
+        if version is None:
+            # raw недоступен: читаем версию из загруженного обновления, оно пригодится для установки
+            version_path = os.path.join(self.download_update(tip), self.VERSION_FILE)
+            if os.path.exists(version_path):
+                with open(version_path, 'r', encoding='utf-8') as f:
+                    version = f.read().strip()
+        
+        self.save_update_state({'tip': tip, 'version': version, 'checked_at': time.time()})
+        return version
+
+    def download_update(self, tip=None):
+        """Скачать обновление (shallow clone); уже загруженный коммит tip используется повторно"""
+        temp_dir = os.path.join(self.install_dir, "temp_update_check")
+        if os.path.exists(temp_dir):
+            try:
+                if tip is not None and Repo(temp_dir).head.commit.hexsha == tip:
+                    return temp_dir
+            except Exception:
+                pass
+            shutil.rmtree(temp_dir)
+        
+        # Клонируем репозиторий обновлений
+        with self.metrics.timer('update_download'):
+            Repo.clone_from(self.UPDATE_REPO_URL, temp_dir, branch=self.UPDATE_BRANCH, depth=1)
+        return temp_dir
+
+    def discard_update(self, update_dir=None):
+        # Очищаем временную папку
+        shutil.rmtree(update_dir or os.path.join(self.install_dir, "temp_update_check"), ignore_errors=True)
+
+    def perform_self_update(self, new_version, tip=None):
+        """Дельта-обновление по манифесту: заменяются только измененные файлы; возвращает папку с backup.
+        
+        Файлы сначала скачиваются во временную папку, затем по одному атомарно (os.replace)
+        ставятся на место. Backup - жесткие ссылки только на замененные файлы; при ошибке
+        во время замены уже замененные файлы автоматически откатываются.
+        """
+        tip = tip or self.load_update_state().get('tip')
+        manifest = self.read_remote_manifest(tip) if tip else None
+        update_dir = None
+        if manifest is None:
+            # Манифеста релиза нет или он недоступен: строим его по загруженному обновлению
+            update_dir = self.download_update(tip)
+            manifest = self.build_manifest(update_dir)
+        for rel_path in manifest['files']:
+            self.check_update_path(rel_path)
+        
+        changed = [rel_path for rel_path, digest in sorted(manifest['files'].items())
+                   if not self.is_update_ignored(rel_path)
+                   and self.file_digest(os.path.join(self.install_dir, rel_path)) != digest]
+        
+        stage_dir = os.path.join(self.install_dir, "temp_update_stage")
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        try:
+            transferred = 0
+            for rel_path in changed:
+                staged_path = os.path.join(stage_dir, rel_path)
+                os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+                if update_dir is not None:
+                    shutil.copy2(os.path.join(update_dir, rel_path), staged_path)
+                else:
+                    self.download_release_file(tip, rel_path, staged_path)
+                if self.file_digest(staged_path) != manifest['files'][rel_path]:
+                    raise RuntimeError(f"Контрольная сумма не совпадает: {rel_path}")
+                transferred += os.path.getsize(staged_path)
+            
+            backup_dir = os.path.join(self.install_dir, f"backup_v{new_version}")
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            backup = {'from_version': self.CURRENT_VERSION, 'to_version': new_version,
+                      'created_at': time.time(), 'replaced': [], 'added': []}
+            
+            try:
+                for rel_path in changed:
+                    dst_path = os.path.join(self.install_dir, rel_path)
+                    if os.path.exists(dst_path):
+                        self.snapshot_file(dst_path, os.path.join(backup_dir, rel_path))
+                        backup['replaced'].append(rel_path)
+                    else:
+                        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                        backup['added'].append(rel_path)
+                    os.replace(os.path.join(stage_dir, rel_path), dst_path)
+            except Exception:
+                self.restore_backup(backup_dir, backup)
+                backup['rolled_back'] = True
+                raise
+            finally:
+                os.makedirs(backup_dir, exist_ok=True)
+                with open(os.path.join(backup_dir, self.BACKUP_MANIFEST), 'w', encoding='utf-8') as f:
+                    json.dump(backup, f, ensure_ascii=False, indent=2)
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            if update_dir is not None:
+                shutil.rmtree(update_dir, ignore_errors=True)
+        
+        self.log_message(f"Программа обновлена до версии {new_version}: "
+                         f"заменено файлов {len(changed)} из {len(manifest['files'])}, "
+                         f"загружено {transferred / 1024:.1f} КБ")
+        return backup_dir
+
+    def check_update_path(self, rel_path):
+        """Путь из манифеста должен вести внутрь папки программы: абсолютные пути и ../ отклоняются"""
+        normalized = os.path.normpath(rel_path) if rel_path else ''
+        if (not normalized or os.path.isabs(rel_path) or os.path.splitdrive(rel_path)[0]
+                or rel_path.startswith(('/', '\\')) or normalized == os.curdir
+                or normalized.split(os.sep)[0] == os.pardir):
+            raise ValueError(f"Недопустимый путь в манифесте обновления: {rel_path!r}")
+        root = os.path.abspath(self.install_dir)
+        if os.path.commonpath([root, os.path.abspath(os.path.join(root, normalized))]) != root:
+            raise ValueError(f"Недопустимый путь в манифесте обновления: {rel_path!r}")
+
+    def is_update_ignored(self, rel_path):
+        """Файлы, которые обновление не трогает (конфиги, кэши, backup, временные папки)"""
+        return any(fnmatch.fnmatch(part, pattern)
+                   for part in Path(rel_path).parts for pattern in self.UPDATE_IGNORE)
+
+    @staticmethod
+    def file_digest(path):
+        """sha256 файла (None, если файла нет)"""
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return None
+        return digest.hexdigest()
+
+    def build_manifest(self, root, version=None):
+        """Манифест релиза: {'version', 'files': {относительный путь: sha256}}"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root)
+            dirnames[:] = [name for name in dirnames
+                           if not self.is_update_ignored(os.path.normpath(os.path.join(rel_dir, name)))]
+            for name in filenames:
+                rel_path = Path(os.path.normpath(os.path.join(rel_dir, name))).as_posix()
+                if name != self.RELEASE_MANIFEST and not self.is_update_ignored(rel_path):
+                    files[rel_path] = self.file_digest(os.path.join(dirpath, name))
+        
+        if version is None:
+            version_path = os.path.join(root, self.VERSION_FILE)
+            if os.path.exists(version_path):
+                with open(version_path, 'r', encoding='utf-8') as f:
+                    version = f.read().strip()
+        return {'version': version, 'files': files}
+
+    def read_remote_manifest(self, tip):
+        url = self.raw_update_url(tip, self.RELEASE_MANIFEST)
+        if url is None:
+            return None
+        response = self.github.session.get(url, timeout=10)
+        if response.status_code != 200:
+            return None
+        return response.json()
+
+    def download_release_file(self, tip, rel_path, target_path):
+        with self.metrics.timer('update_file'):
+            response = self.github.session.get(self.raw_update_url(tip, rel_path), timeout=30, stream=True)
+            if response.status_code != 200:
+                raise RuntimeError(f"Не удалось загрузить {rel_path}: {response.status_code}")
+            with open(target_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+
+    @staticmethod
+    def snapshot_file(path, backup_path):
+        """Снимок файла в backup: жесткая ссылка (без копирования данных), иначе копия"""
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        try:
+            os.link(path, backup_path)
+        except OSError:
+            shutil.copy2(path, backup_path)
+
+    def restore_backup(self, backup_dir, backup):
+        """Вернуть файлы из backup на место (каждый файл - атомарный os.replace)"""
+        for rel_path in backup['replaced'] + backup['added']:
+            self.check_update_path(rel_path)
+        for rel_path in backup['replaced']:
+            dst_path = os.path.join(self.install_dir, rel_path)
+            temp_path = f"{dst_path}.rollback_tmp"
+            self.snapshot_file(os.path.join(backup_dir, rel_path), temp_path)
+            os.replace(temp_path, dst_path)
+        for rel_path in backup['added']:
+            try:
+                os.remove(os.path.join(self.install_dir, rel_path))
+            except FileNotFoundError:
+                pass
+
+    def list_backups(self):
+        """Backup обновлений, от новых к старым: [(папка, описание)]"""
+        backups = []
+        for name in os.listdir(self.install_dir):
+            manifest_path = os.path.join(self.install_dir, name, self.BACKUP_MANIFEST)
+            if name.startswith('backup_') and os.path.exists(manifest_path):
+                try:
+                    with open(manifest_path, 'r', encoding='utf-8') as f:
+                        backups.append((os.path.join(self.install_dir, name), json.load(f)))
+                except (OSError, ValueError):
+                    continue
+        backups.sort(key=lambda item: item[1].get('created_at', 0), reverse=True)
+        return backups
+
+    def rollback_update(self, backup_dir=None):
+        """Откат последнего (или указанного) обновления; возвращает версию, к которой выполнен откат"""
+        backups = [(path, backup) for path, backup in self.list_backups()
+                   if not backup.get('rolled_back') and (backup_dir is None or path == backup_dir)]
+        if not backups:
+            raise RuntimeError("Нет обновлений для отката")
+        
+        backup_dir, backup = backups[0]
+        self.restore_backup(backup_dir, backup)
+        backup['rolled_back'] = True
+        with open(os.path.join(backup_dir, self.BACKUP_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(backup, f, ensure_ascii=False, indent=2)
+        
+        self.log_message(f"Выполнен откат обновления {backup['to_version']} -> {backup['from_version']} "
+                         f"(файлов: {len(backup['replaced']) + len(backup['added'])})")
+        return backup['from_version']
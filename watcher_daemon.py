@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from watcher_core import WatcherEngine, LogFileSink
+
+logger = logging.getLogger("filehive")
+
+def setup_logging(log_file=None, json_lines=False):
+    """Лог в stdout и, если задан log_file, асинхронно в файл с ротацией; возвращает LogFileSink или None"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    
+    if not log_file:
+        return None
+    log_sink = LogFileSink(log_file, json_lines=json_lines)
+    logger.addHandler(log_sink.handler)
+    return log_sink
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="GitHub Auto-Commit Watcher без GUI")
+    parser.add_argument("--daemon", action="store_true", help="запуск без окна (tkinter не загружается)")
+    parser.add_argument("--config", default="watcher_config.json", help="файл конфигурации")
+    parser.add_argument("--log-file", help="дублировать лог в файл (с ротацией по размеру)")
+    parser.add_argument("--log-json", action="store_true", help="писать файл лога строками JSON")
+    parser.add_argument("--commit-interval", type=float, default=0,
+                        help="коммитить все измененные папки раз в N секунд (0 - не коммитить)")
+    parser.add_argument("--pull-on-start", action="store_true", help="обновить все папки с GitHub при запуске")
+    parser.add_argument("--self-update", action="store_true",
+                        help="проверить обновление программы при запуске и установить его")
+    parser.add_argument("--rollback", action="store_true", help="откатить последнее обновление программы и выйти")
+    parser.add_argument("--build-manifest", metavar="DIR",
+                        help="записать манифест релиза (manifest.json) для папки DIR и выйти")
+    return parser.parse_args(argv)
+
+def self_update(engine):
+    """Неинтерактивное самообновление; возвращает True, если программа обновлена"""
+    try:
+        latest_version = engine.probe_update()
+        if latest_version is None or latest_version == engine.CURRENT_VERSION:
+            logger.info("Установлена последняя версия программы")
+            return False
+        
+        backup_dir = engine.perform_self_update(latest_version)
+        logger.info(f"Backup сохранен в: {backup_dir}")
+        return True
+    except Exception as e:
+        logger.info(f"Ошибка обновления: {str(e)}")
+        return False
+
+def pull_all(engine):
+    for folder_path, data in list(engine.watched_folders.items()):
+        if not data.get('remote_url') or data.get('repo') is None:
+            continue
+        try:
+            engine.pull_folder(folder_path)
+        except Exception as e:
+            logger.info(f"Ошибка обновления {data['folder_name']}: {str(e)}")
+
+def main(argv=None):
+    started = time.monotonic()
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    log_sink = setup_logging(args.log_file, args.log_json)
+    try:
+        return run(args, started, log_sink)
+    finally:
+        if log_sink is not None:
+            log_sink.close()
+
+def run(args, started, log_sink=None):
+    engine = WatcherEngine(args.config, log=logger.info)
+    
+    if args.build_manifest:
+        manifest = engine.build_manifest(args.build_manifest)
+        with open(os.path.join(args.build_manifest, engine.RELEASE_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        logger.info(f"Манифест записан: файлов {len(manifest['files'])}, версия {manifest['version']}")
+        return 0
+    
+    if args.rollback:
+        try:
+            engine.rollback_update()
+        except Exception as e:
+            logger.info(f"Ошибка отката: {str(e)}")
+            return 1
+        return 0
+    
+    if args.self_update and self_update(engine):
+        logger.info("Перезапуск после обновления")
+        if log_sink is not None:
+            log_sink.close()
+        os.execl(sys.executable, sys.executable, *sys.argv)
+    
+    stop_event = threading.Event()
+    
+    def request_stop(signum, frame):
+        stop_event.set()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    
+    engine.start_monitoring()
+    if args.pull_on_start:
+        engine.wait_until_loaded()
+        pull_all(engine)
+    logger.info(f"Headless-режим запущен за {time.monotonic() - started:.2f} с, папок: {len(engine.watched_folders)}")
+    
+    next_commit = time.monotonic() + args.commit_interval
+    # Короткий таймаут ожидания, чтобы Ctrl+C срабатывал и в Windows
+    while not stop_event.wait(1.0):
+        if args.commit_interval and time.monotonic() >= next_commit:
+            dirty_folders = engine.dirty_folders()
+            if dirty_folders:
+                engine.run_batch_commit(dirty_folders)
+            next_commit = time.monotonic() + args.commit_interval
+    
+    logger.info("Остановка...")
+    engine.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())